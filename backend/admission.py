@@ -0,0 +1,308 @@
+"""Контроль допуска запросов к модели: token bucket по пользователю и общий.
+
+Каждый запрос, которому нужна модель, до обращения к OpenRouter проходит
+четыре корзины: запросы и оценка токенов (промпт + ответ) пользователя и
+те же две корзины на весь сервис. Пустая корзина - запрос ждет в очереди
+(не дольше ADMISSION_MAX_WAIT для чата и ADMISSION_DOCUMENT_MAX_WAIT для
+документов) или сразу получает отказ (-> 429 с Retry-After), если корзины
+наполнятся позже, чем он готов ждать, или очередь уже длиной
+ADMISSION_QUEUE_SIZE. Так один пользователь или зациклившийся клиент не
+выбирает общую квоту OpenRouter и не вызывает 429 у всех остальных.
+
+Очередь с приоритетами: чат (0) впереди анализа документов (1). Когда не
+хватает общей квоты, следующий по порядку ждет, а остальные за ним не
+пропускаются; когда не хватает квоты пользователя - ждет только он.
+
+Пользователь - IP клиента. ADMISSION_USER_HEADER (по умолчанию выключен)
+берет его из заголовка, например X-User-Id: включать только за прокси,
+который сам ставит этот заголовок и вырезает его из запросов клиентов,
+иначе клиент подставит любой id и обойдет лимит пользователя.
+
+Состояние корзин - в памяти процесса; ADMISSION_BACKEND=sqlite делит его
+между воркерами serve.py через локальный SQLite файл (очередь у каждого
+воркера своя, лимиты общие).
+"""
+import bisect
+import itertools
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from logs import get_logger
+from metrics import ADMISSION_DECISIONS, ADMISSION_WAIT_SECONDS
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") == "1"
+ADMISSION_BACKEND = os.getenv("ADMISSION_BACKEND", "memory")  # memory | sqlite
+ADMISSION_PATH = os.getenv("ADMISSION_PATH", "admission.sqlite3")
+ADMISSION_USER_RPS = float(os.getenv("ADMISSION_USER_RPS", "0.5"))
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "10"))
+ADMISSION_USER_TPM = float(os.getenv("ADMISSION_USER_TPM", "40000"))
+ADMISSION_GLOBAL_RPS = float(os.getenv("ADMISSION_GLOBAL_RPS", "10"))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", "40"))
+ADMISSION_GLOBAL_TPM = float(os.getenv("ADMISSION_GLOBAL_TPM", "400000"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "5"))
+ADMISSION_DOCUMENT_MAX_WAIT = float(os.getenv("ADMISSION_DOCUMENT_MAX_WAIT", "15"))
+ADMISSION_USER_HEADER = os.getenv("ADMISSION_USER_HEADER", "")  # пусто - пользователь по IP
+
+PRIORITIES = {"chat": 0, "document": 1}
+PRUNE_EVERY = 1000  # решений между чистками полных (неотличимых от новых) корзин
+
+log = get_logger("admission")
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: reason - user_limit / global_limit / queue_full / timeout"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Запрос не допущен ({reason}), повторить через {retry_after} с")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _refill(level, updated_at, rate, burst, now):
+    return min(burst, level + max(0.0, now - updated_at) * rate)
+
+
+def _plan(state, buckets, now):
+    """(ожидание в секундах, корзина, которой не хватает) для набора корзин"""
+    wait, short = 0.0, None
+    for key, rate, burst, amount in buckets:
+        level = _refill(*state[key], rate, burst, now) if key in state else burst
+        if level < amount:
+            need = (amount - level) / rate
+            if need > wait:
+                wait, short = need, key
+    return wait, short
+
+
+class MemoryBuckets:
+    """Корзины в памяти процесса"""
+
+    def __init__(self):
+        self._state = {}  # key -> (уровень, время обновления)
+        self._rates = {}  # key -> (rate, burst): для чистки
+        self._lock = threading.Lock()
+        self._decisions = 0
+
+    def take(self, buckets):
+        """Списывает amount из всех корзин сразу или ни из одной; возвращает (ожидание, корзина)"""
+        with self._lock:
+            now = time.monotonic()
+            wait, short = _plan(self._state, buckets, now)
+            if short is None:
+                for key, rate, burst, amount in buckets:
+                    level = _refill(*self._state[key], rate, burst, now) if key in self._state else burst
+                    self._state[key] = (level - amount, now)
+                    self._rates[key] = (rate, burst)
+            self._decisions += 1
+            if self._decisions % PRUNE_EVERY == 0:
+                self._prune(now)
+            return wait, short
+
+    def _prune(self, now):
+        for key, (level, updated_at) in list(self._state.items()):
+            rate, burst = self._rates[key]
+            if _refill(level, updated_at, rate, burst, now) >= burst:
+                del self._state[key], self._rates[key]
+
+    def size(self):
+        with self._lock:
+            return len(self._state)
+
+    def close(self):
+        pass
+
+
+class SqliteBuckets:
+    """Корзины в локальном SQLite файле, общие для нескольких процессов"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._decisions = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS admission_buckets (
+                key TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                rate REAL NOT NULL,
+                burst REAL NOT NULL)""")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def take(self, buckets):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")  # чтение и списание - одной транзакцией для всех процессов
+        try:
+            now = time.time()
+            keys = [bucket[0] for bucket in buckets]
+            rows = conn.execute(f"SELECT key, level, updated_at FROM admission_buckets WHERE key IN "
+                                f"({','.join('?' * len(keys))})", keys).fetchall()
+            state = {key: (level, updated_at) for key, level, updated_at in rows}
+            wait, short = _plan(state, buckets, now)
+            if short is None:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO admission_buckets (key, level, updated_at, rate, burst) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(key, (_refill(*state[key], rate, burst, now) if key in state else burst) - amount, now,
+                      rate, burst) for key, rate, burst, amount in buckets])
+            self._decisions += 1
+            if self._decisions % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM admission_buckets WHERE level + (? - updated_at) * rate >= burst", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait, short
+
+    def size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM admission_buckets").fetchone()[0]
+
+    def close(self):
+        """Закрывает соединение текущего потока (мастер serve.py - перед fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "buckets", "wait", "short", "admitted")
+
+    def __init__(self, priority, seq, buckets):
+        self.priority = priority
+        self.seq = seq
+        self.buckets = buckets
+        self.wait = 0.0
+        self.short = None
+        self.admitted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """Допуск запросов по корзинам (backend: MemoryBuckets / SqliteBuckets) с очередью по приоритетам.
+
+    Лимит <= 0 отключает соответствующую корзину.
+    """
+
+    def __init__(self, backend, user_rps=ADMISSION_USER_RPS, user_burst=ADMISSION_USER_BURST,
+                 user_tpm=ADMISSION_USER_TPM, global_rps=ADMISSION_GLOBAL_RPS, global_burst=ADMISSION_GLOBAL_BURST,
+                 global_tpm=ADMISSION_GLOBAL_TPM, queue_size=ADMISSION_QUEUE_SIZE,
+                 max_wait=None):
+        self.backend = backend
+        self.limits = {"user_rps": user_rps, "user_burst": user_burst, "user_tpm": user_tpm,
+                       "global_rps": global_rps, "global_burst": global_burst, "global_tpm": global_tpm}
+        self.queue_size = queue_size
+        self.max_wait = max_wait or {"chat": ADMISSION_MAX_WAIT, "document": ADMISSION_DOCUMENT_MAX_WAIT}
+        self._queue = []  # _Waiter, по (приоритет, порядок прихода)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._stats = {"admitted": 0, "queued": 0, "rejected": {}}
+
+    def _buckets(self, user, tokens):
+        """(ключ, скорость в секунду, емкость, списать) для корзин запроса"""
+        limits = self.limits
+        buckets = []
+        for key, rate, burst, amount in (
+                ("global:requests", limits["global_rps"], limits["global_burst"], 1),
+                ("global:tokens", limits["global_tpm"] / 60, limits["global_tpm"], tokens),
+                (f"user:{user}:requests", limits["user_rps"], limits["user_burst"], 1),
+                (f"user:{user}:tokens", limits["user_tpm"] / 60, limits["user_tpm"], tokens)):
+            if rate > 0 and burst > 0:
+                # Запрос дороже всей корзины иначе не прошел бы никогда - он выбирает ее целиком
+                buckets.append((key, rate, max(burst, 1), min(amount, max(burst, 1))))
+        return buckets
+
+    def _dispatch(self):
+        """Допускает ожидающих по порядку, пока хватает корзин; возвращает время до следующей проверки"""
+        next_check = math.inf
+        admitted = False
+        for waiter in list(self._queue):
+            waiter.wait, waiter.short = self.backend.take(waiter.buckets)
+            if waiter.short is None:
+                waiter.admitted = admitted = True
+                self._queue.remove(waiter)
+                continue
+            next_check = min(next_check, waiter.wait)
+            if waiter.short.startswith("global:"):
+                break  # Общая квота - сначала тому, кто впереди; остальные не обгоняют его
+        if admitted:
+            self._cond.notify_all()
+        return next_check
+
+    def admit(self, user, tokens, priority="chat", timeout=None):
+        """Ждет допуска; возвращает время ожидания в секундах или бросает AdmissionRejected.
+
+        timeout - сколько запрос готов ждать (остаток его дедлайна); не больше max_wait приоритета.
+        """
+        max_wait = self.max_wait.get(priority, ADMISSION_MAX_WAIT)
+        if timeout is not None:
+            max_wait = min(max_wait, timeout)
+        waiter = _Waiter(PRIORITIES.get(priority, len(PRIORITIES)), next(self._seq), self._buckets(user, tokens))
+        start = time.monotonic()
+        with self._cond:
+            bisect.insort(self._queue, waiter)
+            next_check = self._dispatch()
+            if not waiter.admitted:
+                # Быстрый отказ: корзины не наполнятся вовремя или очередь уже полна
+                if waiter.wait > max_wait:
+                    self._reject(waiter, priority, "global_limit" if waiter.short.startswith("global:")
+                                 else "user_limit", waiter.wait)
+                if len(self._queue) > self.queue_size:
+                    self._reject(waiter, priority, "queue_full", max(waiter.wait, 1))
+                self._stats["queued"] += 1
+            deadline = start + max_wait
+            while not waiter.admitted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject(waiter, priority, "timeout", max(waiter.wait, 1))
+                self._cond.wait(max(0.001, min(remaining, next_check)))
+                if not waiter.admitted:
+                    next_check = self._dispatch()
+            self._stats["admitted"] += 1
+        waited = time.monotonic() - start
+        ADMISSION_DECISIONS.inc(priority=priority, outcome="admitted")
+        ADMISSION_WAIT_SECONDS.observe(waited, priority=priority)
+        return waited
+
+    def _reject(self, waiter, priority, reason, wait):
+        """Убирает запрос из очереди и бросает AdmissionRejected (вызывать под self._cond)"""
+        self._queue.remove(waiter)
+        self._stats["rejected"][reason] = self._stats["rejected"].get(reason, 0) + 1
+        ADMISSION_DECISIONS.inc(priority=priority, outcome=reason)
+        log.debug("Запрос не допущен", reason=reason, priority=priority, bucket=waiter.short, wait=round(wait, 2))
+        raise AdmissionRejected(reason, max(1, math.ceil(wait)))
+
+    def queue_length(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            stats = {"admitted": self._stats["admitted"], "queued": self._stats["queued"],
+                     "rejected": dict(self._stats["rejected"]), "waiting": len(self._queue)}
+        return dict(stats, buckets=self.backend.size(), limits=self.limits, queue_size=self.queue_size,
+                    max_wait=self.max_wait, backend=type(self.backend).__name__)
+
+    def close(self):
+        self.backend.close()
+
+
+def create_admission_controller():
+    """Создает контроль допуска по настройкам из окружения (None - выключен)"""
+    if not ADMISSION_CONTROL:
+        return None
+    if ADMISSION_BACKEND == "sqlite":
+        return AdmissionController(SqliteBuckets(ADMISSION_PATH))
+    return AdmissionController(MemoryBuckets())
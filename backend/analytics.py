@@ -0,0 +1,337 @@
+"""Аналитика для страницы Analytics: векторные сводки NumPy по колонкам транзакций.
+
+Журнал (ledger.py) копируется в колонки - массивы сумм, месяцев и кодов
+категорий/названий. По ним np.bincount накапливает матрицы "месяц x
+категория" и суммы по получателям, из которых без циклов по транзакциям
+выводятся:
+- суммы по категориям (доход, расход, количество);
+- помесячные доход/расход/итог и скользящее среднее расходов;
+- топ-N получателей по расходам;
+- отклонение от бюджета по категориям за месяц.
+
+Новые транзакции дочитываются из журнала по id и добавляются в матрицы
+только хвостом, а готовые ответы кешируются на версию данных.
+"""
+import json
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ledger import DEFAULT_USER
+from logs import get_logger
+
+log = get_logger("analytics")
+if np is None:
+    log.warning("numpy не установлен. Аналитика (/api/analytics) недоступна.")
+
+ANALYTICS_TOP_N = int(os.getenv("ANALYTICS_TOP_N", "10"))
+ANALYTICS_ROLLING_WINDOW = int(os.getenv("ANALYTICS_ROLLING_WINDOW", "3"))  # месяцев
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "32"))
+# Месячные бюджеты по категориям, JSON: {"food": 400, "shopping": 800}.
+# Для категорий без бюджета ориентир - среднее за предыдущие ANALYTICS_ROLLING_WINDOW месяцев.
+ANALYTICS_BUDGETS = json.loads(os.getenv("ANALYTICS_BUDGETS", "{}"))
+
+
+class AnalyticsUnavailable(RuntimeError):
+    """numpy не установлен"""
+
+
+def month_label(index):
+    """Номер месяца (год * 12 + месяц - 1) -> "2025-11" """
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def parse_month(value):
+    """ "2025-11" -> номер месяца"""
+    try:
+        year, month = value.split("-")
+        year, month = int(year), int(month)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Месяц в формате ГГГГ-ММ, получено: {value!r}")
+    if not 1 <= month <= 12:
+        raise ValueError(f"Месяц в формате ГГГГ-ММ, получено: {value!r}")
+    return year * 12 + month - 1
+
+
+class _Codes:
+    """Словарь строка -> код для категориальных колонок"""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def encode(self, items):
+        codes = np.empty(len(items), dtype=np.int32)
+        index = self.index
+        for i, item in enumerate(items):
+            code = index.get(item)
+            if code is None:
+                code = index[item] = len(self.values)
+                self.values.append(item)
+            codes[i] = code
+        return codes
+
+
+class Columns:
+    """Колоночная копия транзакций с дозаписью (емкость растет удвоением)"""
+
+    FIELDS = (("amount", "float64"), ("month", "int32"), ("category", "int32"), ("name", "int32"))
+
+    def __init__(self, capacity=1024):
+        if np is None:
+            raise AnalyticsUnavailable("numpy не установлен")
+        self.size = 0
+        self.last_id = 0
+        self.categories = _Codes()
+        self.names = _Codes()
+        self._arrays = {field: np.empty(capacity, dtype=dtype) for field, dtype in self.FIELDS}
+
+    def __getattr__(self, field):
+        arrays = self.__dict__.get("_arrays")
+        if arrays is None or field not in arrays:
+            raise AttributeError(field)
+        return arrays[field][:self.size]
+
+    def extend(self, ids, amounts, dates, categories, names):
+        """Дописывает транзакции; dates - ISO строки "2025-11-12" """
+        count = len(ids)
+        if not count:
+            return
+        needed = self.size + count
+        capacity = len(self._arrays["amount"])
+        if needed > capacity:
+            while capacity < needed:
+                capacity *= 2
+            for field, array in self._arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                self._arrays[field] = grown
+
+        months = np.array(dates, dtype="datetime64[M]").astype(np.int64) + 1970 * 12
+        new = {
+            "amount": np.asarray(amounts, dtype=np.float64),
+            "month": months.astype(np.int32),
+            "category": self.categories.encode(categories),
+            "name": self.names.encode(names),
+        }
+        for field, values in new.items():
+            self._arrays[field][self.size:needed] = values
+        self.size = needed
+        self.last_id = max(self.last_id, int(ids[-1]))
+
+
+def rolling_mean(values, window):
+    """Скользящее среднее по окну window (для первых точек - по доступным)"""
+    if not len(values):
+        return values
+    sums = np.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def _grow(array, shape):
+    """Копия 1D/2D массива, расширенная нулями до shape"""
+    if array.shape == tuple(shape):
+        return array
+    grown = np.zeros(shape, dtype=array.dtype)
+    grown[tuple(slice(0, size) for size in array.shape)] = array
+    return grown
+
+
+class Rollup:
+    """Накопленные суммы "месяц x категория" и по получателям.
+
+    Обновляется только хвостом новых транзакций (np.bincount по срезу
+    колонок), все сводки потом выводятся из этих небольших матриц.
+    """
+
+    def __init__(self):
+        self.rows = 0  # сколько строк колонок уже учтено
+        self.first_month = None
+        self.income = np.zeros((0, 0))  # [месяц, категория]
+        self.expenses = np.zeros((0, 0))
+        self.count = np.zeros((0, 0), dtype=np.int64)
+        self.name_expenses = np.zeros(0)
+        self.name_count = np.zeros(0, dtype=np.int64)
+
+    def update(self, columns):
+        """Учитывает строки columns[self.rows:]; возвращает False, если нужен полный пересчет"""
+        start = self.rows
+        if start == columns.size:
+            return True
+        amount = columns.amount[start:]
+        month = columns.month[start:]
+        category = columns.category[start:]
+        name = columns.name[start:]
+
+        if self.first_month is None:
+            self.first_month = int(month.min())
+        elif int(month.min()) < self.first_month:
+            # Транзакция задним числом раньше всей истории - проще пересчитать все
+            return False
+
+        n_months = max(self.income.shape[0], int(month.max()) - self.first_month + 1)
+        n_categories = len(columns.categories.values)
+        n_names = len(columns.names.values)
+        shape = (n_months, n_categories)
+        self.income = _grow(self.income, shape)
+        self.expenses = _grow(self.expenses, shape)
+        self.count = _grow(self.count, shape)
+        self.name_expenses = _grow(self.name_expenses, (n_names,))
+        self.name_count = _grow(self.name_count, (n_names,))
+
+        cell = (month - self.first_month).astype(np.int64) * n_categories + category
+        size = n_months * n_categories
+        income = np.where(amount > 0, amount, 0.0)
+        expenses = np.where(amount < 0, -amount, 0.0)
+        self.income += np.bincount(cell, weights=income, minlength=size).reshape(shape)
+        self.expenses += np.bincount(cell, weights=expenses, minlength=size).reshape(shape)
+        self.count += np.bincount(cell, minlength=size).reshape(shape)
+        self.name_expenses += np.bincount(name, weights=expenses, minlength=n_names)
+        self.name_count += np.bincount(name[amount < 0], minlength=n_names)
+        self.rows = columns.size
+        return True
+
+
+def compute_rollups(rollup, columns, top_n=ANALYTICS_TOP_N, window=ANALYTICS_ROLLING_WINDOW, month=None,
+                    budgets=None):
+    """Все сводки Analytics из накопленных матриц"""
+    budgets = ANALYTICS_BUDGETS if budgets is None else budgets
+    category_names = columns.categories.values
+    n_months = rollup.income.shape[0]
+    first_month = rollup.first_month or 0
+
+    # Категории
+    by_category_income = rollup.income.sum(axis=0)
+    by_category_expenses = rollup.expenses.sum(axis=0)
+    by_category_count = rollup.count.sum(axis=0)
+    order = np.argsort(-(by_category_income + by_category_expenses), kind="stable")
+    categories = [
+        {"category": category_names[i], "income": round(float(by_category_income[i]), 2),
+         "expenses": round(float(by_category_expenses[i]), 2), "count": int(by_category_count[i])}
+        for i in order if by_category_count[i]
+    ]
+
+    # Месяцы (непрерывный ряд от первого до последнего месяца) и скользящее среднее расходов
+    monthly_income = rollup.income.sum(axis=1)
+    monthly_expenses = rollup.expenses.sum(axis=1)
+    monthly_count = rollup.count.sum(axis=1)
+    rolling = rolling_mean(monthly_expenses, window)
+    months = [
+        {"month": month_label(first_month + i), "income": round(float(monthly_income[i]), 2),
+         "expenses": round(float(monthly_expenses[i]), 2),
+         "net": round(float(monthly_income[i] - monthly_expenses[i]), 2),
+         "count": int(monthly_count[i]), "rolling_expenses": round(float(rolling[i]), 2)}
+        for i in range(n_months)
+    ]
+
+    # Топ получателей по расходам
+    by_name = rollup.name_expenses
+    n_names = len(by_name)
+    top = np.argpartition(-by_name, min(top_n, n_names) - 1)[:top_n] if n_names else np.zeros(0, dtype=np.int64)
+    top = top[np.argsort(-by_name[top], kind="stable")]
+    merchants = [
+        {"name": columns.names.values[i], "expenses": round(float(by_name[i]), 2),
+         "count": int(rollup.name_count[i])}
+        for i in top if by_name[i] > 0
+    ]
+
+    # Бюджет: расходы за месяц по категориям против бюджета (или среднего за прошлые месяцы)
+    target = parse_month(month) - first_month if month else n_months - 1
+    variance = []
+    if n_months:
+        spent = rollup.expenses[target] if 0 <= target < n_months else np.zeros(len(category_names))
+        past = rollup.expenses[max(0, target - window):max(0, min(target, n_months))]
+        baseline = past.sum(axis=0) / len(past) if len(past) else np.zeros(len(category_names))
+        for i, category in enumerate(category_names):
+            budget = budgets.get(category)
+            source = "budget"
+            if budget is None:
+                budget, source = float(baseline[i]), "average"
+            if not budget and not spent[i]:
+                continue
+            variance.append({
+                "category": category, "spent": round(float(spent[i]), 2), "budget": round(float(budget), 2),
+                "variance": round(float(spent[i] - budget), 2), "budget_source": source,
+            })
+        variance.sort(key=lambda item: -item["variance"])
+
+    total_income = float(monthly_income.sum())
+    total_expenses = float(monthly_expenses.sum())
+    return {
+        "totals": {"income": round(total_income, 2), "expenses": round(total_expenses, 2),
+                   "net": round(total_income - total_expenses, 2), "count": int(monthly_count.sum())},
+        "categories": categories,
+        "months": months,
+        "rolling_window": window,
+        "top_merchants": merchants,
+        "budget": {"month": month_label(first_month + target) if n_months else None, "categories": variance},
+    }
+
+
+class AnalyticsEngine:
+    """Колоночная копия журнала, дочитываемая по id, и кеш сводок по версии данных"""
+
+    def __init__(self, ledger, cache_size=ANALYTICS_CACHE_SIZE):
+        self.ledger = ledger
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._columns = {}  # user_id -> Columns
+        self._rollups = {}  # user_id -> Rollup
+        self._cache = {}  # (user_id, version, параметры) -> сводки
+        self.hits = 0
+        self.misses = 0
+        self.rows_loaded = 0
+
+    def _refresh(self, user_id):
+        """Дочитывает из журнала транзакции, появившиеся после последней загруженной"""
+        columns = self._columns.get(user_id)
+        if columns is None:
+            columns = self._columns[user_id] = Columns()
+        rows = self.ledger.rows_after(columns.last_id, user_id)
+        if rows:
+            ids, amounts, dates, categories, names = zip(*rows)
+            columns.extend(ids, amounts, dates, categories, names)
+            self.rows_loaded += len(rows)
+        return columns
+
+    def rollups(self, user_id=DEFAULT_USER, top_n=ANALYTICS_TOP_N, window=ANALYTICS_ROLLING_WINDOW, month=None):
+        """Сводки Analytics (из кеша, если данные не менялись)"""
+        if np is None:
+            raise AnalyticsUnavailable("numpy не установлен")
+        version = self.ledger.version(user_id)
+        key = (user_id, version, top_n, window, month)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            columns = self._refresh(user_id)
+            rollup = self._rollups.get(user_id)
+            if rollup is None or not rollup.update(columns):
+                rollup = self._rollups[user_id] = Rollup()
+                rollup.update(columns)
+            result = compute_rollups(rollup, columns, top_n=top_n, window=window, month=month)
+            result["version"] = version
+            # Сводки по старым версиям данных этого пользователя больше не нужны
+            self._cache = {k: v for k, v in self._cache.items() if k[0] != user_id or k[1] == version}
+            if len(self._cache) >= self.cache_size:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = result
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "available": np is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rows_loaded": self.rows_loaded,
+                "columns": {user: columns.size for user, columns in self._columns.items()},
+            }
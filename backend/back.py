@@ -1,38 +1,70 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
 import os
-import requests
-from dotenv import load_dotenv
+import re
+import json
+import httpx
 import time
-import base64
+import math
+from functools import lru_cache
+
+# Переменные окружения из .env - до импорта модулей ниже: они читают настройки при импорте
 try:
-    import PyPDF2
-except ImportError:
-    # Если PyPDF2 не установлен, пробуем pypdf
-    try:
-        import pypdf as PyPDF2
-    except ImportError:
-        print("[WARNING] PyPDF2 не установлен. Анализ PDF недоступен.")
-        PyPDF2 = None
+    from dotenv import load_dotenv
+except ImportError:  # python-dotenv нужен только для .env при разработке
+    load_dotenv = None
+if load_dotenv is not None:
+    load_dotenv()
 
-from io import BytesIO
+from fastpath import FastPathEngine
+from navigation import check_navigation_command, extract_navigation_from_response
+from prompts import APP_STRUCTURE, estimate_tokens, prompt_templates
+from context import CONTEXT_TOKEN_BUDGET, FinancialContextBuilder
+from ledger import Ledger, LedgerError
+from httpcache import compress_response, conditional_response, make_etag
+from analytics import (ANALYTICS_ROLLING_WINDOW, ANALYTICS_TOP_N, AnalyticsEngine, AnalyticsUnavailable,
+                       parse_month)
+from indicators import STOCKS_DATA_PATH, IndicatorEngine, IndicatorsUnavailable
+from documents import (DOCUMENT_CHAR_BUDGET, DOCUMENT_TOKEN_BUDGET, DocumentExtractor, ExtractionError,
+                       load_pdf_backend)
+from summarize import (ANALYSIS_MODES, DOCUMENT_ANALYSIS_MODE, DOCUMENT_CHUNK_TOKENS, DOCUMENT_DEADLINE,
+                       DOCUMENT_PROMPT_VERSION, ChunkFailed, DocumentSummarizer, analysis_prompt)
+from doccache import create_document_cache
+from jobs import FINISHED_STATUSES, JobQueue, QueueFull
+from uploads import (MAX_DOCUMENT_BYTES, SpoolingRequest, UploadTooLarge, discard_upload, hash_upload,
+                     limit_document_upload, persist_upload)
+from cache import create_response_cache, make_cache_key, normalize_prompt
+from router import ModelRouter
+from singleflight import SingleFlight, TooManyWaiters, WaiterTimeout
+from sessions import SESSION_COMPACTION, SessionStore, compaction_prompt
+from admission import ADMISSION_USER_HEADER, AdmissionRejected, create_admission_controller
+from retry import Deadline, DeadlineExceeded, DEFAULT_RETRY_POLICY
+from upstream import upstream_client
+from logs import get_logger
+from logs import stats as log_stats
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import DOCUMENT_ANALYSIS_SECONDS, PROMPT_BUILD_SECONDS, REGISTRY, process_memory
 
-# Загружаем переменные окружения из .env файла
-load_dotenv()
+log = get_logger("back")
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest  # загрузки - во временный файл, а не в память
 CORS(app)
+# Большие JSON ответы сжимаются gzip/brotli
+app.after_request(compress_response)
 
 # OpenRouter API configuration
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 if not OPENROUTER_API_KEY:
-    print("[WARNING] OPENROUTER_API_KEY не задан. Добавьте его в .env для работы API.")
+    log.warning("OPENROUTER_API_KEY не задан. Добавьте его в .env для работы API.")
     OPENROUTER_API_KEY = None
 
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+# URL можно переопределить, например, на локальный stand-in сервер для тестов
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
 
-# Данные пользователя (в реальном приложении это должно браться из БД)
+# Начальные данные пользователя - ими заполняется пустой журнал (ledger.py)
 USER_DATA = {
     "balance": 1520.30,
     "currency": "zł",
@@ -46,408 +78,696 @@ USER_DATA = {
     ]
 }
 
+# Список моделей в порядке приоритета (от лучших к резервным)
+OPENROUTER_MODELS = [
+    "openai/gpt-4o-mini",  # Самая стабильная, платная но дешевая
+    "google/gemini-flash-1.5",  # Бесплатная, быстрая
+    "mistralai/mistral-7b-instruct:free",
+    "microsoft/phi-3-mini-128k-instruct:free",
+    "qwen/qwen-2-7b-instruct:free"
+]
+
+# Роутер выбирает лучшую здоровую модель по задержкам и ошибкам
+model_router = ModelRouter(OPENROUTER_MODELS)
+
 # Получаем список доступных моделей при запуске
 def get_available_model():
     """Получает модель из OpenRouter с fallback механизмом"""
-    # Список моделей в порядке приоритета (от лучших к резервным)
-    models = [
-        "openai/gpt-4o-mini",  # Самая стабильная, платная но дешевая
-        "google/gemini-flash-1.5",  # Бесплатная, быстрая
-        "mistralai/mistral-7b-instruct:free",
-        "microsoft/phi-3-mini-128k-instruct:free",
-        "qwen/qwen-2-7b-instruct:free"
-    ]
-    
-    model = models[0]  # По умолчанию первая
-    print(f"[INFO] Используем модель: {model} (OpenRouter)")
+    model = model_router.choose()  # При старте статистики нет - первая по приоритету
+    log.info("Используем модель (OpenRouter)", model=model)
     return model
 
-def get_financial_context():
-    """Формирует контекст с информацией о финансах пользователя"""
-    total_income = sum(t['amount'] for t in USER_DATA['transactions'] if t['amount'] > 0)
-    total_expenses = sum(abs(t['amount']) for t in USER_DATA['transactions'] if t['amount'] < 0)
-    
-    context = f"""
-=== USER'S FINANCIAL DATA ===
-Current Balance: {USER_DATA['balance']} {USER_DATA['currency']}
-Card Number: {USER_DATA['card_number']}
-Total Income: {total_income} {USER_DATA['currency']}
-Total Expenses: {total_expenses} {USER_DATA['currency']}
-Net Result: {total_income - total_expenses} {USER_DATA['currency']}
+# Журнал транзакций с инкрементальными агрегатами (SQLite)
+ledger = Ledger()
+if ledger.seed(USER_DATA):
+    log.info("Журнал транзакций создан", path=ledger.path)
 
-=== RECENT TRANSACTIONS ===
-"""
-    
-    for t in USER_DATA['transactions']:
-        symbol = "+" if t['amount'] > 0 else "-"
-        context += f"- [{t['date']}] {t['name']}: {symbol}{abs(t['amount'])} {USER_DATA['currency']} (category: {t['category']})\n"
-    
-    return context
+# Контекст промпта: агрегаты журнала + транзакции под вопрос
+context_builder = FinancialContextBuilder(ledger)
+
+# Сводки Analytics по колоночной копии журнала (NumPy)
+analytics_engine = AnalyticsEngine(ledger)
+
+# Индикаторы по ценам акций для страницы Stocks
+indicator_engine = IndicatorEngine()
+if STOCKS_DATA_PATH and indicator_engine.available:
+    try:
+        log.info("Загружены ряды цен", tickers=len(indicator_engine.load_file(STOCKS_DATA_PATH)),
+                 path=STOCKS_DATA_PATH)
+    except (OSError, ValueError, KeyError) as e:
+        log.warning("Не удалось загрузить ряды цен", path=STOCKS_DATA_PATH, error=e)
+
+def get_data_version():
+    """Версия финансовых данных: меняется при каждой записи в журнал (и раз в сутки - в промпте есть дата)"""
+    return f"{ledger.version()}:{datetime.now().strftime('%Y-%m-%d')}"
+
+def get_financial_context(query=None):
+    """Формирует контекст с информацией о финансах пользователя.
+
+    Агрегаты есть всегда, транзакции - только относящиеся к вопросу query
+    (или последние), в пределах бюджета токенов CONTEXT_TOKEN_BUDGET.
+    """
+    return context_builder.build(query)
 
 def get_app_structure():
     """Формирует контекст со структурой приложения и его функциями"""
-    structure = """
-=== BANKING APP STRUCTURE & FEATURES ===
-
-📱 MAIN SECTIONS (Tabs/Pages):
-
-1. HOME / DASHBOARD
-   - Shows current balance and card number
-   - Displays quick financial summary
-   - Recent transactions preview (last 5)
-   - Quick actions buttons
-
-2. TRANSACTIONS / HISTORY
-   - Full list of all transactions
-   - Each transaction shows:
-     * Transaction name
-     * Amount (+ for income, - for expenses)
-     * Date
-     * Category (salary, groceries, health, food, gift, etc.)
-   - Filterable by type (income/expense)
-   - Sortable by date
-
-3. ANALYTICS / STATISTICS
-   - Visual charts and graphs
-   - Spending by category breakdown
-   - Income vs Expenses comparison
-   - Monthly trends
-   - Budget insights
-
-4. AI ASSISTANT (Current Chat)
-   - Natural language financial advisor
-   - Can answer questions about user's finances
-   - Provides budget recommendations
-   - Helps with financial planning
-   - Access to all user's financial data
-   - **NEW**: Can analyze documents (PDFs, contracts, agreements)
-
-5. SETTINGS / PROFILE
-   - Account settings
-   - Notification preferences
-   - Security settings
-   - Language selection
-
-🔧 AVAILABLE ACTIONS:
-- View balance
-- Review transactions
-- Analyze spending patterns
-- Get financial advice
-- Plan budget
-- Track expenses by category
-- Compare income vs expenses
-- **Analyze financial documents and contracts**
-
-💡 WHAT YOU CAN HELP WITH:
-- "Show me my balance" → provide current balance
-- "What did I spend on groceries?" → analyze grocery transactions
-- "How much did I earn this month?" → calculate total income
-- "Where do I see my transactions?" → explain Transactions tab
-- "How to check analytics?" → explain Analytics section
-- "Give me budget advice" → analyze data and provide recommendations
-- "What's my biggest expense?" → identify largest spending category
-- **"Analyze this contract" → provide summary of uploaded document**
-"""
-    return structure
-
-def extract_text_from_pdf(file_content):
-    """Извлекает текст из PDF файла"""
-    if PyPDF2 is None:
-        return "[ERROR] PyPDF2 не установлен. Установите: pip install PyPDF2"
-    
-    try:
-        pdf_file = BytesIO(file_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        text = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text() + "\n"
-        
-        return text.strip()
-    except Exception as e:
-        print(f"[ERROR] Ошибка при извлечении текста из PDF: {str(e)}")
-        return None
+    return APP_STRUCTURE
+
+# Извлечение текста документов: постранично, с остановкой по бюджету символов
+document_extractor = DocumentExtractor()
+
+# Ответы call_openrouter, которые означают ошибку, а не текст модели
+ERROR_ANSWER_PREFIXES = ("⚠️", "❌", "⏱️")
+
+def complete_document_prompt(prompt, deadline, page=None):
+    """Один запрос анализа документа через общий путь call_openrouter (кеш, single-flight, повторы).
 
-def analyze_document(file_content, filename, file_type, current_page=None):
-    """Анализирует документ и возвращает краткую сводку"""
-    print(f"[DEBUG] Анализ документа: {filename} ({file_type})")
-    print(f"[DEBUG] Текущая страница: {current_page or 'не указана'}")
+    Без данных счета: кусок документа - не вопрос о финансах, а ключ кеша
+    куска не должен сбрасываться при каждой записи в журнал.
+    """
+    answer = call_openrouter(prompt, current_page=page or "document_analysis", deadline=deadline, user_data=False)
+    if answer.startswith(ERROR_ANSWER_PREFIXES):
+        raise ChunkFailed(answer)
+    return answer
+
+# Длинные документы: куски параллельно (не больше DOCUMENT_MAP_CONCURRENCY запросов), затем свод
+document_summarizer = DocumentSummarizer(complete_document_prompt)
+
+# Кеш по SHA-256 файла: извлеченный текст и сводка отдельно, на диске (doccache.py)
+document_cache = create_document_cache()
+
+def extract_document_text(source, file_type, file_hash, mode):
+    """Текст документа из кеша или извлечением; возвращает (текст, счетчики извлечения, из кеша ли)"""
+    # truncate: страницы PDF после набора бюджета символов не разбираются;
+    # mapreduce: нужен весь текст (большие PDF - параллельно, если PDF_WORKERS > 0)
+    kind = "full" if mode == "mapreduce" else f"budget:{DOCUMENT_CHAR_BUDGET}:{DOCUMENT_TOKEN_BUDGET}"
+    if document_extractor.preprocess:
+        kind += ":clean"
+    cached = document_cache.get_text(file_hash, kind) if file_hash else None
+    if cached is not None:
+        return cached["text"], cached["extraction"], True
     
-    # Извлекаем текст в зависимости от типа файла
-    if file_type == 'application/pdf':
-        document_text = extract_text_from_pdf(file_content)
-    elif file_type.startswith('text/'):
-        document_text = file_content.decode('utf-8', errors='ignore')
+    if mode == "mapreduce":
+        extraction = document_extractor.extract(source, file_type, char_budget=None, token_budget=0)
     else:
+        extraction = document_extractor.extract(source, file_type)
+    text = extraction.pop("text")
+    if file_hash and text:
+        document_cache.set_text(file_hash, kind, {"text": text, "extraction": extraction})
+    return text, extraction, False
+
+def analyze_document(source, filename, file_type, current_page=None, deadline=None, mode=DOCUMENT_ANALYSIS_MODE,
+                     file_hash=None):
+    """Анализирует документ и возвращает краткую сводку.
+
+    mode="mapreduce" - весь текст по кускам со сводом (summarize.py),
+    mode="truncate" - только первые DOCUMENT_CHAR_BUDGET символов одним запросом.
+    source - байты, файловый объект загрузки или путь к файлу (читается с диска).
+    file_hash - SHA-256 содержимого: с ним текст и сводка берутся из кеша документов.
+    """
+    start = time.perf_counter()
+    result = _analyze_document(source, filename, file_type, current_page, deadline, mode, file_hash)
+    if "error" in result:
+        outcome = "error"
+    elif result.get("from_cache", {}).get("summary"):
+        outcome = "cached"
+    else:
+        outcome = "partial" if result.get("partial") else "ok"
+    DOCUMENT_ANALYSIS_SECONDS.observe(time.perf_counter() - start, mode=mode, outcome=outcome)
+    return result
+
+def _analyze_document(source, filename, file_type, current_page, deadline, mode, file_hash):
+    log.debug("Анализ документа", filename=filename, type=file_type, mode=mode, page=current_page)
+    
+    if file_type != 'application/pdf' and not file_type.startswith('text/'):
         return {"error": "Неподдерживаемый тип файла. Поддерживаются: PDF, TXT"}
     
-    if not document_text:
-        return {"error": "Не удалось извлечь текст из документа"}
+    # Сводка зависит от файла, модели, шаблонов анализа и системного промпта страницы
+    page = current_page or "document_analysis"
+    model = model_router.choose()
+    prompt_version = make_cache_key(DOCUMENT_PROMPT_VERSION, prompt_templates.static_prefix(page))
+    if file_hash:
+        cached = document_cache.get_summary(file_hash, model, prompt_version, mode)
+        if cached is not None:
+            log.debug("Сводка документа найдена в кеше", file_hash=file_hash[:12])
+            return dict(cached, filename=filename, from_cache={"text": True, "summary": True})
     
-    # Ограничиваем длину текста (первые 8000 символов для анализа)
-    if len(document_text) > 8000:
-        document_text = document_text[:8000] + "...[документ обрезан]"
+    try:
+        document_text, extraction, text_cached = extract_document_text(source, file_type, file_hash, mode)
+    except ExtractionError as e:
+        log.error("Не удалось извлечь текст", filename=filename, error=e)
+        return {"error": "Не удалось извлечь текст из документа"}
     
-    print(f"[DEBUG] Извлечено {len(document_text)} символов текста")
+    if not document_text:
+        return {"error": "Не удалось извлечь текст из документа"}
     
-    # Формируем промпт для анализа документа
-    analysis_prompt = f"""Analyze this document and provide a brief summary in the user's language.
-
-Document: {filename}
-
-Content:
-{document_text}
-
-Please provide:
-1. **Document Type**: What kind of document is this? (contract, agreement, terms of service, etc.)
-2. **Main Purpose**: What is the main purpose of this document?
-3. **Key Points**: List 3-5 most important points or conditions
-4. **Important Dates**: Any important dates or deadlines mentioned
-5. **Financial Terms**: Any amounts, fees, interest rates, or financial obligations
-6. **Risks/Warnings**: Any important warnings or risks the user should be aware of
-7. **Action Required**: Does the user need to do anything?
-
-Format the response clearly and concisely. If the document is a banking contract, focus on financial terms, obligations, and user rights."""
+    cleaned = extraction.get("preprocess") or {}
+    log.debug("Текст документа извлечен", chars=len(document_text), cached=text_cached,
+              elapsed_ms=extraction["elapsed_ms"], pages=extraction["pages_extracted"],
+              pages_total=extraction["pages_total"], tokens_before=cleaned.get("tokens_before"),
+              tokens_after=cleaned.get("tokens_after"))
     
     try:
         # Отправляем запрос к нейросети для анализа
-        result = call_openrouter(analysis_prompt, current_page=current_page or "document_analysis")
+        if mode == "mapreduce":
+            analysis = document_summarizer.summarize(filename, document_text, deadline, current_page)
+            log.debug("Map-reduce завершен", chunks_done=analysis["chunks_done"], chunks=analysis["chunks"],
+                      map_ms=analysis["map_ms"], reduce_ms=analysis["reduce_ms"])
+        else:
+            analysis = {"mode": "truncate",
+                        "summary": complete_document_prompt(analysis_prompt(filename, document_text), deadline,
+                                                            current_page)}
         
-        return {
+        result = {
             "filename": filename,
             "type": file_type,
             "text_length": len(document_text),
-            "summary": result
+            "extraction": extraction,
+            **analysis
         }
+        # Частичные сводки (дедлайн), ошибки и MOCK ответы не кешируем
+        if (file_hash and OPENROUTER_API_KEY and not analysis.get("partial")
+                and not analysis["summary"].startswith(ERROR_ANSWER_PREFIXES)):
+            document_cache.set_summary(file_hash, model, prompt_version, mode, result)
+        return dict(result, from_cache={"text": text_cached, "summary": False})
+        
+    except ChunkFailed as e:
+        return {"error": str(e)}
         
     except Exception as e:
-        print(f"[ERROR] Ошибка при анализе документа: {str(e)}")
+        log.error("Ошибка при анализе документа", exc_info=True, filename=filename)
         return {"error": f"Ошибка при анализе: {str(e)}"}
 
 AVAILABLE_MODEL = get_available_model()
 
-def call_openrouter(prompt, retry_count=0, max_retries=2, current_page=None):
-    """Отправляет запрос к OpenRouter API с контекстом финансовых данных и структуры приложения"""
-    print(f"[DEBUG] Получен запрос: {prompt}")
-    print(f"[DEBUG] Текущая страница: {current_page}")
-    print(f"[DEBUG] Используем модель: {AVAILABLE_MODEL} (попытка {retry_count + 1})")
-    
+# Кеш готовых ответов модели (ключ: вопрос + страница + модель + версия данных)
+response_cache = create_response_cache()
+
+# Локальные ответы на простые вопросы (баланс, доходы, траты) без LLM
+fastpath_engine = FastPathEngine()
+
+def answer_locally(user_input, current_page=None):
+    """Пробует ответить на вопрос по данным пользователя без обращения к модели"""
+    answer = fastpath_engine.answer(user_input, ledger)
+    if answer is None:
+        return None
+    return {
+        "result": answer["result"],
+        "timestamp": datetime.now().isoformat(),
+        "model": None,
+        "current_page": current_page,
+        "source": "fastpath",
+        "intent": answer["intent"]
+    }
+
+def answer_without_model(user_input, current_page=None):
+    """Ответ без модели: fast-path по данным или команда навигации; None - нужен запрос к модели"""
+    local_result = answer_locally(user_input, current_page)
+    if local_result:
+        return local_result
+    # Проверяем команды навигации ПЕРЕД отправкой к AI
+    navigation_result = check_navigation_command(user_input)
+    if navigation_result:
+        navigation_result["source"] = "navigation"
+        return navigation_result
+    return None
+
+# Объединение одинаковых одновременных запросов: чат (ключ кеша) и документы (хеш файла)
+chat_inflight = SingleFlight()
+document_inflight = SingleFlight()
+
+def summarize_session_turns(summary, turns):
+    """SESSION_COMPACTION=model: модель обновляет сводку сессии (ошибка -> локальная сводка)"""
+    return complete_document_prompt(compaction_prompt(summary, turns), Deadline(), page="session_summary")
+
+# Сессии диалога: история на сервере, старые ходы сворачиваются в сводку (sessions.py)
+session_store = SessionStore(
+    compact=summarize_session_turns if SESSION_COMPACTION == "model" and OPENROUTER_API_KEY else None,
+    mode=SESSION_COMPACTION)
+
+def open_session(body):
+    """Сессия запроса: только если клиент прислал поле session_id (null - начать новую)"""
+    if "session_id" not in body:
+        return None
+    return session_store.get_or_create(body["session_id"])
+
+def remember_turn(session, user_input, response):
+    """Записывает ход в сессию и добавляет session_id в ответ; True - историю пора свернуть"""
+    if session is None:
+        return False
+    response["session_id"] = session.id
+    answer = response.get("result") or ""
+    if not answer or answer.startswith(ERROR_ANSWER_PREFIXES):
+        return False  # Ошибки в историю не попадают: следующий запрос повторит вопрос без них
+    return session_store.record(session, user_input, answer)
+
+def compact_session(session):
+    """Сворачивание истории - после отправки ответа, чтобы не задерживать его"""
     try:
-        # Формируем контекст с информацией пользователя
-        financial_context = get_financial_context()
-        app_structure = get_app_structure()
+        session_store.compact(session)
+    except Exception:
+        log.error("Не удалось свернуть историю сессии", exc_info=True, session=session.id)
+
+# Контроль допуска перед моделью: token bucket по пользователю и общий, очередь по приоритетам
+admission = create_admission_controller()
+
+@lru_cache(maxsize=64)
+def static_prefix_tokens(current_page):
+    return estimate_tokens(prompt_templates.static_prefix(current_page))
+
+def estimate_chat_tokens(user_input, current_page=None, session=None):
+    """Оценка токенов запроса чата: промпт (префикс, данные, история, вопрос) и ответ"""
+    tokens = static_prefix_tokens(current_page) + CONTEXT_TOKEN_BUDGET + estimate_tokens(user_input) + CHAT_MAX_TOKENS
+    if session is not None:
+        history = session_store.describe(session)
+        tokens += history["history_tokens"] + history["summary_tokens"]
+    return tokens
+
+def estimate_document_tokens(upload):
+    """Грубая оценка токенов анализа документа: текст (по размеру файла) и промпт с ответом на каждый кусок"""
+    text_tokens = upload["size"] // 4 if upload["mode"] == "mapreduce" else DOCUMENT_CHAR_BUDGET // 4
+    calls = math.ceil(text_tokens / DOCUMENT_CHUNK_TOKENS) + 1 if upload["mode"] == "mapreduce" else 1
+    return text_tokens + calls * (static_prefix_tokens(upload["current_page"] or "document_analysis")
+                                  + CHAT_MAX_TOKENS)
+
+def admit_request(tokens, priority="chat", deadline=None):
+    """Допуск запроса к модели; None - допущен, иначе ответ 429 с Retry-After.
+
+    Пользователь - IP клиента или заголовок ADMISSION_USER_HEADER, если он задан (только за прокси).
+    deadline=None - не ждать в очереди (задача в фоне: ждет уже в очереди задач).
+    """
+    if admission is None:
+        return None
+    user = request.headers.get(ADMISSION_USER_HEADER) if ADMISSION_USER_HEADER else None
+    user = (user or request.remote_addr or "unknown")[:128]
+    try:
+        admission.admit(user, tokens, priority, timeout=deadline.remaining() if deadline else 0)
+    except AdmissionRejected as e:
+        response = jsonify({"error": f"⚠️ Слишком много запросов. Попробуйте через {e.retry_after} с.",
+                            "reason": e.reason, "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    return None
+
+def session_response(session, user_input, response):
+    """JSON ответ ассистента с записью хода в сессию"""
+    needs_compaction = remember_turn(session, user_input, response)
+    result = jsonify(response)
+    if needs_compaction:
+        result.call_on_close(lambda: compact_session(session))
+    return result
+
+def build_system_prompt(current_page=None, query=None, market_context=None):
+    """Формирует системный промпт FinBot с учетом текущей страницы.
+
+    Статический префикс страницы собран заранее (prompts.py), в конец
+    добавляются только финансовые данные (под вопрос query), сигналы акций
+    (market_context, страница Stocks) и текущая дата.
+    """
+    with PROMPT_BUILD_SECONDS.time():
+        return prompt_templates.build(current_page, get_financial_context(query), extra_context=market_context)
+
+def build_chat_messages(prompt, current_page=None, market_context=None, history=None, user_data=True):
+    """Сообщения запроса к модели.
+
+    С историей сессии порядок такой: статический префикс страницы, сводка и
+    прошлые ходы, затем данные пользователя с датой и сам вопрос. Начало
+    списка меняется только при сворачивании истории, так что кеш промпта у
+    провайдера продолжает срабатывать от хода к ходу.
+    user_data=False - только статический префикс, без финансовых данных
+    (анализ документов, сворачивание истории).
+    """
+    if not user_data:
+        return [{"role": "system", "content": prompt_templates.static_prefix(current_page)},
+                {"role": "user", "content": prompt}]
+    if not history:
+        return [{"role": "system", "content": build_system_prompt(current_page, prompt, market_context)},
+                {"role": "user", "content": prompt}]
+    with PROMPT_BUILD_SECONDS.time():
+        prefix, suffix = prompt_templates.parts(current_page, get_financial_context(prompt),
+                                                extra_context=market_context)
+    return ([{"role": "system", "content": prefix}] + history
+            + [{"role": "system", "content": suffix.strip()}, {"role": "user", "content": prompt}])
+
+def get_market_context(current_page, body):
+    """Сигналы по акциям для промпта страницы Stocks (ряды берутся из запроса страницы или загруженных данных)"""
+    if current_page != "stocks":
+        return None
+    try:
+        # Ряды со страницы - только в этот запрос, общий движок они не меняют
+        engine = IndicatorEngine.from_page(body.get("stocks")) or indicator_engine
+        return engine.prompt_block() or None
+    except (ValueError, TypeError, IndicatorsUnavailable) as e:
+        log.warning("Сигналы акций не посчитаны", error=e)
+        return None
+
+def get_mock_response():
+    """Ответ FinBot в MOCK режиме (без API ключа)"""
+    return f"[MOCK] Привет! Я FinBot - твой финансовый помощник. Твой баланс: {ledger.summary()['balance']:.2f} zł. Если у вас есть настоящий OpenRouter ключ, добавьте его в backend/.env для полноценной работы AI."
+
+# Лимит длины ответа модели (его же закладывает в оценку токенов контроль допуска)
+CHAT_MAX_TOKENS = 800  # Увеличили лимит для более полных ответов
+
+def build_openrouter_request(messages, stream=False, model=None):
+    """Формирует заголовки и тело запроса к OpenRouter"""
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "http://localhost:3000",
+        "X-Title": "Financial AI Assistant"
+    }
+    
+    payload = {
+        "model": model or model_router.choose(),
+        "messages": messages,
+        "temperature": 0.7,  # Баланс между креативностью и точностью
+        "max_tokens": CHAT_MAX_TOKENS,
+        "top_p": 0.9,
+    }
+    
+    if stream:
+        payload["stream"] = True
+    
+    return headers, payload
+
+def describe_openrouter_error(response):
+    """Превращает неуспешный ответ OpenRouter (кроме 429) в сообщение для пользователя"""
+    if response.status_code == 401:
+        log.warning("OpenRouter 401 - Invalid API Key")
+        return "❌ Ошибка авторизации. Проверьте API ключ на https://openrouter.ai/keys"
+    
+    if response.status_code == 400:
+        error_data = response.json()
+        error_msg = error_data.get("error", {}).get("message", "Unknown error")
+        log.warning("OpenRouter 400 - Bad Request", error=error_msg)
+        return f"❌ Ошибка запроса: {error_msg}"
+    
+    error_msg = response.text[:300]
+    log.warning("OpenRouter error", status=response.status_code, error=error_msg)
+    return f"⚠️ Ошибка API ({response.status_code}). Попробуйте позже."
+
+RATE_LIMIT_MESSAGE = "⚠️ Сервис временно перегружен. Пожалуйста, попробуйте через минуту или используйте платную модель для стабильной работы."
+
+def describe_deadline_exceeded(error):
+    """Сообщение пользователю, когда бюджет времени запроса исчерпан"""
+    log.info("Бюджет времени запроса исчерпан", budget=error.budget)
+    return f"⏱️ Не удалось получить ответ за {error.budget:g} с. Попробуйте еще раз."
+
+def request_openrouter(prompt, current_page, deadline, cache_key, market_context=None, history=None, user_data=True):
+    """Один реальный запрос к OpenRouter; возвращает (ответ, модель) и кладет успех в кеш"""
+    messages = build_chat_messages(prompt, current_page, market_context, history, user_data)
+    
+    # Отправляем запрос к OpenRouter API
+    headers, payload = build_openrouter_request(messages)
+    
+    model, response = upstream_client.run(model_router.post(
+        upstream_client, OPENROUTER_API_URL, headers, payload,
+        deadline=deadline, policy=DEFAULT_RETRY_POLICY))
+    
+    log.debug("Ответ OpenRouter", status=response.status_code, model=model)
+    
+    if response.status_code == 200:
+        data = response.json()
+        answer = data.get("choices", [{}])[0].get("message", {}).get("content", "")
         
-        # Добавляем информацию о текущей странице, если она передана
-        current_page_info = ""
-        if current_page:
-            page_descriptions = {
-                "dashboard": "HOME/DASHBOARD - showing balance, quick actions, and recent transactions",
-                "transactions": "TRANSACTIONS PAGE - viewing full transaction history",
-                "analytics": "ANALYTICS PAGE - viewing charts and spending statistics",
-                "document_analysis": "DOCUMENT ANALYSIS PAGE - analyzing uploaded financial documents",
-                "contacts": "CONTACTS PAGE - managing contacts, sending money, and messaging",
-                "settings": "SETTINGS PAGE - managing account preferences",
-                "support": "SUPPORT PAGE - getting help and assistance"
-            }
-            
-            page_desc = page_descriptions.get(current_page, current_page.upper())
-            current_page_info = f"\n🎯 USER IS CURRENTLY ON: {page_desc}\n"
-            
-            # Специальный контекст для анализа документов
-            if current_page == "document_analysis":
-                current_page_info += """
-📄 CONTEXT: User is analyzing a document (contract, agreement, etc.)
-You are helping them understand the document's contents, terms, and implications.
-Focus on clear explanations, highlighting important terms, risks, and required actions.
-"""
-            
-            # Специальный контекст для страницы контактов
-            elif current_page == "contacts":
-                current_page_info += """
-👥 CONTEXT: User is on the Contacts page managing their contacts.
-You can help them:
-- Send money to contacts (e.g., "Send 100 zł to Anna")
-- Send messages to contacts (e.g., "Message Piotr")
-- Find specific contacts (e.g., "Who did I transfer the most money to?")
-- Manage and organize contacts
-
-When user asks to send money or message someone:
-1. Identify the contact name from their request
-2. Extract the amount if it's a transfer
-3. Confirm the action clearly
-4. The UI will automatically open the appropriate modal
-
-Examples:
-- "Send 50 zł to Maria" → Identify Maria, extract 50, prepare transfer
-- "Write to Jan" → Identify Jan, prepare message form
-- "Show my top contacts" → Analyze and show contacts with most activity
-"""
-            
-            # Специальный контекст для страницы акций
-            elif current_page == "stocks":
-                current_page_info += """
-📈 CONTEXT: User is on the Stock Market page analyzing stocks.
-You are a professional financial analyst helping them make investment decisions.
-
-You can help them:
-- Analyze stock performance and trends
-- Provide investment recommendations based on data
-- Explain market movements and price changes
-- Compare different stocks
-- Suggest buy/sell/hold strategies
-- Identify growth opportunities and risks
-- Analyze weekly price patterns
-
-When analyzing stocks:
-1. Look at price trends (rising, falling, stable)
-2. Consider percentage changes
-3. Identify momentum (strong gains/losses)
-4. Note volatility (price fluctuations)
-5. Compare relative performance
-6. Give clear buy/sell/hold recommendations
-
-Investment advice format:
-- Strong Buy: High growth potential, positive trend
-- Buy: Good opportunity, moderate growth
-- Hold: Stable, wait for better entry
-- Sell: Declining trend, take profits
-- Strong Sell: High risk, exit position
-
-Examples:
-- "Which stock should I buy?" → Analyze all stocks, recommend best performer
-- "Is AAPL a good investment?" → Analyze Apple's trend and give recommendation
-- "Compare TSLA and NVDA" → Side-by-side analysis with recommendation
-- "What's the best performer?" → Identify highest growth stock
-- "Should I sell GOOGL?" → Analyze trend and advise
-
-Always provide:
-✅ Clear recommendation (Buy/Sell/Hold)
-✅ Reasoning based on price data
-✅ Risk level (Low/Medium/High)
-✅ Target price or timeframe if relevant
-"""
+        if not answer:
+            return "Извините, не удалось получить ответ. Попробуйте переформулировать вопрос.", model
         
-        # УЛУЧШЕННЫЙ системный промпт с информацией о структуре приложения
-        system_prompt = f"""You are "FinBot" - an intelligent AI assistant integrated into a banking mobile application. 
-
-{app_structure}
-
-{current_page_info}
-
-{financial_context}
-
-🎯 YOUR CAPABILITIES:
-1. **Navigation Help**: Guide users through the app's sections and features
-   - When user asks to go somewhere, the system will automatically navigate
-   - Examples: "Open contacts", "Go to analytics", "Show transactions"
-2. **Financial Analysis**: Analyze user's transactions, income, and expenses
-3. **Budget Advice**: Provide personalized financial recommendations
-4. **Feature Explanation**: Explain what each section of the app does
-5. **Data Insights**: Answer specific questions about user's financial data
-6. **General Assistance**: Help with any banking or financial questions
-
-📋 RESPONSE GUIDELINES:
-1. **Language Matching**: ALWAYS respond in the SAME LANGUAGE as the user's question
-2. **Context Awareness**: If user asks "where can I see X?", tell them which tab/section to use
-3. **Be Specific**: Reference actual numbers from user's data when relevant
-4. **Be Helpful**: If user seems lost, proactively suggest relevant features
-5. **Navigation**: When directing users, use clear section names (Home, Transactions, Analytics, Settings)
-6. **Current Location**: Consider which page user is on and provide contextual help
-7. **Concise**: 2-4 sentences for simple questions, detailed explanations when needed
-
-💬 EXAMPLE INTERACTIONS:
-- "Where can I see all my transactions?" → "Go to the Transactions tab to see your complete transaction history..."
-- "What's my balance?" → "Your current balance is [amount] zł..."
-- "How much did I spend on food?" → "Looking at your transactions, you spent [X] zł on food..."
-- "What does Analytics show?" → "The Analytics section provides visual charts showing your spending by category..."
-
-Current date: {datetime.now().strftime("%d %B %Y")}
-
-Remember: You have full access to the user's financial data and complete knowledge of the app's structure. Use this to provide accurate, helpful, and contextual assistance!"""
+        # Кешируем только успешные ответы - ошибки должны повторяться
+        response_cache.set(cache_key, {"answer": answer.strip(), "model": model})
+        return answer.strip(), model
         
+    elif response.status_code == 429:
+        # Повторы уже сделаны внутри upstream клиента - бюджет исчерпан
+        log.warning("Rate limit (429) - повторы исчерпаны", model=model)
+        return RATE_LIMIT_MESSAGE, model
+    
+    else:
+        return describe_openrouter_error(response), model
+
+def call_openrouter(prompt, current_page=None, deadline=None, meta=None, market_context=None, history=None,
+                    history_key=None, user_data=True):
+    """Отправляет запрос к OpenRouter API с контекстом финансовых данных и структуры приложения.
+
+    deadline - сквозной бюджет времени запроса; повторы при 429/5xx укладываются в него.
+    meta - необязательный dict, куда записывается модель, которая фактически ответила,
+    и попал ли ответ в кеш.
+    market_context - блок вычисленных сигналов акций (страница Stocks).
+    history - сообщения сессии (SessionStore.messages), history_key - их версия для ключа кеша.
+    user_data=False - промпт без финансовых данных, ключ кеша не зависит от версии журнала.
+    """
+    # Текст вопроса в лог не пишется - только длина
+    log.debug("Запрос к модели", chars=len(prompt), page=current_page)
+    
+    if deadline is None:
+        deadline = Deadline()
+    if meta is None:
+        meta = {}
+    
+    try:
         # Если API ключ не установлен, используем mock ответ
         if not OPENROUTER_API_KEY:
-            print("[DEBUG] API Key не установлен - используем MOCK режим")
-            mock_response = f"[MOCK] Привет! Я FinBot - твой финансовый помощник. Твой баланс: {USER_DATA['balance']} zł. Если у вас есть настоящий OpenRouter ключ, добавьте его в backend/.env для полноценной работы AI."
-            return mock_response
+            log.debug("API Key не установлен - используем MOCK режим")
+            build_chat_messages(prompt, current_page, market_context, history, user_data)
+            return get_mock_response()
         
-        # Отправляем запрос к OpenRouter API
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "http://localhost:3000",
-            "X-Title": "Financial AI Assistant"
-        }
+        # Сначала кеш: одинаковый вопрос с той же страницы при тех же данных
+        data_version = get_data_version() if user_data else None
+        cache_key = make_cache_key(normalize_prompt(prompt), current_page, model_router.choose(), data_version,
+                                   market_context, history_key)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            log.debug("Ответ найден в кеше")
+            meta["model"] = cached["model"]
+            meta["cached"] = True
+            return cached["answer"]
+        meta["cached"] = False
         
-        payload = {
-            "model": AVAILABLE_MODEL,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt},
-            ],
-            "temperature": 0.7,  # Баланс между креативностью и точностью
-            "max_tokens": 800,  # Увеличили лимит для более полных ответов
-            "top_p": 0.9,
-        }
+        # Одинаковые одновременные вопросы делят один запрос к модели
+        (answer, model), shared = chat_inflight.do(
+            cache_key,
+            lambda: request_openrouter(prompt, current_page, deadline, cache_key, market_context, history, user_data),
+            timeout=deadline.remaining())
+        meta["model"] = model
+        if shared:
+            log.debug("Ответ получен из общего запроса (single-flight)")
+        return answer
         
-        print(f"[DEBUG] Sending request to OpenRouter...")
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=30)
+    except TooManyWaiters as e:
+        log.warning("Слишком много ожидающих одного запроса", error=e)
+        return RATE_LIMIT_MESSAGE
         
-        print(f"[DEBUG] OpenRouter Status: {response.status_code}")
+    except WaiterTimeout as e:
+        log.info("Общий запрос не уложился в дедлайн", error=e)
+        return describe_deadline_exceeded(DeadlineExceeded(deadline.budget))
         
-        if response.status_code == 200:
-            data = response.json()
-            answer = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-            
-            if not answer:
-                return "Извините, не удалось получить ответ. Попробуйте переформулировать вопрос."
-            
-            print(f"[DEBUG] Ответ от OpenRouter получен ({len(answer)} символов)")
-            return answer.strip()
-            
-        elif response.status_code == 429:
-            # Rate limit - пробуем повторить с задержкой
-            print(f"[DEBUG] Rate limit (429) - попытка {retry_count + 1}/{max_retries}")
-            if retry_count < max_retries:
-                wait_time = 2 ** retry_count  # Экспоненциальная задержка: 1s, 2s, 4s
-                print(f"[DEBUG] Ожидание {wait_time} секунд...")
-                time.sleep(wait_time)
-                return call_openrouter(prompt, retry_count + 1, max_retries, current_page)
-            else:
-                return "⚠️ Сервис временно перегружен. Пожалуйста, попробуйте через минуту или используйте платную модель для стабильной работы."
-                
-        elif response.status_code == 401:
-            print(f"[DEBUG] OpenRouter 401 - Invalid API Key")
-            return "❌ Ошибка авторизации. Проверьте API ключ на https://openrouter.ai/keys"
-            
-        elif response.status_code == 400:
-            error_data = response.json()
-            error_msg = error_data.get("error", {}).get("message", "Unknown error")
-            print(f"[DEBUG] OpenRouter 400 - Bad Request: {error_msg}")
-            return f"❌ Ошибка запроса: {error_msg}"
-            
-        else:
-            error_msg = response.text[:300]
-            print(f"[DEBUG] OpenRouter Error ({response.status_code}): {error_msg}")
-            return f"⚠️ Ошибка API ({response.status_code}). Попробуйте позже."
+    except DeadlineExceeded as e:
+        return describe_deadline_exceeded(e)
         
-    except requests.exceptions.Timeout:
-        print(f"[DEBUG] Timeout при обращении к OpenRouter")
+    except httpx.TimeoutException:
+        log.warning("Timeout при обращении к OpenRouter")
         return "⚠️ Превышено время ожидания ответа. Попробуйте еще раз."
         
-    except requests.exceptions.ConnectionError:
-        print(f"[DEBUG] Connection error")
+    except httpx.TransportError:
+        log.warning("Ошибка подключения к OpenRouter")
         return "⚠️ Ошибка подключения к серверу. Проверьте интернет-соединение."
         
     except Exception as e:
-        print(f"[DEBUG] Непредвиденная ошибка: {str(e)}")
+        log.error("Непредвиденная ошибка запроса к модели", exc_info=True)
         return f"⚠️ Произошла ошибка: {str(e)[:100]}"
 
 
+# Пауза между словами в MOCK стриминге, чтобы клиент видел постепенный вывод
+MOCK_STREAM_DELAY = float(os.getenv("MOCK_STREAM_DELAY", "0.02"))
+
+def stream_openrouter(prompt, current_page=None, deadline=None, meta=None, market_context=None, history=None,
+                      history_key=None):
+    """Стримит ответ OpenRouter (stream: true) и отдает текстовые дельты по мере поступления"""
+    log.debug("Запрос к модели (stream)", chars=len(prompt), page=current_page)
+    
+    if meta is None:
+        meta = {}
+    
+    # Без API ключа стримим mock ответ по словам - удобно для офлайн проверки
+    if not OPENROUTER_API_KEY:
+        log.debug("API Key не установлен - стримим MOCK ответ")
+        build_chat_messages(prompt, current_page, market_context, history)
+        for word in re.findall(r"\S+\s*", get_mock_response()):
+            if MOCK_STREAM_DELAY:
+                time.sleep(MOCK_STREAM_DELAY)
+            yield word
+        return
+    
+    model = model_router.choose()
+    meta["model"] = model
+    
+    # Ответ из кеша отдаем одной дельтой
+    cache_key = make_cache_key(normalize_prompt(prompt), current_page, model, get_data_version(), market_context,
+                               history_key)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        log.debug("Ответ найден в кеше (stream)")
+        meta["model"] = cached["model"]
+        meta["cached"] = True
+        yield cached["answer"]
+        return
+    meta["cached"] = False
+    
+    messages = build_chat_messages(prompt, current_page, market_context, history)
+    headers, payload = build_openrouter_request(messages, stream=True, model=model)
+    
+    model_router.begin(model)
+    started = time.monotonic()
+    upstream = upstream_client.stream_sync(OPENROUTER_API_URL, headers=headers, json=payload,
+                                           deadline=deadline or Deadline(), policy=DEFAULT_RETRY_POLICY)
+    try:
+        # Для роутера задержка стрима - время до первого байта
+        try:
+            response = next(upstream)
+        except Exception:
+            model_router.record(model, time.monotonic() - started, None)
+            raise
+        model_router.record(model, time.monotonic() - started, response.status_code)
+        log.debug("Ответ OpenRouter (stream)", status=response.status_code, model=model)
+        
+        if response.status_code == 429:
+            yield RATE_LIMIT_MESSAGE
+            return
+        if response.status_code != 200:
+            yield describe_openrouter_error(response)
+            return
+        
+        parts = []
+        for line in upstream:
+            # Пустые строки разделяют события, строки с ":" - keep-alive комментарии
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                answer = "".join(parts).strip()
+                if answer:
+                    response_cache.set(cache_key, {"answer": answer, "model": model})
+                break
+            
+            chunk = json.loads(data)
+            if "error" in chunk:
+                error_msg = chunk["error"].get("message", "Unknown error")
+                log.warning("Ошибка в потоке OpenRouter", model=model, error=error_msg)
+                yield f"⚠️ Ошибка API: {error_msg}"
+                return
+            
+            delta = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        upstream.close()
+
+
+def sse_event(event, data):
+    """Форматирует одно событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Сколько символов предыдущего текста пересканировать, чтобы не пропустить
+# паттерн навигации, разрезанный между двумя дельтами
+NAVIGATION_SCAN_OVERLAP = 64
+
+def generate_neural_action_events(user_input, current_page=None, deadline=None, market_context=None, session=None,
+                                  local_answer=None):
+    """Генерирует SSE события ответа ассистента: delta, action, done (или error).
+
+    local_answer - готовый ответ без модели (answer_without_model), если он есть.
+    """
+    # Первый байт уходит сразу, еще до обращения к модели
+    yield ": stream opened\n\n"
+    
+    if local_answer:
+        needs_compaction = remember_turn(session, user_input, local_answer)
+        if local_answer["source"] == "navigation":
+            yield sse_event("action", local_answer["action"])
+        else:
+            yield sse_event("delta", {"text": local_answer["result"]})
+        yield sse_event("done", local_answer)
+        if needs_compaction:
+            compact_session(session)
+        return
+    
+    parts = []
+    tail = ""
+    navigation_action = None
+    meta = {}
+    history = session_store.messages(session) if session is not None else None
+    history_key = session_store.history_key(session) if session is not None else None
+    
+    try:
+        for delta in stream_openrouter(user_input, current_page=current_page, deadline=deadline, meta=meta,
+                                       market_context=market_context, history=history, history_key=history_key):
+            parts.append(delta)
+            yield sse_event("delta", {"text": delta})
+            
+            # Ищем навигацию инкрементально: только в новой дельте плюс хвост предыдущего текста
+            if navigation_action is None:
+                window = tail + delta
+                navigation_action = extract_navigation_from_response(window)
+                tail = window[-NAVIGATION_SCAN_OVERLAP:]
+                if navigation_action:
+                    yield sse_event("action", navigation_action)
+                    
+    except DeadlineExceeded as e:
+        yield sse_event("error", {"error": describe_deadline_exceeded(e)})
+        return
+    
+    except httpx.TimeoutException:
+        log.warning("Timeout при стриминге из OpenRouter")
+        yield sse_event("error", {"error": "⚠️ Превышено время ожидания ответа. Попробуйте еще раз."})
+        return
+    
+    except httpx.TransportError:
+        log.warning("Ошибка подключения к OpenRouter (stream)")
+        yield sse_event("error", {"error": "⚠️ Ошибка подключения к серверу. Проверьте интернет-соединение."})
+        return
+    
+    except Exception as e:
+        log.error("Непредвиденная ошибка при стриминге", exc_info=True)
+        yield sse_event("error", {"error": f"⚠️ Произошла ошибка: {str(e)[:100]}"})
+        return
+    
+    response = {
+        "result": "".join(parts).strip(),
+        "timestamp": datetime.now().isoformat(),
+        "model": meta.get("model", AVAILABLE_MODEL),
+        "current_page": current_page,
+        "cached": meta.get("cached", False),
+        "source": "cache" if meta.get("cached") else "llm"
+    }
+    if navigation_action:
+        response["action"] = navigation_action
+    
+    needs_compaction = remember_turn(session, user_input, response)
+    yield sse_event("done", response)
+    # Клиент уже получил done - сворачиваем историю, пока соединение закрывается
+    if needs_compaction:
+        compact_session(session)
+
+
+def stream_neural_action_response(user_input, current_page=None, deadline=None, market_context=None, session=None,
+                                  local_answer=None):
+    """Оборачивает поток событий ассистента в SSE ответ Flask"""
+    return Response(
+        stream_with_context(generate_neural_action_events(user_input, current_page, deadline, market_context,
+                                                          session, local_answer)),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Отключаем буферизацию в nginx
+        }
+    )
+
+
 @app.route("/api/neural-action", methods=["POST"])
 def neural_action():
     """Обрабатывает запросы к AI ассистенту"""
+    deadline = Deadline()  # Один бюджет времени на весь запрос, включая повторы
     body = request.json
     user_input = body.get("input", "").strip()
     current_page = body.get("current_page", None)  # Опциональная информация о текущей странице
@@ -455,13 +775,30 @@ def neural_action():
     if not user_input:
         return jsonify({"error": "Введите сообщение"}), 400
 
-    # Проверяем команды навигации ПЕРЕД отправкой к AI
-    navigation_result = check_navigation_command(user_input)
-    if navigation_result:
-        return jsonify(navigation_result)
+    # Сессия (если клиент ее ведет): прошлые ходы уходят в модель вместе с вопросом
+    session = open_session(body)
+
+    # Простые вопросы по данным и команды навигации - без модели и без контроля допуска
+    local_answer = answer_without_model(user_input, current_page)
+    if local_answer is None:
+        rejected = admit_request(estimate_chat_tokens(user_input, current_page, session), "chat", deadline)
+        if rejected:
+            return rejected
+
+    # ?stream=1 - тот же ответ, но потоком SSE
+    if request.args.get("stream") in ("1", "true"):
+        return stream_neural_action_response(user_input, current_page, deadline, get_market_context(current_page, body),
+                                             session, local_answer)
+
+    if local_answer:
+        return session_response(session, user_input, local_answer)
 
     # Получаем ответ от нейросети с учетом текущей страницы
-    result = call_openrouter(user_input, current_page=current_page)
+    meta = {}
+    result = call_openrouter(user_input, current_page=current_page, deadline=deadline, meta=meta,
+                             market_context=get_market_context(current_page, body),
+                             history=session_store.messages(session) if session is not None else None,
+                             history_key=session_store.history_key(session) if session is not None else None)
     
     # Проверяем, есть ли в ответе команды навигации
     navigation_action = extract_navigation_from_response(result)
@@ -469,137 +806,39 @@ def neural_action():
     response = {
         "result": result,
         "timestamp": datetime.now().isoformat(),
-        "model": AVAILABLE_MODEL,
-        "current_page": current_page
+        "model": meta.get("model", AVAILABLE_MODEL),  # Модель, которая фактически ответила
+        "current_page": current_page,
+        "cached": meta.get("cached", False),
+        "source": "cache" if meta.get("cached") else "llm"  # Какой путь ответил - для оценки разгрузки LLM
     }
     
     # Добавляем действие навигации если найдено
     if navigation_action:
         response["action"] = navigation_action
     
-    return jsonify(response)
+    return session_response(session, user_input, response)
 
 
-def check_navigation_command(user_input):
-    """Проверяет, является ли команда запросом на навигацию"""
-    lower_input = user_input.lower()
-    
-    # Словарь команд навигации
-    navigation_map = {
-        # Dashboard / Home
-        'dashboard': ['dashboard', 'home', 'главная', 'главную', 'домой', 'дашборд'],
-        
-        # Transactions
-        'transactions': ['transactions', 'transaction', 'история', 'транзакции', 'транзакцию', 'переводы'],
-        
-        # Analytics
-        'analytics': ['analytics', 'статистика', 'аналитика', 'графики', 'charts'],
-        
-        # Contacts
-        'contacts': ['contacts', 'contact', 'контакты', 'контакт'],
-        
-        # Document Analysis
-        'document_analysis': ['documents', 'document', 'документы', 'документ', 'анализ документов', 'document analysis'],
-        
-        # Currency
-        'currency': ['currency', 'exchange', 'валюта', 'обмен', 'курс'],
-        
-        # Transfer
-        'transfer': ['transfer', 'перевод', 'отправить деньги', 'send money'],
-        
-        # Settings
-        'settings': ['settings', 'настройки', 'настройка'],
-        
-        # Support
-        'support': ['support', 'help', 'поддержка', 'помощь'],
-        
-        # Blik
-        'blik': ['blik', 'блик']
-    }
-    
-    # Ключевые фразы для навигации
-    navigation_triggers = [
-        'open', 'открой', 'перейди', 'go to', 'navigate', 'show', 'покажи',
-        'переход', 'иди', 'открыть', 'перейти', 'покажи мне'
-    ]
-    
-    # Проверяем, есть ли триггер навигации
-    has_trigger = any(trigger in lower_input for trigger in navigation_triggers)
-    
-    if has_trigger or any(keyword in lower_input for page_keywords in navigation_map.values() for keyword in page_keywords):
-        # Определяем, какую страницу нужно открыть
-        for page, keywords in navigation_map.items():
-            if any(keyword in lower_input for keyword in keywords):
-                # Генерируем понятный ответ
-                page_names = {
-                    'dashboard': 'Dashboard',
-                    'transactions': 'Transactions',
-                    'analytics': 'Analytics',
-                    'contacts': 'Contacts',
-                    'document_analysis': 'Document Analysis',
-                    'currency': 'Currency Exchange',
-                    'transfer': 'Transfer',
-                    'settings': 'Settings',
-                    'support': 'Support',
-                    'blik': 'BLIK'
-                }
-                
-                page_routes = {
-                    'dashboard': '/',
-                    'transactions': '/trans',
-                    'analytics': '/analytics',
-                    'contacts': '/contacts',
-                    'document_analysis': '/anal',
-                    'currency': '/currency',
-                    'transfer': '/trans',
-                    'settings': '/settings',
-                    'support': '/support',
-                    'blik': '/blik'
-                }
-                
-                return {
-                    "result": f"✅ Opening {page_names.get(page, page)} page...",
-                    "action": {
-                        "type": "navigate",
-                        "page": page,
-                        "route": page_routes.get(page, '/')
-                    },
-                    "timestamp": datetime.now().isoformat()
-                }
-    
-    return None
+@app.route("/api/neural-action/stream", methods=["POST"])
+def neural_action_stream():
+    """Стримит ответ AI ассистента токен за токеном (Server-Sent Events)"""
+    deadline = Deadline()
+    body = request.json
+    user_input = body.get("input", "").strip()
+    current_page = body.get("current_page", None)
 
+    if not user_input:
+        return jsonify({"error": "Введите сообщение"}), 400
 
-def extract_navigation_from_response(ai_response):
-    """Извлекает команды навигации из ответа AI"""
-    lower_response = ai_response.lower()
-    
-    # Паттерны которые AI может использовать
-    navigation_patterns = {
-        'contacts': ['go to contacts', 'open contacts', 'contacts page', 'navigate to contacts'],
-        'transactions': ['go to transactions', 'open transactions', 'transaction history'],
-        'analytics': ['go to analytics', 'open analytics', 'view analytics'],
-        'document_analysis': ['go to documents', 'open documents', 'document analysis'],
-        'dashboard': ['go to dashboard', 'go home', 'return to home']
-    }
-    
-    for page, patterns in navigation_patterns.items():
-        if any(pattern in lower_response for pattern in patterns):
-            page_routes = {
-                'dashboard': '/',
-                'transactions': '/trans',
-                'analytics': '/analytics',
-                'contacts': '/contacts',
-                'document_analysis': '/anal'
-            }
-            
-            return {
-                "type": "navigate",
-                "page": page,
-                "route": page_routes.get(page, '/')
-            }
-    
-    return None
+    session = open_session(body)
+    local_answer = answer_without_model(user_input, current_page)
+    if local_answer is None:
+        rejected = admit_request(estimate_chat_tokens(user_input, current_page, session), "chat", deadline)
+        if rejected:
+            return rejected
+
+    return stream_neural_action_response(user_input, current_page, deadline, get_market_context(current_page, body),
+                                         session, local_answer)
 
 
 @app.route("/api/health", methods=["GET"])
@@ -608,14 +847,183 @@ def health():
     return jsonify({
         "status": "ok",
         "timestamp": datetime.now().isoformat(),
-        "model": AVAILABLE_MODEL,
-        "api_key_configured": bool(OPENROUTER_API_KEY)
+        "model": model_router.last_model or AVAILABLE_MODEL,
+        "api_key_configured": bool(OPENROUTER_API_KEY),
+        "upstream": upstream_client.stats(),
+        "router": model_router.state(),
+        "cache": response_cache.stats(),
+        "fastpath": fastpath_engine.stats(),
+        "analytics": analytics_engine.stats(),
+        "stocks": indicator_engine.stats(),
+        "documents": dict(document_extractor.stats(), summarize=document_summarizer.stats(),
+                          cache=document_cache.stats(), jobs=document_jobs.stats()),
+        "single_flight": {"chat": chat_inflight.stats(), "documents": document_inflight.stats()},
+        "sessions": session_store.stats(),
+        "admission": admission.stats() if admission else {"enabled": False},
+        "logs": log_stats(),
+        "process": {"pid": os.getpid(), "memory": process_memory()}
     })
 
+# Состояние, которое в /api/metrics считается в момент запроса
+def document_job_counts():
+    stats = document_jobs.stats()
+    return {("queued",): stats["queued"], ("running",): stats["running"]}
+
+REGISTRY.gauge("finbot_document_jobs", "Задачи анализа документов по статусам", document_job_counts, ("status",))
+REGISTRY.gauge("finbot_model_circuit_open", "Circuit breaker модели открыт (1) или нет (0)",
+               lambda: {(model,): int(info["state"] == "open")
+                        for model, info in model_router.state()["models"].items()}, ("model",))
+REGISTRY.gauge("finbot_sessions_active", "Сессии диалога в памяти процесса", lambda: session_store.stats()["active"])
+REGISTRY.gauge("finbot_log_queue_records", "Записи лога, ждущие записи в stdout", lambda: log_stats()["queued"])
+REGISTRY.gauge("finbot_log_dropped_records", "Записи лога, выброшенные при заполненной очереди",
+               lambda: log_stats()["dropped"])
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    """Задержки по этапам и счетчики в текстовом формате Prometheus"""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+# Сериализованный полный ответ /api/user/data: (версия данных, тело); с ?limit= тело не кешируется,
+# иначе каждое новое значение limit оставляло бы в памяти процесса еще одно тело
+_user_data_body = None
+
+def data_etag(*extra):
+    """ETag и время последнего изменения данных пользователя (extra - еще части версии ответа)"""
+    summary = ledger.summary()
+    return make_etag(summary["version"], int(summary["updated_at"] * 1000), *extra), summary["updated_at"]
+
 @app.route("/api/user/data", methods=["GET"])
 def get_user_data():
-    """Возвращает данные пользователя"""
-    return jsonify(USER_DATA)
+    """Возвращает данные пользователя (?limit=N - только последние N транзакций)"""
+    limit = request.args.get("limit", type=int)
+    version = ledger.version()
+    if limit is not None:
+        limit = max(0, limit)
+        if limit >= ledger.summary()["count"]:
+            limit = None  # все транзакции - тот же ответ, что и без limit
+
+    def build_body():
+        global _user_data_body
+        if limit is not None:
+            return json.dumps(ledger.user_data(limit=limit), ensure_ascii=False)
+        cached = _user_data_body
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        body = json.dumps(ledger.user_data(), ensure_ascii=False)
+        _user_data_body = (version, body)
+        return body
+
+    etag, last_modified = data_etag()
+    return conditional_response(build_body, etag, last_modified)
+
+@app.route("/api/transactions", methods=["GET"])
+def list_transactions():
+    """Страница транзакций: ?type=&category=&from=&to=&sort=date|amount&order=desc|asc&limit=&cursor="""
+    args = request.args
+    etag, last_modified = data_etag()
+
+    def build_body():
+        transactions, next_cursor = ledger.page(
+            tx_type=args.get("type"), category=args.get("category"),
+            date_from=args.get("from"), date_to=args.get("to"),
+            sort=args.get("sort", "date"), order=args.get("order", "desc"),
+            limit=args.get("limit", 50, type=int), cursor=args.get("cursor"))
+        return json.dumps({"transactions": transactions, "next_cursor": next_cursor}, ensure_ascii=False)
+
+    try:
+        return conditional_response(build_body, etag, last_modified)
+    except LedgerError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/transactions", methods=["POST"])
+def add_transaction():
+    """Добавляет транзакцию в журнал (агрегаты обновляются инкрементально)"""
+    body = request.json or {}
+    try:
+        transaction = ledger.append(body)
+    except LedgerError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"transaction": transaction, "balance": round(ledger.summary()["balance"], 2)}), 201
+
+@app.route("/api/dashboard/summary", methods=["GET"])
+def dashboard_summary():
+    """Короткая сводка для Dashboard: баланс, итоги, месяц, топ категорий и 5 последних транзакций"""
+    # Итоги текущего месяца меняются и без записей - при смене месяца: он входит в ETag,
+    # а Last-Modified не раньше начала месяца
+    now = datetime.now()
+    month = now.strftime("%Y-%m")
+    etag, last_modified = data_etag(month)
+    last_modified = max(last_modified, now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+    def build_body():
+        summary = ledger.summary()
+        month_totals = summary["months"].get(month, {"income": 0.0, "expenses": 0.0})
+        top_categories = sorted(
+            ((category, t["expenses"]) for category, t in summary["categories"].items() if t["expenses"] > 0),
+            key=lambda item: -item[1])[:5]
+        return json.dumps({
+            "balance": round(summary["balance"], 2),
+            "currency": summary["currency"],
+            "card_number": summary["card_number"],
+            "total_income": round(summary["income"], 2),
+            "total_expenses": round(summary["expenses"], 2),
+            "transactions_count": summary["count"],
+            "current_month": {"month": month, "income": round(month_totals["income"], 2),
+                              "expenses": round(month_totals["expenses"], 2)},
+            "top_categories": [{"category": c, "expenses": round(v, 2)} for c, v in top_categories],
+            "recent_transactions": ledger.recent(limit=5),
+        }, ensure_ascii=False)
+
+    return conditional_response(build_body, etag, last_modified)
+
+@app.route("/api/analytics", methods=["GET"])
+def get_analytics():
+    """Сводки для Analytics: категории, месяцы, скользящее среднее, топ получателей, бюджет.
+
+    ?top=N - размер топа получателей, ?window=N - окно среднего (месяцев),
+    ?month=ГГГГ-ММ - месяц для сравнения с бюджетом (по умолчанию последний).
+    """
+    args = request.args
+    etag, last_modified = data_etag()
+    try:
+        top_n = max(1, min(args.get("top", ANALYTICS_TOP_N, type=int), 100))
+        window = max(1, min(args.get("window", ANALYTICS_ROLLING_WINDOW, type=int), 24))
+        month = args.get("month")
+        if month:
+            parse_month(month)
+        return conditional_response(
+            lambda: json.dumps(analytics_engine.rollups(top_n=top_n, window=window, month=month), ensure_ascii=False),
+            etag, last_modified)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except AnalyticsUnavailable as e:
+        return jsonify({"error": f"Аналитика недоступна: {e}"}), 503
+
+@app.route("/api/stocks/series", methods=["POST"])
+def upload_stock_series():
+    """Загружает ряды цен закрытия: {"series": {"AAPL": [180.5, 182.3, ...]}}"""
+    body = request.json or {}
+    series = body.get("series")
+    if not isinstance(series, dict) or not series:
+        return jsonify({"error": "Ожидается {\"series\": {\"ТИКЕР\": [цены]}}"}), 400
+    try:
+        versions = indicator_engine.update(series)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    except IndicatorsUnavailable as e:
+        return jsonify({"error": f"Индикаторы недоступны: {e}"}), 503
+    return jsonify({"versions": versions, "tickers": len(indicator_engine.tickers())})
+
+@app.route("/api/stocks/indicators", methods=["GET"])
+def get_stock_indicators():
+    """Индикаторы по тикерам (?tickers=AAPL,MSFT; по умолчанию - все загруженные)"""
+    tickers = [t.strip() for t in request.args.get("tickers", "").split(",") if t.strip()]
+    try:
+        return jsonify({"signals": indicator_engine.signals(tickers or None)})
+    except KeyError as e:
+        return jsonify({"error": f"Нет данных по тикерам: {e.args[0]}"}), 404
+    except IndicatorsUnavailable as e:
+        return jsonify({"error": f"Индикаторы недоступны: {e}"}), 503
 
 @app.route("/api/user/financial-context", methods=["GET"])
 def get_user_context():
@@ -629,43 +1037,162 @@ def get_app_info():
     structure = get_app_structure()
     return jsonify({"structure": structure})
 
-@app.route("/api/document/analyze", methods=["POST"])
-def analyze_document_endpoint():
-    """Анализирует загруженный документ (PDF, TXT)"""
+@app.route("/api/prompts", methods=["GET"])
+def get_prompt_templates():
+    """Предсобранные шаблоны системного промпта: размер и токены по страницам"""
+    if "page" in request.args:
+        page = request.args.get("page") or None
+        prefix = prompt_templates.static_prefix(page)
+        return jsonify({"page": page, "chars": len(prefix), "tokens": estimate_tokens(prefix), "prompt": prefix})
+    return jsonify({"templates": prompt_templates.describe()})
+
+ALLOWED_DOCUMENT_TYPES = ['application/pdf', 'text/plain', 'text/html', 'text/markdown']
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    """Тело запроса больше лимита - разбор прерван, не дочитывая загрузку"""
+    return jsonify({"error": f"Файл слишком большой (максимум {MAX_DOCUMENT_BYTES // (1024 * 1024)} МБ)"}), 413
+
+def read_document_upload():
+    """Проверяет загрузку документа; возвращает (upload, None) или (None, ответ с ошибкой).
+
+    Файл не читается в память целиком: SpoolingRequest._get_file_stream (uploads.py)
+    пишет его во временный файл (больше UPLOAD_SPOOL_BYTES или без длины) или в BytesIO,
+    в upload["stream"] передается этот же поток.
+    """
+    # Лимит проверяется по ходу чтения тела, а не после file.read()
+    limit_document_upload(request)
     
     # Проверяем наличие файла
     if 'file' not in request.files:
-        return jsonify({"error": "Файл не найден"}), 400
+        return None, (jsonify({"error": "Файл не найден"}), 400)
     
     file = request.files['file']
     
     if file.filename == '':
-        return jsonify({"error": "Файл не выбран"}), 400
+        return None, (jsonify({"error": "Файл не выбран"}), 400)
     
     # Получаем информацию о текущей странице (опционально)
     current_page = request.form.get('current_page', 'document_analysis')
-    print(f"[INFO] Запрос с страницы: {current_page}")
+    
+    mode = request.form.get('mode') or DOCUMENT_ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
+        return None, (jsonify({"error": f"Неизвестный режим анализа: {mode}", "supported": list(ANALYSIS_MODES)}), 400)
     
     # Проверяем тип файла
-    allowed_types = ['application/pdf', 'text/plain', 'text/html', 'text/markdown']
-    if file.content_type not in allowed_types:
-        return jsonify({
+    if file.content_type not in ALLOWED_DOCUMENT_TYPES:
+        return None, (jsonify({
             "error": f"Неподдерживаемый тип файла: {file.content_type}",
             "supported": "PDF, TXT, HTML, Markdown"
-        }), 400
+        }), 400)
     
+    # Размер и хеш - чтением потока по кускам
     try:
-        # Читаем содержимое файла
-        file_content = file.read()
-        
-        # Проверяем размер файла (максимум 10 МБ)
-        if len(file_content) > 10 * 1024 * 1024:
-            return jsonify({"error": "Файл слишком большой (максимум 10 МБ)"}), 400
-        
-        print(f"[INFO] Получен файл для анализа: {file.filename} ({file.content_type}, {len(file_content)} байт)")
+        size, file_hash = hash_upload(file.stream)
+    except UploadTooLarge:
+        return None, (jsonify({"error": f"Файл слишком большой (максимум {MAX_DOCUMENT_BYTES // (1024 * 1024)} МБ)"}), 413)
+    
+    log.info("Получен файл для анализа", filename=file.filename, type=file.content_type, size=size,
+             page=current_page)
+    return {
+        "filename": file.filename,
+        "file_type": file.content_type,
+        "current_page": current_page,
+        "mode": mode,
+        "size": size,
+        "file_hash": file_hash,
+        "stream": file.stream,
+    }, None
+
+def run_document_job(params, content):
+    """Обработчик задачи из очереди: тот же анализ, что и в синхронном запросе (файл - с диска)"""
+    try:
+        return analyze_document(params["path"], params["filename"], params["file_type"], params["current_page"],
+                                Deadline(DOCUMENT_DEADLINE), params["mode"], params["file_hash"])
+    finally:
+        discard_upload(params["path"])
+
+# Фоновые задачи анализа: очередь в SQLite, JOB_WORKERS потоков
+document_jobs = JobQueue(run_document_job, abandon=lambda params: discard_upload(params["path"]),
+                         public_params=("filename", "file_type", "mode", "current_page"))
+
+def start_background_work():
+    """Фоновые потоки процесса: обработчики задач анализа документов"""
+    document_jobs.start()
+
+def before_fork():
+    """Мастер serve.py до fork: догружает ленивые импорты (их страницы памяти станут общими
+    для воркеров) и закрывает SQLite соединения - соединение нельзя переносить через fork"""
+    load_pdf_backend()
+    for resource in (ledger, document_jobs, response_cache, document_cache, session_store, admission):
+        if resource is not None:
+            resource.close()
+
+# serve.py загружает модуль в мастере до fork (SERVE_PRELOAD=1): потоки запускает каждый воркер
+if os.getenv("SERVE_PRELOAD") != "1":
+    start_background_work()
+
+def submit_document_job(upload):
+    """Ставит документ в очередь; 202 с id задачи или 429, если очередь заполнена"""
+    upload["path"] = persist_upload(upload.pop("stream"))
+    try:
+        job_id = document_jobs.submit("document", upload)
+    except QueueFull as e:
+        discard_upload(upload["path"])
+        response = jsonify({"error": "Очередь анализа документов заполнена. Попробуйте позже.",
+                            "retry_after": e.retry_after})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    log.info("Документ поставлен в очередь", filename=upload["filename"], job=job_id)
+    job = document_jobs.get(job_id)
+    return jsonify({
+        "job_id": job_id,
+        "status": job["status"],
+        "position": job.get("position"),
+        "status_url": f"/api/document/jobs/{job_id}",
+        "events_url": f"/api/document/jobs/{job_id}/events",
+    }), 202
+
+@app.route("/api/document/analyze", methods=["POST"])
+def analyze_document_endpoint():
+    """Анализирует загруженный документ (PDF, TXT); form mode=mapreduce|truncate.
+
+    ?async=1 - не ждать анализа: вернуть id задачи (как POST /api/document/jobs).
+    """
+    deadline = Deadline(DOCUMENT_DEADLINE)
+    
+    # Слишком большое тело -> 413 из errorhandler, поэтому до общего try
+    upload, error = read_document_upload()
+    if error:
+        return error
+    
+    # Анализ документа - низший приоритет: чат в очереди допуска идет первым
+    if request.args.get("async") in ("1", "true"):
+        rejected = admit_request(estimate_document_tokens(upload), "document")
+        return rejected or submit_document_job(upload)
+    rejected = admit_request(estimate_document_tokens(upload), "document", deadline)
+    if rejected:
+        return rejected
+    
+    try:
+        # Одинаковые одновременные загрузки (двойной клик, повтор) делят один анализ
+        stream, file_hash = upload["stream"], upload["file_hash"]
+        filename, file_type, current_page, mode = (upload["filename"], upload["file_type"], upload["current_page"],
+                                                   upload["mode"])
+        document_key = make_cache_key(file_hash, filename, file_type, current_page, mode)
+        try:
+            # Анализируем документ с передачей информации о текущей странице
+            result, shared = document_inflight.do(
+                document_key,
+                lambda: analyze_document(stream, filename, file_type, current_page, deadline, mode, file_hash),
+                timeout=deadline.remaining())
+        except TooManyWaiters:
+            return jsonify({"error": "Слишком много одинаковых запросов. Попробуйте позже."}), 429
+        except WaiterTimeout:
+            return jsonify({"error": "Превышено время ожидания анализа. Попробуйте еще раз."}), 504
         
-        # Анализируем документ с передачей информации о текущей странице
-        result = analyze_document(file_content, file.filename, file.content_type, current_page)
+        if shared:
+            log.debug("Результат анализа получен из общего запроса (single-flight)")
         
         if "error" in result:
             return jsonify(result), 400
@@ -678,9 +1205,57 @@ def analyze_document_endpoint():
         })
         
     except Exception as e:
-        print(f"[ERROR] Ошибка при обработке файла: {str(e)}")
+        log.error("Ошибка при обработке файла", exc_info=True)
         return jsonify({"error": f"Ошибка обработки: {str(e)}"}), 500
 
+@app.route("/api/document/jobs", methods=["POST"])
+def create_document_job():
+    """Загружает документ и сразу возвращает id задачи анализа (202)"""
+    upload, error = read_document_upload()
+    if error:
+        return error
+    rejected = admit_request(estimate_document_tokens(upload), "document")
+    return rejected or submit_document_job(upload)
+
+@app.route("/api/document/jobs/<job_id>", methods=["GET"])
+def get_document_job(job_id):
+    """Статус задачи анализа: queued / running / done (с результатом) / failed"""
+    job = document_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    return jsonify(job)
+
+# Как часто слать комментарий в SSE, пока статус задачи не меняется (прокси не закрывают соединение)
+JOB_EVENTS_HEARTBEAT = 15.0
+
+@app.route("/api/document/jobs/<job_id>/events", methods=["GET"])
+def document_job_events(job_id):
+    """SSE: событие status при каждой смене статуса, в конце done (результат) или error"""
+    job = document_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Задача не найдена"}), 404
+    
+    def generate(job):
+        yield sse_event("status", {"status": job["status"], "position": job.get("position"), "timing": job["timing"]})
+        while job["status"] not in FINISHED_STATUSES:
+            status = job["status"]
+            job = document_jobs.wait(job_id, status, JOB_EVENTS_HEARTBEAT)
+            if job is None:
+                yield sse_event("error", {"error": "Задача не найдена"})
+                return
+            if job["status"] == status:
+                yield ": waiting\n\n"
+            else:
+                yield sse_event("status", {"status": job["status"], "position": job.get("position"),
+                                           "timing": job["timing"]})
+        yield sse_event("done" if job["status"] == "done" else "error", job)
+    
+    return Response(
+        stream_with_context(generate(job)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 if __name__ == "__main__":
     print("=" * 50)
@@ -693,8 +1268,18 @@ if __name__ == "__main__":
     print("=" * 50)
     print("\n📋 Доступные эндпоинты:")
     print("  POST /api/neural-action - Чат с AI ассистентом")
+    print("  POST /api/neural-action/stream - Чат с AI ассистентом (SSE стриминг)")
     print("  POST /api/document/analyze - Анализ документов")
+    print("  POST /api/document/jobs - Анализ документов в фоне (id задачи)")
+    print("  GET  /api/document/jobs/<id>[/events] - Статус задачи (JSON или SSE)")
     print("  GET  /api/user/data - Данные пользователя")
+    print("  GET  /api/transactions - Транзакции (фильтры, сортировка, курсор)")
+    print("  GET  /api/dashboard/summary - Сводка для Dashboard")
+    print("  GET  /api/analytics - Сводки для Analytics")
+    print("  GET  /api/stocks/indicators - Индикаторы акций")
+    print("  GET  /api/prompts - Шаблоны системного промпта")
     print("  GET  /api/health - Статус сервера")
+    print("  GET  /api/metrics - Метрики (Prometheus)")
     print("=" * 50)
+    print("Сервер разработки (reloader, один процесс). Для продакшна: python serve.py")
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
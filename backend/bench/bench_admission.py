@@ -0,0 +1,110 @@
+"""Бенчмарк контроля допуска: накладные расходы и поведение под нагрузкой.
+
+1. Время одного решения admit() без ожидания: корзины в памяти и в SQLite.
+2. Флуд: один клиент шлет запросы без пауз, несколько обычных - раз в
+   секунду, все проходят через AdmissionController (вместо модели - пауза).
+   Показывает, сколько запросов дошло до "модели" в секунду (не больше
+   общего лимита), долю отказов у флудера и у обычных пользователей.
+3. Приоритеты: при исчерпанной общей квоте чат и документы ждут вместе -
+   ожидание чата и документов.
+
+Запуск из каталога backend:
+    python bench/bench_admission.py [секунд флуда]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import AdmissionController, AdmissionRejected, MemoryBuckets, SqliteBuckets  # noqa: E402
+
+UPSTREAM_SECONDS = 0.05
+
+
+def overhead(controller, n=5000):
+    start = time.perf_counter()
+    for i in range(n):
+        controller.admit(f"user{i % 100}", 1000, timeout=0)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def flood(duration, users=4):
+    controller = AdmissionController(MemoryBuckets(), user_rps=0.5, user_burst=5, global_rps=5, global_burst=10,
+                                     global_tpm=0, user_tpm=0, queue_size=16,
+                                     max_wait={"chat": 1.0, "document": 1.0})
+    counts = {"flood": [0, 0], "normal": [0, 0]}  # [допущено, отказов]
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client(kind, user, pause):
+        while time.monotonic() < stop:
+            try:
+                controller.admit(user, 1000)
+                time.sleep(UPSTREAM_SECONDS)
+                outcome = 0
+            except AdmissionRejected:
+                outcome = 1
+            with lock:
+                counts[kind][outcome] += 1
+            time.sleep(pause)
+
+    threads = [threading.Thread(target=client, args=("flood", "flooder", 0)) for _ in range(8)]
+    threads += [threading.Thread(target=client, args=("normal", f"user{i}", 1.0)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def priorities(rounds=40):
+    controller = AdmissionController(MemoryBuckets(), user_rps=0, user_tpm=0, global_rps=20, global_burst=1,
+                                     global_tpm=0, queue_size=64, max_wait={"chat": 10.0, "document": 10.0})
+    waits = {"chat": [], "document": []}
+    lock = threading.Lock()
+
+    def client(priority):
+        for _ in range(rounds // 2):
+            waited = controller.admit(priority, 1, priority)
+            with lock:
+                waits[priority].append(waited * 1000)
+
+    threads = [threading.Thread(target=client, args=(priority,)) for priority in ("document", "chat") * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return waits
+
+
+def main():
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+
+    unlimited = {"user_rps": 1e9, "user_burst": 1e9, "global_rps": 1e9, "global_burst": 1e9, "user_tpm": 1e12,
+                 "global_tpm": 1e12}
+    memory_us = overhead(AdmissionController(MemoryBuckets(), **unlimited))
+    with tempfile.TemporaryDirectory(prefix="finbot-admission-") as workdir:
+        sqlite_us = overhead(AdmissionController(SqliteBuckets(os.path.join(workdir, "admission.sqlite3")),
+                                                 **unlimited), 1000)
+    print(f"admit() без ожидания: память {memory_us:.1f} µs, SQLite {sqlite_us:.0f} µs")
+
+    counts = flood(duration)
+    admitted = counts["flood"][0] + counts["normal"][0]
+    print(f"\nФлуд {duration:g} с (общий лимит 5 rps, запас 10; пользователь 0.5 rps, запас 5):")
+    print(f"  до модели дошло {admitted} запросов ({admitted / duration:.1f} rps)")
+    for kind, (ok, rejected) in counts.items():
+        print(f"  {kind}: допущено {ok}, отказов {rejected} ({rejected / max(1, ok + rejected):.0%})")
+
+    waits = priorities()
+    print("\nОбщая квота 20 rps без запаса, по два потока чата и документов:")
+    for priority, values in waits.items():
+        values.sort()
+        print(f"  {priority}: ожидание p50 {statistics.median(values):.0f} ms, max {values[-1]:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
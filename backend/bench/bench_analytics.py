@@ -0,0 +1,98 @@
+"""Бенчмарк: сводки Analytics на NumPy против чистого Python на 1M транзакций.
+
+Запуск из каталога backend:
+    python bench/bench_analytics.py [число транзакций]
+"""
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import Columns, Rollup, compute_rollups  # noqa: E402
+from bench_context import generate_data  # noqa: E402
+
+TAIL = 1000
+
+
+def iso(display_date):
+    return datetime.strptime(display_date, "%d %b %Y").strftime("%Y-%m-%d")
+
+
+def python_rollups(transactions, top_n=10, window=3):
+    """Те же сводки циклами по списку словарей - как в прежнем get_financial_context"""
+    categories = defaultdict(lambda: [0.0, 0.0, 0])
+    months = defaultdict(lambda: [0.0, 0.0, 0])
+    merchants = defaultdict(float)
+    month_category = defaultdict(float)
+    for t in transactions:
+        amount = t["amount"]
+        month = t["month"]
+        income, expense = (amount, 0.0) if amount > 0 else (0.0, -amount)
+        for totals in (categories[t["category"]], months[month]):
+            totals[0] += income
+            totals[1] += expense
+            totals[2] += 1
+        if expense:
+            merchants[t["name"]] += expense
+            month_category[(month, t["category"])] += expense
+    ordered = sorted(months)
+    expenses = [months[m][1] for m in ordered]
+    rolling = [sum(expenses[max(0, i - window + 1):i + 1]) / min(i + 1, window) for i in range(len(expenses))]
+    top = sorted(merchants.items(), key=lambda item: -item[1])[:top_n]
+    last = ordered[-1]
+    past = ordered[-window - 1:-1]
+    variance = {c: month_category[(last, c)] - sum(month_category[(m, c)] for m in past) / max(len(past), 1)
+                for c in categories}
+    return categories, rolling, top, variance
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"Генерация {count} транзакций...")
+    transactions = list(reversed(generate_data(count)["transactions"]))
+    dates = {t["date"]: iso(t["date"]) for t in transactions}
+    for i, t in enumerate(transactions):
+        t["iso"] = dates[t["date"]]
+        t["month"] = t["iso"][:7]
+        t["id"] = i + 1
+    head, tail = transactions[:-TAIL], transactions[-TAIL:]
+
+    def columns_from(rows, columns):
+        columns.extend([t["id"] for t in rows], [t["amount"] for t in rows], [t["iso"] for t in rows],
+                       [t["category"] for t in rows], [t["name"] for t in rows])
+
+    columns = Columns()
+    _, load_ms = timed(lambda: columns_from(head, columns))
+    rollup = Rollup()
+    _, full_ms = timed(lambda: rollup.update(columns))
+    _, derive_ms = timed(lambda: compute_rollups(rollup, columns))
+
+    _, tail_load_ms = timed(lambda: columns_from(tail, columns))
+    _, tail_ms = timed(lambda: rollup.update(columns))
+    result, derive2_ms = timed(lambda: compute_rollups(rollup, columns))
+
+    _, python_ms = timed(lambda: python_rollups(transactions))
+
+    print(f"\nЗагрузка {len(head)} строк в колонки: {load_ms:9.1f} ms (один раз на процесс)")
+    print(f"NumPy: накопление всех строк       {full_ms:9.1f} ms")
+    print(f"NumPy: вывод сводок из матриц      {derive_ms:9.2f} ms")
+    print(f"NumPy: +{TAIL} новых строк (колонки + матрицы) {tail_load_ms + tail_ms:6.2f} ms, "
+          f"сводки {derive2_ms:.2f} ms")
+    print(f"Чистый Python: полный пересчет     {python_ms:9.1f} ms")
+    print(f"\nОбновление после новых транзакций: x{python_ms / (tail_load_ms + tail_ms + derive2_ms):,.0f} быстрее; "
+          f"полный пересчет NumPy: x{python_ms / (full_ms + derive_ms):,.1f}")
+    print(f"Проверка: {result['totals']['count']} транзакций, {len(result['months'])} месяцев")
+
+
+if __name__ == "__main__":
+    main()
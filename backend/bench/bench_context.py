@@ -0,0 +1,102 @@
+"""Бенчмарк: размер финансового контекста и время его сборки на 10 и 10k транзакций.
+
+Сравнивает прежний контекст (все транзакции подряд) с контекстом под
+вопрос в пределах бюджета токенов.
+
+Запуск из каталога backend:
+    python bench/bench_context.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context import FinancialContextBuilder  # noqa: E402
+from ledger import Ledger  # noqa: E402
+from prompts import estimate_tokens  # noqa: E402
+
+MERCHANTS = [
+    ("Salary Payment", "salary", 4200), ("Grocery Shopping", "groceries", -85), ("Pharmacy", "health", -30),
+    ("Coffee Shop", "food", -12), ("Gift Received", "gift", 150), ("Restaurant Nova", "food", -60),
+    ("Uber Ride", "transport", -25), ("Netflix", "subscriptions", -43), ("Spotify", "subscriptions", -20),
+    ("Electricity Bill", "utilities", -180), ("Cinema City", "entertainment", -35), ("Zara", "shopping", -220),
+]
+
+QUESTIONS = [
+    None,
+    "How much did I spend on coffee?",
+    "Show my Netflix payments in March 2025",
+    "Give me budget advice",
+]
+
+
+def generate_data(count, seed=42):
+    """Синтетические данные в формате USER_DATA, от новых к старым"""
+    rng = random.Random(seed)
+    today = datetime(2025, 11, 12)
+    transactions = []
+    for i in range(count):
+        name, category, amount = rng.choice(MERCHANTS)
+        date = today - timedelta(days=i * 730 // max(count, 1))
+        transactions.append({
+            "id": i + 1,
+            "type": "income" if amount > 0 else "expense",
+            "name": name,
+            "amount": round(amount * rng.uniform(0.7, 1.3), 2),
+            "date": date.strftime("%d %b %Y"),
+            "category": category,
+        })
+    return {"balance": 1520.30, "currency": "zł", "card_number": "**** **** **** 1234", "transactions": transactions}
+
+
+def legacy_financial_context(data):
+    """Прежний get_financial_context: все транзакции в промпт"""
+    total_income = sum(t['amount'] for t in data['transactions'] if t['amount'] > 0)
+    total_expenses = sum(abs(t['amount']) for t in data['transactions'] if t['amount'] < 0)
+    context = f"""
+=== USER'S FINANCIAL DATA ===
+Current Balance: {data['balance']} {data['currency']}
+Card Number: {data['card_number']}
+Total Income: {total_income} {data['currency']}
+Total Expenses: {total_expenses} {data['currency']}
+Net Result: {total_income - total_expenses} {data['currency']}
+
+=== RECENT TRANSACTIONS ===
+"""
+    for t in data['transactions']:
+        symbol = "+" if t['amount'] > 0 else "-"
+        context += f"- [{t['date']}] {t['name']}: {symbol}{abs(t['amount'])} {data['currency']} (category: {t['category']})\n"
+    return context
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in (10, 10_000):
+            data = generate_data(count)
+            ledger = Ledger(os.path.join(tmp, f"ledger_{count}.sqlite3"))
+            ledger.seed(data)
+            builder = FinancialContextBuilder(ledger)
+
+            start = time.perf_counter()
+            ledger.summary()
+            cold = time.perf_counter() - start
+
+            legacy = legacy_financial_context(data)
+            legacy_time = timeit.timeit(lambda: legacy_financial_context(data), number=20) / 20
+            print(f"\n{count} транзакций: прежний контекст {estimate_tokens(legacy):7d} токенов, "
+                  f"{legacy_time * 1000:7.2f} ms; агрегаты читаются {cold * 1000:.2f} ms (один раз на процесс)")
+
+            for question in QUESTIONS:
+                context = builder.build(question)
+                number = 200
+                warm = timeit.timeit(lambda: builder.build(question), number=number) / number
+                print(f"  {str(question):42s} {estimate_tokens(context):5d} токенов  {warm * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Бенчмарк: извлечение текста из больших PDF - целиком (как раньше) против
+раннего выхода по бюджету и параллельного разбора диапазонов страниц.
+
+PDF генерируются здесь же (Helvetica, текст договора). Запуск из каталога backend:
+    python bench/bench_documents.py [страниц] [процессов]
+"""
+import os
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from documents import DOCUMENT_CHAR_BUDGET, DocumentExtractor, load_pdf_backend  # noqa: E402
+
+CLAUSE = ("{n}.{line} The Borrower shall repay the loan amount of {amount} PLN with interest of "
+          "{rate}% per annum no later than the {day} day of each month.")
+
+
+def generate_pdf(pages, lines_per_page=45, header=None, footer=None):
+    """Минимальный PDF из pages страниц текста (без внешних библиотек);
+    header/footer - строки-колонтитулы, {n} заменяется номером страницы"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for n in range(1, pages + 1):
+        lines = [CLAUSE.format(n=n, line=i, amount=1000 + n * 7 + i, rate=(n + i) % 15 + 1, day=i % 28 + 1)
+                 for i in range(lines_per_page)]
+        if header:
+            lines.insert(0, header.format(n=n))
+        if footer:
+            lines.append(footer.format(n=n))
+        text = " T* ".join(f"({line})Tj" for line in lines)
+        stream = f"BT /F1 8 Tf 10 TL 30 800 Td {text} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def legacy_extract(content):
+    """Прежний extract_text_from_pdf: все страницы, text += ..."""
+    reader = load_pdf_backend().PdfReader(BytesIO(content))
+    text = ""
+    for page_num in range(len(reader.pages)):
+        text += reader.pages[page_num].extract_text() + "\n"
+    return text.strip()[:DOCUMENT_CHAR_BUDGET]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else min(4, os.cpu_count() or 1)
+    content = generate_pdf(pages)
+    print(f"PDF: {pages} страниц, {len(content) / 1024:.0f} КБ, бюджет {DOCUMENT_CHAR_BUDGET} символов")
+
+    legacy, legacy_ms = timed(lambda: legacy_extract(content))
+    # Без очистки (preprocess.py): сравниваем с сырым текстом прежнего извлечения
+    extractor = DocumentExtractor(workers=workers, parallel_min_pages=1, preprocess=False)
+    budgeted, budget_ms = timed(lambda: extractor.extract(content, "application/pdf"))
+    full, full_ms = timed(lambda: extractor.extract(content, "application/pdf", char_budget=None, token_budget=0))
+
+    serial = DocumentExtractor(workers=0, preprocess=False)
+    serial_full, serial_ms = timed(lambda: serial.extract(content, "application/pdf", char_budget=None))
+    extractor.extract(content, "application/pdf", char_budget=None, token_budget=0)  # пул уже прогрет
+    _, parallel_ms = timed(lambda: extractor.extract(content, "application/pdf", char_budget=None, token_budget=0))
+    extractor.shutdown()
+
+    print(f"\nПрежнее извлечение (все страницы):   {legacy_ms:8.1f} ms")
+    print(f"С бюджетом (ранний выход):           {budget_ms:8.1f} ms, "
+          f"страниц {budgeted['pages_extracted']} из {budgeted['pages_total']}")
+    print(f"Целиком, последовательно:            {serial_ms:8.1f} ms")
+    print(f"Целиком, пул {workers} проц. (с запуском):     {full_ms:8.1f} ms")
+    print(f"Целиком, пул {workers} проц. (прогрет):        {parallel_ms:8.1f} ms")
+    print(f"\nРанний выход: x{legacy_ms / budget_ms:,.0f} быстрее; параллельно: x{serial_ms / parallel_ms:.1f}")
+
+    assert budgeted["text"].startswith(legacy[:DOCUMENT_CHAR_BUDGET - 100])
+    assert full["text"] == serial_full["text"] and full["pages_extracted"] == pages
+    print(f"Проверка: текст совпадает с прежним, целиком {full['chars']} символов")
+    print(f"Счетчики: {extractor.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Проверка и бенчмарк fast-path: какие вопросы отвечаются локально, какие уходят в LLM.
+
+CASES - вопросы с ожидаемым интентом (None - отдать модели), в том числе
+фразы, на которые fast-path раньше уверенно отвечал неверно: период или
+дата, неизвестная категория или получатель, balance/received/заработ не
+про счет. Скрипт падает (exit 1), если классификация разошлась с
+ожиданием, и печатает время одного ответа.
+
+Запуск из каталога backend:
+    python bench/bench_fastpath.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_context import generate_data  # noqa: E402
+from fastpath import FastPathEngine  # noqa: E402
+from ledger import Ledger  # noqa: E402
+
+CASES = [
+    # Отвечаем локально
+    ("What's my balance?", "balance"),
+    ("what is my current balance", "balance"),
+    ("How much money do I have?", "balance"),
+    ("How much money is on my card?", "balance"),
+    ("Какой у меня баланс?", "balance"),
+    ("Jakie jest moje saldo?", "balance"),
+    ("How much did I spend?", "total_expenses"),
+    ("What are my total expenses?", "total_expenses"),
+    ("Мои расходы", "total_expenses"),
+    ("What is my total income?", "total_income"),
+    ("How much have I earned?", "total_income"),
+    ("Ile zarobiłem?", "total_income"),
+    ("How much did I spend on food?", "category_expenses"),
+    ("How much did I spend on coffee?", "category_expenses"),
+    ("Сколько я потратил на еду?", "category_expenses"),
+    ("Сколько я потратил в аптеке?", "category_expenses"),
+    ("Ile wydałem na jedzenie?", "category_expenses"),
+    ("What is my income from salary?", "category_income"),
+    ("What was my biggest expense?", "largest_expense"),
+    ("Какая самая большая трата?", "largest_expense"),
+    ("Show my last 3 transactions", "last_transactions"),
+    ("Покажи последние 5 транзакций", "last_transactions"),
+    ("Pokaż ostatnie 5 transakcji", "last_transactions"),
+    # Период или дата
+    ("How much did I spend last month?", None),
+    ("How much did I spend in November?", None),
+    ("How much did I spend this week?", None),
+    ("Сколько я потратил в октябре?", None),
+    ("Ile wydałem w tym miesiącu?", None),
+    ("What did I spend on 12.11?", None),
+    # Категория или получатель, которых нет в журнале
+    ("How much did I spend on rent?", None),
+    ("How much did I spend on Netflix?", None),
+    ("Сколько я потратил на ремонт?", None),
+    ("Ile wydałem na czynsz?", None),
+    # Не про счет или не только факт
+    ("Is my spending too high?", None),
+    ("I received an email about a suspicious login", None),
+    ("what is my income tax rate", None),
+    ("Сколько я заработал на акциях?", None),
+    ("what is a balance sheet", None),
+    ("what's the balance of risk in my stock portfolio", None),
+    ("Give me budget advice", None),
+    ("Open analytics", None),
+]
+
+
+def main():
+    with tempfile.TemporaryDirectory(prefix="finbot-fastpath-") as workdir:
+        ledger = Ledger(os.path.join(workdir, "ledger.sqlite3"))
+        ledger.seed(generate_data(200))
+        engine = FastPathEngine()
+
+        failures = []
+        for question, expected in CASES:
+            answer = engine.answer(question, ledger)
+            intent = answer["intent"] if answer else None
+            if intent != expected:
+                failures.append((question, expected, intent))
+        answered = sum(expected is not None for _, expected in CASES)
+        print(f"Вопросов: {len(CASES)}, локально: {answered}, в LLM: {len(CASES) - answered}; "
+              f"расхождений: {len(failures)}")
+        for question, expected, intent in failures:
+            print(f"  {question!r}: ожидали {expected}, получили {intent}")
+
+        for question in ("How much did I spend on coffee?", "what's the balance of risk in my stock portfolio"):
+            seconds = min(timeit.repeat(lambda: engine.answer(question, ledger), number=2000, repeat=3)) / 2000
+            print(f"  {question!r}: {seconds * 1e6:.1f} µs")
+        ledger.close()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
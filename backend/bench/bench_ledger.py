@@ -0,0 +1,78 @@
+"""Бенчмарк журнала транзакций на 100k+ записей против прежнего словаря USER_DATA.
+
+Запуск из каталога backend:
+    python bench/bench_ledger.py [число транзакций]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_context import generate_data, legacy_financial_context  # noqa: E402
+from context import FinancialContextBuilder  # noqa: E402
+from ledger import Ledger  # noqa: E402
+
+BATCH = 10_000
+
+
+def legacy_totals(data):
+    """Прежний подсчет итогов: два прохода генераторами по всем транзакциям"""
+    total_income = sum(t['amount'] for t in data['transactions'] if t['amount'] > 0)
+    total_expenses = sum(abs(t['amount']) for t in data['transactions'] if t['amount'] < 0)
+    return total_income, total_expenses
+
+
+def measure(fn, number):
+    return timeit.timeit(fn, number=number) / number * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    data = generate_data(count)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = Ledger(os.path.join(tmp, "ledger.sqlite3"))
+        ledger.create_account(balance=data["balance"], currency=data["currency"], card_number=data["card_number"])
+        history = list(reversed(data["transactions"]))
+
+        start = time.perf_counter()
+        for i in range(0, count, BATCH):
+            ledger.append_many(history[i:i + BATCH])
+        load = time.perf_counter() - start
+        print(f"{count} транзакций загружено за {load:.2f} s ({count / load:,.0f} tx/s, пачки по {BATCH})")
+
+        ledger.summary()
+        single = []
+        for i in range(200):
+            start = time.perf_counter()
+            ledger.append({"name": "Coffee Shop", "amount": -9.5, "date": "13 Nov 2025", "category": "food"})
+            single.append(time.perf_counter() - start)
+        single.sort()
+        print(f"Одна вставка с обновлением агрегатов: p50 {single[100] * 1000:.3f} ms, p95 {single[190] * 1000:.3f} ms")
+
+        builder = FinancialContextBuilder(ledger)
+        rows = [
+            ("Итоги (баланс, доход, расход)", lambda: ledger.summary(), lambda: legacy_totals(data), 2000, 5),
+            ("Финансовый контекст для промпта", lambda: builder.build("How much did I spend on coffee?"),
+             lambda: legacy_financial_context(data), 200, 3),
+            ("/api/user/data (последние 50)", lambda: json.dumps(ledger.user_data(limit=50), ensure_ascii=False),
+             lambda: json.dumps(data, ensure_ascii=False), 200, 3),
+        ]
+        print(f"\n{'операция':36s} {'журнал':>12s} {'USER_DATA':>12s}")
+        for label, new, old, new_number, old_number in rows:
+            new_ms = measure(new, new_number)
+            old_ms = measure(old, old_number)
+            print(f"{label:36s} {new_ms:9.3f} ms {old_ms:9.3f} ms  x{old_ms / new_ms:,.0f}")
+
+        start = time.perf_counter()
+        Ledger(ledger.path).summary()
+        print(f"\nЧтение агрегатов новым процессом (холодный старт): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Бенчмарк: сколько стоит строка лога и замер метрики в потоке запроса.
+
+Было: print(f"[DEBUG] ...") прямо в stdout. Когда stdout - терминал или
+pipe в сборщик логов, который не успевает, print ждет запись. Здесь
+медленный stdout имитируется потоком с паузой WRITE_DELAY на запись.
+Стало: log.info() кладет запись в очередь (logs.py), а в stdout пишет
+отдельный поток; выключенный log.debug - одно сравнение уровня.
+
+Запуск из каталога backend:
+    python bench/bench_logging.py [записей]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logs  # noqa: E402
+from metrics import Histogram  # noqa: E402
+
+WRITE_DELAY = 0.0002  # 200 мкс на запись: перегруженный pipe/терминал
+
+PROMPT = "Сколько я потратил на продукты в этом месяце и как сократить расходы? " * 3
+
+
+class SlowStream(io.StringIO):
+    def write(self, text):
+        time.sleep(WRITE_DELAY)
+        return super().write(text)
+
+    def flush(self):
+        pass
+
+
+def per_call_us(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    slow = SlowStream()
+
+    def legacy():
+        print(f"[DEBUG] Получен запрос: {PROMPT}", file=slow)
+        print(f"[DEBUG] Текущая страница: dashboard", file=slow)
+
+    logs.LOG_QUEUE_SIZE = count * 2  # в бенчмарке ничего не выбрасываем
+    logs.setup_logging(level="INFO", stream=slow)
+    log = logs.get_logger("bench")
+
+    legacy_us = per_call_us(legacy, count)
+    info_us = per_call_us(lambda: log.info("Запрос к модели", chars=len(PROMPT), page="dashboard"), count)
+    debug_us = per_call_us(lambda: log.debug("Запрос к модели", chars=len(PROMPT), page="dashboard"), count)
+    histogram = Histogram("bench_seconds", "bench", ("model",))
+    observe_us = per_call_us(lambda: histogram.observe(0.012, model="openai/gpt-4o-mini"), count)
+
+    flush_start = time.perf_counter()
+    logs.shutdown_logging()
+    flush_ms = (time.perf_counter() - flush_start) * 1000
+
+    print(f"Записей: {count}, медленный stdout: {WRITE_DELAY * 1e6:.0f} мкс на запись")
+    print(f"print() полного промпта (как было):  {legacy_us:8.1f} мкс на запрос")
+    print(f"log.info() через очередь:            {info_us:8.1f} мкс на запрос")
+    print(f"log.debug() при LOG_LEVEL=INFO:      {debug_us:8.2f} мкс на запрос")
+    print(f"Histogram.observe():                 {observe_us:8.2f} мкс")
+    print(f"Поток-писатель дописал очередь за {flush_ms:.0f} ms (вне запросов); выброшено: {logs.stats()['dropped']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Бенчмарк: сколько символов и токенов уходит в модель с очисткой
+(preprocess.py) и без нее - HTML выписка, markdown отчет и PDF договор
+с колонтитулами. Для каждого документа: символы/токены всего текста,
+число кусков map-reduce (= запросов к модели) и время извлечения.
+
+Запуск из каталога backend:
+    python bench/bench_preprocess.py [строк таблицы] [страниц PDF]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_documents import generate_pdf  # noqa: E402
+from documents import DocumentExtractor  # noqa: E402
+from prompts import estimate_tokens  # noqa: E402
+from summarize import split_chunks  # noqa: E402
+
+STYLE = "<style>" + " ".join(f".c{i} {{ margin: {i}px; color: #{i:06x}; }}" for i in range(200)) + "</style>"
+SCRIPT = "<script>" + "window.dataLayer = window.dataLayer || []; function gtag(){dataLayer.push(arguments);} " * 40 + "</script>"
+
+
+def generate_html(rows):
+    """Выписка из интернет-банка: меню, стили, скрипты и таблица операций"""
+    table = "\n".join(
+        f'<tr class="row c{i % 200}">\n    <td class="date">  2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}  </td>\n'
+        f'    <td class="desc"><span title="Payment">Card payment   MERCHANT {i % 97}</span></td>\n'
+        f'    <td class="amount">&nbsp;-{(i * 37) % 1000}.{i % 100:02d}&nbsp;PLN</td>\n</tr>'
+        for i in range(rows))
+    nav = "".join(f'<li><a href="/section/{i}" class="nav-link">Section {i}</a></li>' for i in range(30))
+    return (f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Statement</title>{STYLE}{SCRIPT}</head>"
+            f"<body><nav><ul>{nav}</ul></nav><main><h1>Account statement</h1>"
+            f"<table>\n<tr><th>Date</th><th>Description</th><th>Amount</th></tr>\n{table}\n</table></main>"
+            f"{SCRIPT}</body></html>")
+
+
+def generate_markdown(rows):
+    """Отчет в markdown: заголовки, выделение, ссылки и выровненная таблица"""
+    parts = ["# Monthly report", "", "![logo](https://example.com/logo.png)", ""]
+    for section in range(rows // 50):
+        parts += [f"## Section {section}", "",
+                  f"Spending in **section {section}** was _higher_ than in [last month](https://example.com/r/{section}).",
+                  "", "| Date       | Merchant          | Amount     |", "|:-----------|:------------------|-----------:|"]
+        parts += [f"| 2024-01-{i % 28 + 1:02d} | MERCHANT {i % 97:<8} | {(i * 37) % 1000:>8}.00 |" for i in range(50)]
+        parts += ["", "---", ""]
+    return "\n".join(parts)
+
+
+def measure(name, content, file_type):
+    row = {}
+    for label, preprocess in (("raw", False), ("clean", True)):
+        extractor = DocumentExtractor(preprocess=preprocess)
+        start = time.perf_counter()
+        result = extractor.extract(content, file_type, char_budget=None, token_budget=0)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        text = result["text"]
+        row[label] = (len(text), estimate_tokens(text), len(split_chunks(text)), elapsed_ms, result["preprocess"])
+    (raw_chars, raw_tokens, raw_chunks, raw_ms, _), (chars, tokens, chunks, ms, stats) = row["raw"], row["clean"]
+    print(f"{name:<9} символов {raw_chars:>8} -> {chars:>8}   токенов ~{raw_tokens:>7} -> ~{tokens:>7} "
+          f"({100 - tokens * 100 // max(raw_tokens, 1)}% меньше)   кусков map {raw_chunks:>3} -> {chunks:>3}   "
+          f"извлечение {raw_ms:6.1f} -> {ms:6.1f} ms")
+    if stats.get("duplicate_lines"):
+        print(f"{'':<9} колонтитулов выброшено: {stats['duplicate_lines']} строк")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    measure("html", generate_html(rows).encode(), "text/html")
+    measure("markdown", generate_markdown(rows).encode(), "text/markdown")
+    pdf = generate_pdf(pages, header="ACME Bank S.A.    Loan agreement No. 2024/117    Confidential",
+                       footer="Page {n} of " + str(pages))
+    measure("pdf", pdf, "application/pdf")
+
+
+if __name__ == "__main__":
+    main()
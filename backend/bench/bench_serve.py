@@ -0,0 +1,102 @@
+"""Бенчмарк serve.py: время старта, память воркеров и пропускная способность по числу воркеров.
+
+Для каждого числа воркеров запускает serve.py, ждет первого ответа
+/api/health, снимает rss/pss мастера и воркеров из /proc и гоняет
+GET /api/user/data замкнутым циклом (как loadtest.py). Для сравнения
+память одного процесса, который импортирует back.py сам, без предзагрузки
+(столько стоил бы каждый воркер без fork от общего мастера), и время
+импорта back.py с отложенным импортом PyPDF2.
+
+Запуск из каталога backend:
+    python bench/bench_serve.py [воркеры через запятую] [секунд нагрузки]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from loadtest import free_port, run_scenario, user_data_request, wait_ready  # noqa: E402
+from metrics import process_memory  # noqa: E402
+
+CONCURRENCY = 16
+
+IMPORT_PROBE = ("import sys, time; start = time.perf_counter(); import back; "
+                "print(round((time.perf_counter() - start) * 1000, 1), 'PyPDF2' in sys.modules, "
+                "__import__('metrics').process_memory()['rss'])")
+
+
+def bench_env(workdir):
+    return dict(os.environ, OPENROUTER_API_KEY="bench", LEDGER_PATH=os.path.join(workdir, "ledger.sqlite3"),
+                JOBS_PATH=os.path.join(workdir, "jobs.sqlite3"), DOCUMENT_CACHE_BACKEND="off", LOG_LEVEL="WARNING")
+
+
+def children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def mb(value):
+    return value / 1024 / 1024 if value is not None else float("nan")
+
+
+def run(workers, duration, env):
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "serve.py"), "--host", "127.0.0.1",
+                                "--port", str(port), "--workers", str(workers)], cwd=BACKEND_DIR, env=env)
+    try:
+        base = f"http://127.0.0.1:{port}"
+        wait_ready(f"{base}/api/health", process)
+        ready_ms = (time.perf_counter() - start) * 1000
+        # Первый ответ может прийти, пока остальные воркеры еще запускаются
+        deadline = time.monotonic() + 10
+        while len(children(process.pid)) < workers and time.monotonic() < deadline:
+            time.sleep(0.05)
+        master = process_memory(process.pid) or {}
+        workers_memory = [process_memory(pid) or {} for pid in children(process.pid)]
+        result = run_scenario(base, user_data_request, CONCURRENCY, duration, 30)
+        httpx.get(f"{base}/api/health")
+        return ready_ms, master, workers_memory, result
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def main():
+    counts = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else f"1,{max(2, os.cpu_count() or 1)}").split(",")]
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    with tempfile.TemporaryDirectory(prefix="finbot-serve-") as workdir:
+        env = bench_env(workdir)
+        probe = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=BACKEND_DIR, env=env,
+                               capture_output=True, text=True, check=True).stdout.split()
+        import_ms, pdf_loaded, standalone_rss = float(probe[0]), probe[1] == "True", int(probe[2])
+        print(f"Ядер: {os.cpu_count()}; import back: {import_ms:.0f} ms, PyPDF2 загружен при импорте: {pdf_loaded}; "
+              f"отдельный процесс без предзагрузки: rss {mb(standalone_rss):.1f} MB")
+
+        for workers in counts:
+            ready_ms, master, memory, result = run(workers, duration, env)
+            rss = [mb(m.get("rss")) for m in memory]
+            pss = [mb(m.get("pss")) for m in memory]
+            latency = result["latency_ms"]
+            print(f"\nВоркеров: {workers}: первый ответ через {ready_ms:.0f} ms; мастер rss {mb(master.get('rss')):.1f} MB")
+            print(f"  воркеры rss: {', '.join(f'{v:.1f}' for v in rss)} MB; "
+                  f"pss: {', '.join(f'{v:.1f}' for v in pss)} MB (сумма pss {sum(pss):.1f} MB против "
+                  f"{mb(standalone_rss) * workers:.1f} MB у {workers} отдельных процессов)")
+            print(f"  /api/user/data, {CONCURRENCY} клиентов: {result['throughput_rps']:.0f} rps, "
+                  f"p50 {latency['p50']} ms, p99 {latency['p99']} ms, ошибок {result['error_rate']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Бенчмарк сессий: размер истории в промпте и память сессии на длинном разговоре.
+
+Разговор из N ходов (вопросы и ответы разной длины) проходит через
+SessionStore так же, как через /api/neural-action: messages() перед
+запросом, record() после ответа и compact(), когда record() попросил.
+Для сравнения - наивная история, которая пересылает все ходы целиком.
+Печатает токены истории на ходу (максимум и последний), сколько раз
+менялось начало списка сообщений (сбрасывается кеш промпта провайдера),
+размер сессии, время операций, а также вытеснение из LRU и подъем
+сессий из SQLite.
+
+Запуск из каталога backend:
+    python bench/bench_sessions.py [ходов] [сессий для LRU]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompts import estimate_tokens  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+
+TOPICS = ("groceries", "rent", "salary", "savings goal", "restaurants", "subscriptions", "travel budget", "health")
+
+
+def make_turn(rng, i):
+    topic = rng.choice(TOPICS)
+    question = f"How did my {topic} spending change this month and what should I do about it? (question {i})"
+    sentences = [f"Your {topic} expenses are {rng.randint(10, 900)} zł this month." for _ in range(rng.randint(2, 12))]
+    return question, " ".join(sentences)
+
+
+def history_tokens(messages):
+    return sum(estimate_tokens(m["content"]) for m in messages)
+
+
+def conversation(store, turns, seed=1):
+    rng = random.Random(seed)
+    session = store.get_or_create(None)
+    naive_tokens = 0
+    ours, prefix_changes, previous_head = [], 0, None
+    timings = {"messages": 0.0, "record": 0.0, "compact": 0.0}
+    for i in range(turns):
+        question, answer = make_turn(rng, i)
+        start = time.perf_counter()
+        messages = store.messages(session)
+        timings["messages"] += time.perf_counter() - start
+        ours.append(history_tokens(messages))
+        head = messages[0]["content"] if messages else None
+        if head != previous_head and previous_head is not None:
+            prefix_changes += 1
+        previous_head = head
+
+        start = time.perf_counter()
+        needs_compaction = store.record(session, question, answer)
+        timings["record"] += time.perf_counter() - start
+        naive_tokens += estimate_tokens(question) + estimate_tokens(answer) + 8
+        if needs_compaction:
+            start = time.perf_counter()
+            store.compact(session)
+            timings["compact"] += time.perf_counter() - start
+    return session, ours, naive_tokens, prefix_changes, timings
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    store = SessionStore(path="")
+    session, ours, naive_tokens, prefix_changes, timings = conversation(store, turns)
+    stats = store.stats()
+    print(f"Ходов: {turns}; история в промпте: максимум {max(ours)} токенов, последний ход {ours[-1]} "
+          f"(наивная полная история: {naive_tokens} токенов)")
+    print(f"  сворачиваний: {stats['compactions']}, начало истории менялось {prefix_changes} раз; "
+          f"сессия в памяти: {len(session.to_json().encode()) / 1024:.1f} KB")
+    for name, total in timings.items():
+        print(f"  {name}: {total / turns * 1e6:.1f} µs на ход")
+
+    with tempfile.TemporaryDirectory(prefix="finbot-sessions-") as workdir:
+        path = os.path.join(workdir, "sessions.sqlite3")
+        store = SessionStore(max_active=sessions // 4, path=path)
+        ids = []
+        start = time.perf_counter()
+        for i in range(sessions):
+            session = store.get_or_create(None)
+            store.record(session, f"question {i}", f"answer {i}")
+            ids.append(session.id)
+        created = time.perf_counter() - start
+        start = time.perf_counter()
+        restored = sum(store.get_or_create(session_id).id == session_id for session_id in ids[: sessions // 4])
+        elapsed = time.perf_counter() - start
+        stats = store.stats()
+        print(f"\nLRU на {stats['max_active']} сессий, SQLite: {sessions} сессий по {created / sessions * 1e6:.0f} µs "
+              f"(с записью), вытеснено {stats['evicted']}, в памяти {stats['active']}")
+        print(f"  вытесненные сессии подняты из SQLite: {restored} из {sessions // 4}, "
+              f"{elapsed / (sessions // 4) * 1e6:.0f} µs на сессию")
+
+
+if __name__ == "__main__":
+    main()
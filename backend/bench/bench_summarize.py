@@ -0,0 +1,80 @@
+"""Бенчмарк: map-reduce анализ документа - время от числа страниц и лимита параллельности.
+
+Вызов модели заменен функцией с задержкой LATENCY секунд (как ответ LLM),
+поэтому сеть и ключ не нужны. Запуск из каталога backend:
+    python bench/bench_summarize.py [задержка, с]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_documents import CLAUSE  # noqa: E402
+from retry import Deadline  # noqa: E402
+from summarize import ChunkFailed, DocumentSummarizer, split_chunks  # noqa: E402
+
+LINES_PER_PAGE = 45
+
+
+def generate_text(pages):
+    lines = [CLAUSE.format(n=n, line=i, amount=1000 + n * 7 + i, rate=(n + i) % 15 + 1, day=i % 28 + 1)
+             for n in range(1, pages + 1) for i in range(LINES_PER_PAGE)]
+    lines.append("Early termination fee: 4999 PLN payable within 14 days of notice.")
+    return "\n".join(lines)
+
+
+def fake_model(latency):
+    calls = []
+
+    def complete(prompt, deadline, page=None):
+        calls.append(len(prompt))
+        if deadline.remaining() < latency:
+            time.sleep(deadline.remaining())
+            raise ChunkFailed("timeout")
+        time.sleep(latency)
+        if prompt.startswith("Below are notes"):
+            return "summary: " + ("4999 PLN" if "4999" in prompt else "no termination fee")
+        return "notes: " + ("termination fee 4999 PLN" if "4999" in prompt else "none")
+
+    return complete, calls
+
+
+def run(pages, concurrency, latency, deadline=120.0, reduce_seconds=None):
+    complete, calls = fake_model(latency)
+    summarizer = DocumentSummarizer(complete, concurrency=concurrency,
+                                    reduce_seconds=latency * 2 if reduce_seconds is None else reduce_seconds)
+    start = time.perf_counter()
+    result = summarizer.summarize("contract.pdf", generate_text(pages), Deadline(deadline))
+    return result, (time.perf_counter() - start) * 1000, len(calls)
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    print(f"Задержка модели: {latency * 1000:.0f} ms на запрос")
+
+    print("\nЧисло страниц (параллельность 8):")
+    for pages in (25, 100, 300):
+        result, ms, calls = run(pages, 8, latency)
+        print(f"  {pages:4d} стр.: {result['chunks']:3d} фрагментов, {calls:3d} запросов, {ms:8.0f} ms"
+              f" -> {result['summary']}")
+
+    chunks = len(split_chunks(generate_text(300)))
+    print(f"\nЛимит параллельности (300 стр., {chunks} фрагментов; "
+          f"ожидание ~ ceil(фрагменты / лимит) + 1 свод = запросов подряд):")
+    base = None
+    for concurrency in (1, 2, 4, 8, 16):
+        result, ms, calls = run(300, concurrency, latency)
+        base = base or ms
+        expected = (-(-chunks // concurrency) + 1) * latency * 1000
+        print(f"  {concurrency:2d}: {ms:8.0f} ms (оценка {expected:6.0f} ms), ускорение x{base / ms:.1f}")
+
+    budget = latency * 8
+    result, ms, calls = run(300, 4, latency, deadline=budget, reduce_seconds=latency * 2)
+    print(f"\nДедлайн {budget * 1000:.0f} ms: ответ за {ms:.0f} ms, фрагментов {result['chunks_done']} из "
+          f"{result['chunks']}, partial={result['partial']} -> {result['summary']}")
+
+
+if __name__ == "__main__":
+    main()
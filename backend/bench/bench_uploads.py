@@ -0,0 +1,129 @@
+"""Бенчмарк: пиковая память сервера при 50 одновременных загрузках PDF по 10 МБ.
+
+legacy    - как раньше: file.read() целиком в память, хеш и разбор по байтам;
+streaming - uploads.py: лимит по ходу чтения, временный файл, хеш и
+            разбор PDF прямо из временного файла.
+Каждый режим запускается в отдельном процессе сервера (пиковый RSS не сбрасывается).
+Запуск из каталога backend:
+    python bench/bench_uploads.py [загрузок] [МБ]
+"""
+import hashlib
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+
+HOLD_SECONDS = 0.5  # пока "идет запрос к модели", обработчик держит загрузку
+PORT = 5071
+
+
+def rss_mb():
+    """Пиковый RSS процесса: VmHWM (ru_maxrss на Linux наследуется от родителя через fork+exec)"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def serve(mode, port):
+    from flask import Flask, jsonify, request
+    from werkzeug.serving import make_server
+
+    from documents import DocumentExtractor
+    from uploads import MAX_DOCUMENT_BYTES, SpoolingRequest, hash_upload, limit_document_upload
+
+    app = Flask(__name__)
+    extractor = DocumentExtractor()
+    if mode == "streaming":
+        app.request_class = SpoolingRequest
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        if mode == "legacy":
+            content = request.files["file"].read()
+            if len(content) > MAX_DOCUMENT_BYTES:
+                return jsonify({"error": "too large"}), 400
+            file_hash = hashlib.sha256(content).hexdigest()
+            extraction = extractor.extract(content, "application/pdf")
+        else:
+            limit_document_upload(request)
+            stream = request.files["file"].stream
+            size, file_hash = hash_upload(stream)
+            extraction = extractor.extract(stream, "application/pdf")
+        time.sleep(HOLD_SECONDS)
+        return jsonify({"hash": file_hash[:12], "chars": extraction["chars"]})
+
+    @app.route("/rss")
+    def rss():
+        return jsonify({"rss_mb": rss_mb()})
+
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    print("ready", flush=True)
+    server.serve_forever()
+
+
+def run(mode, payload, uploads):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode, str(PORT)],
+                               stdout=subprocess.PIPE, text=True)
+    try:
+        process.stdout.readline()
+        base = f"http://127.0.0.1:{PORT}"
+        idle = httpx.get(f"{base}/rss").json()["rss_mb"]
+        statuses = []
+
+        def send():
+            response = httpx.post(f"{base}/upload", files={"file": ("doc.pdf", payload, "application/pdf")},
+                                  timeout=120)
+            statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=send) for _ in range(uploads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        peak = httpx.get(f"{base}/rss").json()["rss_mb"]
+        return idle, peak, elapsed, statuses
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(sys.argv[2], int(sys.argv[3]))
+        return
+
+    from bench_documents import generate_pdf
+
+    uploads = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    megabytes = float(sys.argv[2]) if len(sys.argv) > 2 else 9.5
+    payload = generate_pdf(int(megabytes * 1024 / 6.25))
+    print(f"{uploads} одновременных загрузок PDF по {len(payload) / 1024 / 1024:.1f} МБ")
+
+    results = {}
+    for mode in ("legacy", "streaming"):
+        idle, peak, elapsed, statuses = run(mode, payload, uploads)
+        results[mode] = peak - idle
+        ok = statuses.count(200)
+        print(f"  {mode:9s}: RSS {idle:6.0f} -> пик {peak:6.0f} МБ (+{peak - idle:5.0f} МБ), "
+              f"{elapsed:5.1f} с, успешно {ok}/{uploads}")
+    print(f"\nПрирост пиковой памяти меньше в x{results['legacy'] / max(results['streaming'], 1):.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Локальная замена OpenRouter chat completions для бенчмарков и нагрузочных тестов.
+
+Отвечает в формате OpenRouter (обычный JSON и stream: true - SSE чанками)
+с задержкой из заданного распределения и может подмешивать 429/5xx с
+Retry-After. Бэкенд направляется сюда через OPENROUTER_API_URL:
+
+    python bench/fake_openrouter.py --port 5090 --latency lognormal:0.8:0.5 --rate-429 0.05
+    OPENROUTER_API_URL=http://127.0.0.1:5090/api/v1/chat/completions OPENROUTER_API_KEY=bench python back.py
+
+Распределения задержки (секунды, до заголовков ответа):
+    fixed:0.5            всегда 0.5
+    uniform:0.2:1.0      равномерно от 0.2 до 1.0
+    lognormal:0.8:0.5    логнормальное, медиана 0.8, sigma 0.5 (длинный хвост, как у LLM)
+    exp:0.5              экспоненциальное со средним 0.5
+При стриминге токены идут с паузой --token-interval после первой задержки.
+
+GET /stats - счетчики сервера (запросы по моделям и кодам ответа) в JSON.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_PATH = "/api/v1/chat/completions"
+SERVER_ERRORS = (500, 502, 503)
+
+WORDS = ("Based on your recent transactions, your spending on groceries is stable. Consider setting a monthly "
+         "budget for restaurants and review subscriptions you no longer use. Your balance covers planned "
+         "expenses for the next weeks.").split()
+
+
+def parse_latency(spec):
+    """Строка распределения -> функция sample(rng) в секундах"""
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    if kind == "exp" and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+class FakeOpenRouter:
+    """Поведение сервера: задержки, ошибки и счетчики (общие для всех потоков)"""
+
+    def __init__(self, latency="lognormal:0.8:0.5", token_interval=0.02, tokens=60, rate_429=0.0,
+                 rate_5xx=0.0, retry_after=1.0, fail_models=(), seed=None):
+        self.sample_latency = parse_latency(latency)
+        self.latency = latency
+        self.token_interval = token_interval
+        self.tokens = tokens
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.fail_models = set(fail_models)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def decide(self, model):
+        """(код ответа, задержка до заголовков)"""
+        with self._lock:
+            roll = self._rng.random()
+            latency = max(0.0, self.sample_latency(self._rng))
+        if model in self.fail_models:
+            status = 503
+        elif roll < self.rate_429:
+            status = 429
+        elif roll < self.rate_429 + self.rate_5xx:
+            status = SERVER_ERRORS[int(roll * 1000) % len(SERVER_ERRORS)]
+        else:
+            status = 200
+        return status, latency
+
+    def count(self, model, status):
+        with self._lock:
+            by_status = self.counts.setdefault(model, {})
+            by_status[str(status)] = by_status.get(str(status), 0) + 1
+
+    def stats(self):
+        with self._lock:
+            counts = {model: dict(statuses) for model, statuses in self.counts.items()}
+        return {
+            "requests": sum(sum(statuses.values()) for statuses in counts.values()),
+            "by_model": counts,
+            "config": {"latency": self.latency, "token_interval": self.token_interval, "tokens": self.tokens,
+                       "rate_429": self.rate_429, "rate_5xx": self.rate_5xx, "retry_after": self.retry_after,
+                       "fail_models": sorted(self.fail_models)},
+        }
+
+    def answer_words(self):
+        return [WORDS[i % len(WORDS)] + " " for i in range(self.tokens)]
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive: бэкенд держит пул соединений
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _chunk(self, text):
+            data = text.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._json(200, fake.stats())
+            else:
+                self._json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path != CHAT_PATH:
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self._json(400, {"error": {"message": "invalid JSON"}})
+                return
+            model = payload.get("model", "unknown")
+            status, latency = fake.decide(model)
+            time.sleep(latency)
+            fake.count(model, status)
+
+            if status != 200:
+                headers = {"Retry-After": f"{fake.retry_after:g}"} if status in (429, 503) else None
+                self._json(status, {"error": {"message": f"injected {status}", "code": status}}, headers)
+                return
+
+            completion_id = f"gen-{uuid.uuid4().hex[:16]}"
+            words = fake.answer_words()
+            if not payload.get("stream"):
+                self._json(200, {
+                    "id": completion_id,
+                    "model": model,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(words).strip()}}],
+                    "usage": {"prompt_tokens": len(body) // 4, "completion_tokens": len(words)},
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                self._chunk(": OPENROUTER PROCESSING\n\n")
+                for word in words:
+                    if fake.token_interval:
+                        time.sleep(fake.token_interval)
+                    chunk = {"id": completion_id, "model": model, "choices": [{"index": 0, "delta": {"content": word}}]}
+                    self._chunk(f"data: {json.dumps(chunk)}\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Клиент получил [DONE] или ушел раньше - это нормально
+                self.close_connection = True
+
+    return Handler
+
+
+def create_server(fake, host="127.0.0.1", port=5090):
+    """HTTP сервер (port=0 - свободный порт); запуск - server.serve_forever()"""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена OpenRouter chat completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5090)
+    parser.add_argument("--latency", default="lognormal:0.8:0.5", help="распределение задержки до заголовков")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="пауза между токенами стрима, с")
+    parser.add_argument("--tokens", type=int, default=60, help="длина ответа в словах")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="доля ответов 500/502/503")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After для 429/503, с")
+    parser.add_argument("--fail-models", default="", help="модели через запятую, которые всегда отвечают 503")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakeOpenRouter(args.latency, args.token_interval, args.tokens, args.rate_429, args.rate_5xx,
+                          args.retry_after, [m for m in args.fail_models.split(",") if m], args.seed)
+    print(f"Fake OpenRouter: http://{args.host}:{args.port}{CHAT_PATH} (latency {args.latency}, "
+          f"429 {args.rate_429:.0%}, 5xx {args.rate_5xx:.0%})", flush=True)
+    create_server(fake, args.host, args.port).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
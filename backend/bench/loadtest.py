@@ -0,0 +1,389 @@
+"""Нагрузочный тест бэкенда без сети: OpenRouter заменен fake_openrouter.py.
+
+Поднимает локальную замену OpenRouter и бэкенд (serve.py с --workers
+воркерами, OPENROUTER_API_URL указывает на замену), затем по очереди гоняет
+сценарии замкнутым циклом: --concurrency клиентов, каждый шлет следующий
+запрос сразу после ответа, --duration секунд на сценарий.
+
+Сценарии:
+    chat           POST /api/neural-action (уникальные вопросы, мимо кеша и fast path)
+    chat-stream    POST /api/neural-action?stream=1, отдельно время до первой дельты
+    document       POST /api/document/analyze, сгенерированные PDF на --pages страниц
+    user-data      GET /api/user/data
+
+Результат - JSON (--output): пропускная способность, p50/p95/p99, доля
+ошибок по сценариям, коммит и настройки. --compare baseline.json сравнивает
+с прошлым прогоном и завершается с кодом 1 при регрессии больше --tolerance.
+
+Запуск из каталога backend:
+    python bench/loadtest.py --duration 20 --output bench/results.json
+    python bench/loadtest.py --compare bench/results.json --latency lognormal:0.8:0.5 --rate-429 0.05
+    python bench/loadtest.py --workers 4 --scenarios user-data,chat   # масштабирование по ядрам
+    python bench/loadtest.py --target http://127.0.0.1:5000 --scenarios user-data   # уже запущенный сервер
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import httpx  # noqa: E402
+
+from bench_documents import generate_pdf  # noqa: E402
+from fake_openrouter import CHAT_PATH  # noqa: E402
+
+SCENARIOS = ("chat", "chat-stream", "document", "user-data")
+# Ответ 200, текст которого - сообщение об ошибке (как ERROR_ANSWER_PREFIXES в back.py)
+ERROR_ANSWER_PREFIXES = ("⚠️", "❌", "⏱️")
+STARTUP_TIMEOUT = 60.0
+
+QUESTION = "Give me an idea how to plan my savings for goal number {n}, in three short steps"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url, process, timeout=STARTUP_TIMEOUT):
+    """Ждет, пока сервер начнет отвечать на url (или процесс упадет)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Процесс завершился при старте (код {process.returncode}): {url}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Сервер не ответил за {timeout:.0f} с: {url}")
+
+
+def percentile(values, q):
+    """Перцентиль по ближайшему рангу (values отсортированы)"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize_latencies(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50) * 1000, 1),
+        "p95": round(percentile(values, 95) * 1000, 1),
+        "p99": round(percentile(values, 99) * 1000, 1),
+        "mean": round(sum(values) / len(values) * 1000, 1),
+        "max": round(values[-1] * 1000, 1),
+    }
+
+
+class Recorder:
+    """Результаты одного сценария (общие для всех клиентов)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.ttfb = []
+        self.ok = 0
+        self.errors = 0
+        self.status_codes = {}
+        self.error_samples = []
+
+    def add(self, latency, status, ok, ttfb=None, error=None):
+        with self._lock:
+            self.latencies.append(latency)
+            if ttfb is not None:
+                self.ttfb.append(ttfb)
+            key = str(status)
+            self.status_codes[key] = self.status_codes.get(key, 0) + 1
+            if ok:
+                self.ok += 1
+            else:
+                self.errors += 1
+                if error and len(self.error_samples) < 5:
+                    self.error_samples.append(error[:200])
+
+    def result(self, elapsed):
+        requests = self.ok + self.errors
+        result = {
+            "requests": requests,
+            "ok": self.ok,
+            "errors": self.errors,
+            "error_rate": round(self.errors / requests, 4) if requests else 0.0,
+            "throughput_rps": round(self.ok / elapsed, 2) if elapsed else 0.0,
+            "duration_s": round(elapsed, 2),
+            "latency_ms": summarize_latencies(self.latencies),
+            "status_codes": dict(sorted(self.status_codes.items())),
+        }
+        if self.ttfb:
+            result["ttfb_ms"] = summarize_latencies(self.ttfb)
+        if self.error_samples:
+            result["error_samples"] = self.error_samples
+        return result
+
+
+def chat_request(client, base, n):
+    """(статус, ok, ошибка) одного запроса к /api/neural-action"""
+    response = client.post(f"{base}/api/neural-action", json={"input": QUESTION.format(n=n), "current_page": "chat"})
+    if response.status_code != 200:
+        return response.status_code, False, response.text, None
+    result = response.json().get("result", "")
+    if result.startswith(ERROR_ANSWER_PREFIXES):
+        return response.status_code, False, result, None
+    return response.status_code, True, None, None
+
+
+def chat_stream_request(client, base, n):
+    """То же потоком SSE; ttfb - до первой дельты ответа"""
+    start = time.perf_counter()
+    ttfb, event, error = None, None, None
+    with client.stream("POST", f"{base}/api/neural-action?stream=1",
+                       json={"input": QUESTION.format(n=n), "current_page": "chat"}) as response:
+        if response.status_code != 200:
+            response.read()
+            return response.status_code, False, response.text, None
+        for line in response.iter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                if event == "delta" and ttfb is None:
+                    ttfb = time.perf_counter() - start
+                elif event == "error":
+                    error = line[6:]
+                elif event == "done":
+                    result = json.loads(line[6:]).get("result", "")
+                    if result.startswith(ERROR_ANSWER_PREFIXES):
+                        error = result
+    if error is None and event != "done":
+        error = "поток закончился без события done"
+    return response.status_code, error is None, error, ttfb
+
+
+def document_request(pages, payload):
+    def send(client, base, n):
+        # Уникальное имя файла - разные промпты, ответы модели не берутся из кеша
+        files = {"file": (f"contract-{pages}p-{n}.pdf", payload, "application/pdf")}
+        response = client.post(f"{base}/api/document/analyze", files=files, data={"current_page": "documents"})
+        if response.status_code != 200:
+            return response.status_code, False, response.text, None
+        return response.status_code, bool(response.json().get("success")), response.text, None
+    return send
+
+
+def user_data_request(client, base, n):
+    response = client.get(f"{base}/api/user/data")
+    return response.status_code, response.status_code == 200, response.text, None
+
+
+# Номер запроса - сквозной для всех сценариев: вопросы чата не повторяются между chat и chat-stream
+_counter = itertools.count()
+_counter_lock = threading.Lock()
+
+
+def run_scenario(base, send, concurrency, duration, timeout):
+    """Замкнутый цикл: concurrency клиентов, duration секунд; возвращает результат Recorder"""
+    recorder = Recorder()
+    stop_at = time.perf_counter() + duration
+
+    def client_loop():
+        with httpx.Client(timeout=timeout) as client:
+            while time.perf_counter() < stop_at:
+                with _counter_lock:
+                    n = next(_counter)
+                start = time.perf_counter()
+                try:
+                    status, ok, error, ttfb = send(client, base, n)
+                except httpx.HTTPError as e:
+                    status, ok, error, ttfb = type(e).__name__, False, str(e), None
+                recorder.add(time.perf_counter() - start, status, ok, ttfb, None if ok else error)
+
+    threads = [threading.Thread(target=client_loop, daemon=True) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.result(time.perf_counter() - start)
+
+
+def build_scenarios(names, pages):
+    scenarios = []
+    for name in names:
+        if name == "chat":
+            scenarios.append(("chat", chat_request))
+        elif name == "chat-stream":
+            scenarios.append(("chat-stream", chat_stream_request))
+        elif name == "document":
+            for count in pages:
+                scenarios.append((f"document-{count}p", document_request(count, generate_pdf(count))))
+        elif name == "user-data":
+            scenarios.append(("user-data", user_data_request))
+        else:
+            raise SystemExit(f"Неизвестный сценарий: {name} (есть: {', '.join(SCENARIOS)})")
+    return scenarios
+
+
+def compare(result, baseline, tolerance):
+    """Регрессии относительно baseline: рост p95, падение пропускной способности, рост ошибок"""
+    regressions = []
+    for name, current in result["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or not before.get("latency_ms") or not current.get("latency_ms"):
+            continue
+        p95_before, p95_now = before["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        if p95_before and p95_now > p95_before * (1 + tolerance):
+            regressions.append(f"{name}: p95 {p95_before:.1f} -> {p95_now:.1f} ms")
+        rps_before, rps_now = before["throughput_rps"], current["throughput_rps"]
+        if rps_before and rps_now < rps_before * (1 - tolerance):
+            regressions.append(f"{name}: throughput {rps_before:.2f} -> {rps_now:.2f} rps")
+        if current["error_rate"] > before["error_rate"] + 0.01:
+            regressions.append(f"{name}: error rate {before['error_rate']:.2%} -> {current['error_rate']:.2%}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def start_processes(args, workdir):
+    """Запускает fake OpenRouter и бэкенд; возвращает (base url, url замены, процессы)"""
+    processes = []
+    fake_port, backend_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    fake = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_openrouter.py"), "--port", str(fake_port),
+         "--latency", args.latency, "--token-interval", str(args.token_interval), "--tokens", str(args.tokens),
+         "--rate-429", str(args.rate_429), "--rate-5xx", str(args.rate_5xx), "--retry-after", str(args.retry_after)]
+        + (["--seed", str(args.seed)] if args.seed is not None else []),
+        stdout=subprocess.DEVNULL)
+    processes.append(fake)
+    wait_ready(f"{fake_url}/stats", fake)
+
+    env = dict(os.environ,
+               OPENROUTER_API_KEY="bench",
+               OPENROUTER_API_URL=f"{fake_url}{CHAT_PATH}",
+               LEDGER_PATH=os.path.join(workdir, "ledger.sqlite3"),
+               JOBS_PATH=os.path.join(workdir, "jobs.sqlite3"),
+               RESPONSE_CACHE_PATH=os.path.join(workdir, "response_cache.sqlite3"),
+               DOCUMENT_CACHE_BACKEND="off",
+               ADMISSION_CONTROL="0",  # все клиенты с одного IP; лимиты включаются через --env
+               LOG_LEVEL="WARNING")
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    backend = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "serve.py"), "--host", "127.0.0.1",
+                                "--port", str(backend_port), "--workers", str(args.workers),
+                                "--threads", str(args.threads)],
+                               cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    processes.append(backend)
+    base = f"http://127.0.0.1:{backend_port}"
+    wait_ready(f"{base}/api/health", backend)
+    return base, fake_url, processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бэкенда с локальной заменой OpenRouter")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="сценарии через запятую")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на сценарий")
+    parser.add_argument("--pages", default="5,50,200", help="размеры PDF для сценария document")
+    parser.add_argument("--timeout", type=float, default=120.0, help="таймаут запроса клиента, с")
+    parser.add_argument("--target", help="уже запущенный бэкенд (без своего fake OpenRouter)")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE для процесса бэкенда")
+    parser.add_argument("--workers", type=int, default=1, help="воркеров serve.py")
+    parser.add_argument("--threads", type=int, default=16, help="потоков в воркере serve.py")
+    parser.add_argument("--latency", default="lognormal:0.8:0.5", help="задержка fake OpenRouter")
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="куда записать JSON результата (по умолчанию - stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение p95/rps (доля)")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    pages = [int(count) for count in args.pages.split(",") if count.strip()]
+    scenarios = build_scenarios(names, pages)
+
+    processes, fake_url = [], None
+    with tempfile.TemporaryDirectory(prefix="finbot-loadtest-") as workdir:
+        try:
+            if args.target:
+                base = args.target.rstrip("/")
+            else:
+                base, fake_url, processes = start_processes(args, workdir)
+
+            result = {
+                "commit": git_commit(),
+                "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "config": {"concurrency": args.concurrency, "duration_s": args.duration, "pages": pages,
+                           "target": args.target, "env": args.env,
+                           "workers": None if args.target else args.workers,
+                           "threads": None if args.target else args.threads,
+                           "upstream": None if args.target else {
+                               "latency": args.latency, "token_interval": args.token_interval,
+                               "tokens": args.tokens, "rate_429": args.rate_429, "rate_5xx": args.rate_5xx,
+                               "retry_after": args.retry_after, "seed": args.seed}},
+                "scenarios": {},
+            }
+            for name, send in scenarios:
+                print(f"{name}: {args.concurrency} клиентов, {args.duration:g} с...", file=sys.stderr, flush=True)
+                scenario = run_scenario(base, send, args.concurrency, args.duration, args.timeout)
+                result["scenarios"][name] = scenario
+                latency = scenario["latency_ms"] or {}
+                print(f"  {scenario['throughput_rps']:.2f} rps, p50 {latency.get('p50')} ms, "
+                      f"p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, "
+                      f"ошибок {scenario['error_rate']:.1%}", file=sys.stderr, flush=True)
+            if fake_url:
+                result["upstream_stats"] = httpx.get(f"{fake_url}/stats").json()
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"Регрессий относительно {args.compare} нет (допуск {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""LRU+TTL кеш ответов модели.
+
+Ключ строится из нормализованного вопроса, текущей страницы, модели и
+версии финансовых данных пользователя, поэтому любое изменение данных
+автоматически делает старые ответы недостижимыми. По умолчанию кеш живет в
+памяти процесса; backend "sqlite" позволяет нескольким воркерам делить
+один кеш через локальный файл.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_REQUESTS
+
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | sqlite | off
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+
+_PUNCTUATION_TAIL = re.compile(r"[\s?!.,;:…]+$")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """Приводит вопрос к каноническому виду: регистр, пробелы, финальная пунктуация"""
+    return _PUNCTUATION_TAIL.sub("", _SPACES.sub(" ", prompt.strip().lower()))
+
+
+def make_cache_key(*parts):
+    """Стабильный ключ кеша из произвольных частей"""
+    raw = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """LRU в памяти процесса с ограничением по числу записей и байтам"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, size = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (time.monotonic() + ttl, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class SqliteBackend:
+    """Общий для нескольких воркеров кеш в локальном SQLite файле (WAL)"""
+
+    def __init__(self, path, max_entries, max_bytes):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.evictions = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache(accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE response_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value, ttl):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?)",
+                     (key, value, size, now + ttl, now))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            row = conn.execute("SELECT key, size FROM response_cache ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (row[0],))
+            count, total = count - 1, total - row[1]
+            self.evictions += 1
+
+    def clear(self):
+        self._connect().execute("DELETE FROM response_cache")
+
+    def close(self):
+        """Закрывает SQLite соединение текущего потока (мастер serve.py - перед fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        count, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache").fetchone()
+        return {"entries": count, "bytes": total, "evictions": self.evictions, "path": self.path}
+
+
+class ResponseCache:
+    """Кеш ответов со счетчиками попаданий/промахов поверх выбранного backend.
+    name - метка кеша в finbot_cache_requests_total."""
+
+    def __init__(self, backend, ttl=RESPONSE_CACHE_TTL, name="response"):
+        self.backend = backend
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Возвращает сохраненный dict или None"""
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache=self.name, result="miss")
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="hit")
+        return json.loads(value)
+
+    def set(self, key, value):
+        if self.backend is not None:
+            self.backend.set(key, json.dumps(value, ensure_ascii=False), self.ttl)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+    def stats(self):
+        total = self.hits + self.misses
+        stats = {
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "ttl": self.ttl,
+        }
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+def create_response_cache():
+    """Создает кеш ответов по настройкам из окружения"""
+    if RESPONSE_CACHE_BACKEND == "off":
+        return ResponseCache(None)
+    if RESPONSE_CACHE_BACKEND == "sqlite":
+        return ResponseCache(SqliteBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_MAX_BYTES))
+    return ResponseCache(MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_MAX_BYTES))
@@ -0,0 +1,190 @@
+"""Сборка финансового контекста для промпта с учетом вопроса и бюджета токенов.
+
+Раньше в системный промпт попадали все транзакции пользователя, и на
+реальной истории промпт рос без ограничений. Теперь контекст состоит из:
+- сводки (баланс, доход/расход) и агрегатов по категориям и месяцам из
+  журнала (ledger.py) - они есть всегда;
+- транзакций, относящихся к вопросу (категория, название, месяц/дата),
+  от новых к старым; если вопрос ни к чему не привязан - последних.
+
+Транзакции добавляются, пока хватает бюджета CONTEXT_TOKEN_BUDGET, поэтому
+размер промпта почти не зависит от длины истории. Подходящие транзакции
+выбираются запросом по индексам журнала, без просмотра всей истории.
+"""
+import os
+import re
+
+from fastpath import CATEGORY_SYNONYMS, format_amount
+from ledger import DEFAULT_USER
+from prompts import estimate_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MAX_CATEGORIES = int(os.getenv("CONTEXT_MAX_CATEGORIES", "12"))
+CONTEXT_MAX_MONTHS = int(os.getenv("CONTEXT_MAX_MONTHS", "12"))
+
+_WORDS = re.compile(r"\w+", re.UNICODE)
+# Короче этого слова вопроса не ищем в индексе ("on", "мне", "i")
+MIN_QUERY_WORD = 3
+# Служебные слова вопросов, которые не должны совпадать с названиями транзакций
+STOPWORDS = {
+    "the", "and", "for", "how", "what", "did", "does", "much", "many", "with", "from", "this", "that",
+    "show", "spent", "spend", "money", "last", "month", "year", "week", "all", "any", "was", "were",
+    "payment", "payments", "transaction", "transactions", "purchase", "purchases",
+    "как", "что", "сколько", "это", "для", "мои", "мой", "мне", "меня", "все", "был", "была", "было",
+    "потратил", "потратила", "месяц", "году", "год", "неделю", "платежи", "платеж", "платёж", "покупки",
+    "транзакции", "операции",
+    "ile", "jak", "jakie", "moje", "dla", "czy", "był", "była", "wydałem", "wydałam", "miesiąc", "rok",
+    "płatności", "transakcje", "zakupy",
+}
+
+# Месяцы: английские названия и сокращения целиком, русские и польские - по основе слова
+MONTH_NAMES = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+MONTH_STEMS = {
+    1: ["январ", "styczni", "styczeń"],
+    2: ["феврал", "luty", "lutego", "lutym"],
+    3: ["март", "marzec", "marca", "marcu"],
+    4: ["апрел", "kwietni", "kwiecień"],
+    5: ["мая", "май", "maja", "maju"],
+    6: ["июн", "czerwc", "czerwiec"],
+    7: ["июл", "lipiec", "lipca", "lipcu"],
+    8: ["август", "sierpni", "sierpień"],
+    9: ["сентябр", "wrześni", "wrzesień"],
+    10: ["октябр", "październik", "pazdziernik"],
+    11: ["ноябр", "listopad"],
+    12: ["декабр", "grudni", "grudzień"],
+}
+YEAR = re.compile(r"\b(20\d\d)\b")
+ISO_MONTH = re.compile(r"\b(20\d\d)-(\d\d)\b")
+
+
+# Строка транзакции в промпте занимает не меньше ~10 токенов - больше budget/10 строк из журнала не читаем
+TOKENS_PER_LINE_ESTIMATE = 10
+
+
+def tokenize(text):
+    return _WORDS.findall(text.lower())
+
+
+def match_query(query, summary, name_index):
+    """Категории, названия транзакций и месяцы, упомянутые в вопросе"""
+    lower = query.lower()
+    all_words = tokenize(lower)
+    words = [w for w in all_words if len(w) >= MIN_QUERY_WORD and w not in STOPWORDS]
+
+    # Категории - по названию и синонимам
+    categories = set()
+    for category in summary["categories"]:
+        names = [category.lower()] + CATEGORY_SYNONYMS.get(category, [])
+        if any(name in lower for name in names):
+            categories.add(category)
+
+    # Названия - по словам (совпадение начала слова, чтобы ловить словоформы):
+    # слова индекса, которые начинаются со слова вопроса, - бинарным поиском,
+    # и начала слова вопроса от 4 букв, которые сами есть в индексе
+    names = set()
+    index = name_index.names
+    for word in words:
+        for token in name_index.with_prefix(word):
+            names.update(index[token])
+        for size in range(4, len(word)):
+            names.update(index.get(word[:size], ()))
+
+    # Месяц и год
+    months = set()
+    years = set(YEAR.findall(lower))
+    for year, month in ISO_MONTH.findall(lower):
+        months.add(f"{year}-{month}")
+    numbers = {MONTH_NAMES[word] for word in all_words if word in MONTH_NAMES}
+    numbers.update(number for number, stems in MONTH_STEMS.items()
+                   if any(word.startswith(stem) for word in all_words for stem in stems))
+    known_months = summary["months"]
+    months.update(m for m in known_months if int(m[5:]) in numbers and (not years or m[:4] in years))
+    if not months and years:
+        months = {m for m in known_months if m[:4] in years}
+
+    return categories, names, months
+
+
+class FinancialContextBuilder:
+    """Собирает текст финансового контекста в пределах бюджета токенов"""
+
+    def __init__(self, ledger, token_budget=CONTEXT_TOKEN_BUDGET, max_categories=CONTEXT_MAX_CATEGORIES,
+                 max_months=CONTEXT_MAX_MONTHS):
+        self.ledger = ledger
+        self.token_budget = token_budget
+        self.max_categories = max_categories
+        self.max_months = max_months
+
+    def _summary(self, summary):
+        currency = summary["currency"]
+        income, expenses = summary["income"], summary["expenses"]
+        lines = [
+            "",
+            "=== USER'S FINANCIAL DATA ===",
+            f"Current Balance: {format_amount(summary['balance'])} {currency}",
+            f"Card Number: {summary['card_number']}",
+            f"Total Income: {format_amount(income)} {currency}",
+            f"Total Expenses: {format_amount(expenses)} {currency}",
+            f"Net Result: {format_amount(income - expenses)} {currency}",
+            f"Transactions: {summary['count']}",
+        ]
+
+        def totals_line(name, t):
+            count = t["income_count"] + t["expense_count"]
+            return (f"- {name}: +{format_amount(t['income'])} / -{format_amount(t['expenses'])} "
+                    f"{currency} ({count} tx)")
+
+        categories = sorted(summary["categories"].items(), key=lambda item: -(item[1]["income"] + item[1]["expenses"]))
+        lines += ["", "=== TOTALS BY CATEGORY ==="]
+        lines += [totals_line(category, t) for category, t in categories[:self.max_categories]]
+        if len(categories) > self.max_categories:
+            lines.append(f"- ... and {len(categories) - self.max_categories} more categories")
+
+        lines += ["", "=== TOTALS BY MONTH ==="]
+        months = summary["months"]
+        lines += [totals_line(month, months[month]) for month in sorted(months, reverse=True)[:self.max_months]]
+        return "\n".join(lines) + "\n"
+
+    def _relevant(self, query, summary, user_id, limit):
+        """Транзакции под вопрос (от новых к старым) или [] если вопрос ни к чему не привязан"""
+        categories, names, months = match_query(query, summary, self.ledger.name_index(user_id))
+        if (categories or names) and months:
+            # "Netflix в марте" - пересечение; если оно пусто, достаточно совпадения по названию
+            return (self.ledger.find(user_id, categories, names, months, limit=limit)
+                    or self.ledger.find(user_id, categories, names, limit=limit))
+        if categories or names or months:
+            return self.ledger.find(user_id, categories, names, months, limit=limit)
+        return []
+
+    def build(self, query=None, user_id=DEFAULT_USER):
+        """Текст контекста: сводка и агрегаты + транзакции по вопросу, пока хватает бюджета"""
+        summary = self.ledger.summary(user_id)
+        context = self._summary(summary)
+        budget = self.token_budget - estimate_tokens(context)
+        limit = max(1, budget // TOKENS_PER_LINE_ESTIMATE)
+
+        transactions = self._relevant(query, summary, user_id, limit) if query else []
+        if transactions:
+            header = "\n=== TRANSACTIONS RELEVANT TO THE QUESTION ({shown} shown, newest first) ===\n"
+        else:
+            transactions = self.ledger.recent(user_id, limit)
+            header = f"\n=== RECENT TRANSACTIONS ({{shown}} of {summary['count']}, newest first) ===\n"
+        budget -= estimate_tokens(header)
+
+        currency = summary["currency"]
+        lines = []
+        for t in transactions:
+            symbol = "+" if t["amount"] > 0 else "-"
+            line = f"- [{t['date']}] {t['name']}: {symbol}{format_amount(abs(t['amount']))} {currency} (category: {t['category']})\n"
+            cost = estimate_tokens(line)
+            if cost > budget:
+                break
+            budget -= cost
+            lines.append(line)
+
+        return context + header.format(shown=len(lines)) + "".join(lines)
@@ -0,0 +1,73 @@
+"""Кеш результатов /api/document/analyze по содержимому файла.
+
+Ключ - SHA-256 байтов файла, поэтому повторная загрузка того же договора
+или выписки (под любым именем) не разбирает PDF и не вызывает модель.
+Текст и сводка хранятся отдельно:
+- текст: хеш файла + способ извлечения (весь текст / бюджет символов);
+- сводка: хеш файла + модель + версия промптов + режим анализа.
+Смена промпта или модели переиспользует уже извлеченный текст.
+
+По умолчанию кеш лежит в SQLite файле (переживает перезапуск, общий для
+воркеров) с LRU вытеснением по числу записей и байтам (cache.SqliteBackend).
+"""
+import os
+
+from cache import MemoryBackend, ResponseCache, SqliteBackend, make_cache_key
+
+DOCUMENT_CACHE_BACKEND = os.getenv("DOCUMENT_CACHE_BACKEND", "sqlite")  # sqlite | memory | off
+DOCUMENT_CACHE_PATH = os.getenv("DOCUMENT_CACHE_PATH", "document_cache.sqlite3")
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "2000"))
+DOCUMENT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOCUMENT_CACHE_TTL = float(os.getenv("DOCUMENT_CACHE_TTL", str(30 * 24 * 3600)))
+
+# Меняется, если меняется сам способ извлечения текста (documents.py)
+EXTRACTION_VERSION = 2
+
+
+class DocumentCache:
+    """Два пространства ключей (текст, сводка) поверх одного backend"""
+
+    def __init__(self, backend, ttl=DOCUMENT_CACHE_TTL):
+        self.texts = ResponseCache(backend, ttl, name="document_text")
+        self.summaries = ResponseCache(backend, ttl, name="document_summary")
+
+    @staticmethod
+    def text_key(file_hash, extraction):
+        return make_cache_key("text", EXTRACTION_VERSION, file_hash, extraction)
+
+    @staticmethod
+    def summary_key(file_hash, model, prompt_version, mode):
+        return make_cache_key("summary", file_hash, model, prompt_version, mode)
+
+    def get_text(self, file_hash, extraction):
+        """Извлеченный текст и счетчики извлечения (dict) или None"""
+        return self.texts.get(self.text_key(file_hash, extraction))
+
+    def set_text(self, file_hash, extraction, value):
+        self.texts.set(self.text_key(file_hash, extraction), value)
+
+    def get_summary(self, file_hash, model, prompt_version, mode):
+        return self.summaries.get(self.summary_key(file_hash, model, prompt_version, mode))
+
+    def set_summary(self, file_hash, model, prompt_version, mode, value):
+        self.summaries.set(self.summary_key(file_hash, model, prompt_version, mode), value)
+
+    def close(self):
+        self.texts.close()  # backend общий для текстов и сводок
+
+    def stats(self):
+        stats = self.texts.stats()
+        summaries = self.summaries.stats()
+        for name in ("hits", "misses", "hit_rate"):
+            stats[f"text_{name}"] = stats.pop(name)
+            stats[f"summary_{name}"] = summaries[name]
+        return stats
+
+
+def create_document_cache():
+    """Создает кеш документов по настройкам из окружения"""
+    if DOCUMENT_CACHE_BACKEND == "off":
+        return DocumentCache(None)
+    if DOCUMENT_CACHE_BACKEND == "memory":
+        return DocumentCache(MemoryBackend(DOCUMENT_CACHE_SIZE, DOCUMENT_CACHE_MAX_BYTES))
+    return DocumentCache(SqliteBackend(DOCUMENT_CACHE_PATH, DOCUMENT_CACHE_SIZE, DOCUMENT_CACHE_MAX_BYTES))
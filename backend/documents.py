@@ -0,0 +1,302 @@
+"""Извлечение текста из документов для /api/document/analyze.
+
+PDF читается постранично, и чтение останавливается, как только набран
+бюджет символов/токенов: для анализа нужны первые DOCUMENT_CHAR_BUDGET
+символов, поэтому остальные страницы 300-страничного договора даже не
+разбираются. Текст страниц собирается списком кусков и склеивается один раз.
+
+Источник - байты, файловый объект (загрузка, уже лежащая во временном файле)
+или путь: PDF парсер читает файл с диска по мере надобности, без копии в памяти.
+
+Текст по дороге проходит очистку (preprocess.py, DOCUMENT_PREPROCESS=1):
+HTML и markdown без разметки, PDF без повторяющихся колонтитулов, без
+лишних пробелов. Бюджет считается уже по очищенному тексту, а текстовые
+файлы читаются и очищаются кусками - чтение тоже останавливается по бюджету.
+
+Если документ нужен целиком (char_budget=None), большие PDF можно разбирать
+диапазонами страниц параллельно в пуле процессов (PDF_WORKERS > 0).
+По каждому документу считаются время и число разобранных страниц.
+
+PyPDF2 импортируется при первом PDF (load_pdf_backend), а не при импорте
+модуля: это заметная часть времени старта, а нужен он только для PDF.
+"""
+import codecs
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from multiprocessing import get_context
+
+from logs import get_logger
+from metrics import DOCUMENT_EXTRACTION_SECONDS
+from preprocess import create_cleaner
+from prompts import estimate_tokens
+
+DOCUMENT_CHAR_BUDGET = int(os.getenv("DOCUMENT_CHAR_BUDGET", "8000"))
+DOCUMENT_TOKEN_BUDGET = int(os.getenv("DOCUMENT_TOKEN_BUDGET", "0"))  # 0 - только бюджет символов
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0"))  # 0 - без пула процессов
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+# Сколько PDF разбирается одновременно в процессе: разбор упирается в GIL, а память
+# парсера (дерево страниц, объекты) растет с числом одновременных разборов
+PDF_MAX_CONCURRENT = int(os.getenv("PDF_MAX_CONCURRENT", "4"))
+DOCUMENT_PREPROCESS = os.getenv("DOCUMENT_PREPROCESS", "1") == "1"
+TEXT_READ_CHUNK = 64 * 1024
+
+TRUNCATED_MARK = "...[документ обрезан]"
+
+log = get_logger("documents")
+
+_pdf_lock = threading.Lock()
+_pdf_loaded = False
+_pdf_module = None
+
+
+def load_pdf_backend():
+    """Модуль PyPDF2 (или pypdf), импортируется один раз при первом вызове; None - не установлен"""
+    global _pdf_module, _pdf_loaded
+    with _pdf_lock:
+        if not _pdf_loaded:
+            try:
+                import PyPDF2 as module
+            except ImportError:
+                # Если PyPDF2 не установлен, пробуем pypdf
+                try:
+                    import pypdf as module
+                except ImportError:
+                    module = None
+                    log.warning("PyPDF2 не установлен. Анализ PDF недоступен.")
+            _pdf_module, _pdf_loaded = module, True
+    return _pdf_module
+
+
+class ExtractionError(RuntimeError):
+    """PDF не удалось разобрать (или PyPDF2 не установлен)"""
+
+
+def open_pdf(source):
+    """PdfReader по байтам или бинарному файловому объекту"""
+    pdf = load_pdf_backend()
+    if pdf is None:
+        raise ExtractionError("PyPDF2 не установлен. Установите: pip install PyPDF2")
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    return pdf.PdfReader(source)
+
+
+def release_pdf(reader):
+    """Сбрасывает кеши PdfReader: страницы и объекты ссылаются друг на друга циклами
+    и иначе живут до сборщика мусора - по несколько МБ на документ, пока идет запрос к модели"""
+    reader.flattened_pages = None
+    reader.resolved_objects.clear()
+
+
+def page_text(page):
+    return page.extract_text() or ""
+
+
+def extract_page_range(source, start, stop):
+    """Текст страниц [start, stop) одним списком - задача для процесса пула (source - байты или путь)"""
+    if isinstance(source, str):
+        # PdfReader(путь) читает весь файл в BytesIO - открываем сами
+        with open(source, "rb") as stream:
+            return extract_page_range(stream, start, stop)
+    reader = open_pdf(source)
+    try:
+        return [page_text(reader.pages[i]) for i in range(start, stop)]
+    finally:
+        release_pdf(reader)
+
+
+class Budget:
+    """Сколько еще текста можно взять: символы и (опционально) токены"""
+
+    def __init__(self, chars=None, tokens=None):
+        self.chars = chars
+        self.tokens = tokens or None
+
+    def take(self, text):
+        """Отрезает от text то, что помещается в бюджет, и уменьшает остаток"""
+        if self.chars is not None:
+            text = text[:self.chars]
+            self.chars -= len(text)
+        if self.tokens is not None:
+            tokens = estimate_tokens(text)
+            if tokens > self.tokens:
+                text = text[:len(text) * self.tokens // tokens]
+                tokens = self.tokens
+            self.tokens -= tokens
+        return text
+
+    @property
+    def exhausted(self):
+        return self.chars == 0 or self.tokens == 0
+
+
+class DocumentExtractor:
+    """Извлекает текст с ранним выходом по бюджету и ведет счетчики"""
+
+    def __init__(self, workers=PDF_WORKERS, parallel_min_pages=PDF_PARALLEL_MIN_PAGES,
+                 max_concurrent=PDF_MAX_CONCURRENT, preprocess=DOCUMENT_PREPROCESS):
+        self.workers = workers
+        self.preprocess = preprocess
+        self.parallel_min_pages = parallel_min_pages
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrent))
+        self._pool = None
+        self._lock = threading.Lock()
+        self._stats = {"documents": 0, "pages_total": 0, "pages_extracted": 0,
+                       "truncated": 0, "parallel": 0, "failed": 0, "ms_total": 0.0,
+                       "tokens_before": 0, "tokens_after": 0}
+
+    def _executor(self):
+        # spawn: форк процесса с потоками Flask/httpx небезопасен
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"))
+            return self._pool
+
+    def extract(self, content, file_type, char_budget=DOCUMENT_CHAR_BUDGET, token_budget=DOCUMENT_TOKEN_BUDGET):
+        """Текст документа в пределах бюджета (char_budget=None - целиком).
+
+        content - байты, бинарный файловый объект или путь к файлу.
+        Возвращает словарь: text, truncated, chars, pages_total,
+        pages_extracted, parallel, elapsed_ms и preprocess (символы и токены
+        до/после очистки, None без очистки). ExtractionError - если PDF
+        не разбирается.
+        """
+        if isinstance(content, str):
+            try:
+                with open(content, "rb") as stream:
+                    return self._extract(stream, file_type, char_budget, token_budget, path=content)
+            except OSError as e:
+                raise ExtractionError(f"Не удалось открыть файл документа: {e}") from e
+        return self._extract(content, file_type, char_budget, token_budget)
+
+    def _extract(self, content, file_type, char_budget, token_budget, path=None):
+        start = time.perf_counter()
+        budget = Budget(char_budget, token_budget)
+        info = {"pages_total": None, "pages_extracted": None, "parallel": False}
+        cleaner = create_cleaner(file_type) if self.preprocess else None
+        try:
+            if file_type == "application/pdf":
+                chunks, truncated = self._extract_pdf(content, budget, info, path, cleaner)
+            elif cleaner is not None:
+                chunks, truncated = self._extract_text(content, budget, cleaner)
+            else:
+                if hasattr(content, "read"):
+                    content.seek(0)
+                    content = content.read()
+                text = content.decode("utf-8", errors="ignore")
+                chunks = [budget.take(text)]
+                truncated = len(chunks[0]) < len(text)
+        except ExtractionError:
+            self._count(info, False, start, file_type, failed=True)
+            raise
+        except Exception as e:
+            self._count(info, False, start, file_type, failed=True)
+            raise ExtractionError(f"Ошибка при извлечении текста из PDF: {e}") from e
+
+        text = "\n".join(chunks).strip()
+        if truncated:
+            text += TRUNCATED_MARK
+        info["preprocess"] = cleaner.stats() if cleaner is not None else None
+        elapsed_ms = self._count(info, truncated, start, file_type)
+        return dict(info, text=text, truncated=truncated, chars=len(text), elapsed_ms=round(elapsed_ms, 1))
+
+    def _extract_text(self, content, budget, cleaner):
+        """Текстовый файл: чтение кусками, очистка и бюджет по ходу чтения"""
+        if not hasattr(content, "read"):
+            content = BytesIO(content)
+        content.seek(0)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        chunks = []
+        while True:
+            raw = content.read(TEXT_READ_CHUNK)
+            text = cleaner.feed(decoder.decode(raw, final=not raw))
+            if not raw:
+                text += cleaner.close()
+            taken = budget.take(text)
+            chunks.append(taken)
+            if budget.exhausted:
+                return ["".join(chunks)], len(taken) < len(text) or bool(raw)
+            if not raw:
+                return ["".join(chunks)], False
+
+    def _extract_pdf(self, content, budget, info, path=None, cleaner=None):
+        with self._slots:
+            reader = open_pdf(content)
+            try:
+                return self._read_pages(reader, content, budget, info, path, cleaner)
+            finally:
+                release_pdf(reader)
+
+    def _read_pages(self, reader, content, budget, info, path, cleaner):
+        total = len(reader.pages)
+        info["pages_total"] = total
+
+        if budget.chars is None and budget.tokens is None and self.workers > 0 and total >= self.parallel_min_pages:
+            info["parallel"] = True
+            info["pages_extracted"] = total
+            chunks = self._extract_parallel(path or content, total)
+            if cleaner is not None:
+                chunks = [cleaner.feed_page(text) for text in chunks]
+            return chunks, False
+
+        chunks = []
+        for number in range(total):
+            text = page_text(reader.pages[number])
+            if cleaner is not None:
+                text = cleaner.feed_page(text)
+            taken = budget.take(text)
+            chunks.append(taken)
+            info["pages_extracted"] = number + 1
+            if budget.exhausted:
+                # Обрезано, если не влезла эта страница или остались непрочитанные
+                return chunks, len(taken) < len(text) or number + 1 < total
+        return chunks, False
+
+    def _extract_parallel(self, content, total):
+        # Процессам пула передается путь; файловый объект без пути приходится прочитать в байты
+        if not isinstance(content, (bytes, bytearray, str)):
+            content.seek(0)
+            content = content.read()
+        step = -(-total // self.workers)
+        ranges = [(start, min(start + step, total)) for start in range(0, total, step)]
+        pool = self._executor()
+        futures = [pool.submit(extract_page_range, content, start, stop) for start, stop in ranges]
+        chunks = []
+        for future in futures:
+            chunks.extend(future.result())
+        return chunks
+
+    def _count(self, info, truncated, start, file_type, failed=False):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        DOCUMENT_EXTRACTION_SECONDS.observe(elapsed_ms / 1000, type=file_type,
+                                            outcome="failed" if failed else "truncated" if truncated else "ok")
+        with self._lock:
+            self._stats["documents"] += 1
+            self._stats["pages_total"] += info["pages_total"] or 0
+            self._stats["pages_extracted"] += info["pages_extracted"] or 0
+            self._stats["truncated"] += int(truncated)
+            self._stats["parallel"] += int(info["parallel"])
+            self._stats["failed"] += int(failed)
+            self._stats["ms_total"] += elapsed_ms
+            if info.get("preprocess"):
+                self._stats["tokens_before"] += info["preprocess"]["tokens_before"]
+                self._stats["tokens_after"] += info["preprocess"]["tokens_after"]
+        return elapsed_ms
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["ms_total"] = round(stats["ms_total"], 1)
+        stats["available"] = load_pdf_backend() is not None
+        stats["workers"] = self.workers
+        stats["preprocess"] = self.preprocess
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,312 @@
+"""Локальные ответы на детерминированные финансовые вопросы без обращения к LLM.
+
+Баланс, общий доход/расход, траты по категории, самая большая трата и
+последние N транзакций берутся из агрегатов и индексов журнала (ledger.py). Вопросы
+распознаются на английском, русском и польском регулярными выражениями,
+скомпилированными один раз при импорте. Все, что не распознано уверенно
+(советы, сравнения, длинные вопросы, команды навигации), уходит в LLM.
+
+Ответ дается, только если вопрос покрыт целиком: после слов интента и
+категорий журнала должны остаться одни служебные слова (COVERED_WORDS).
+Период или дата ("в октябре", "last month"), неизвестная категория или
+получатель ("on rent") и любое другое значимое слово ("balance sheet",
+"received an email", "income tax") - вопрос уходит в LLM, а не получает
+уверенный ответ про все время или весь счет.
+"""
+import re
+import threading
+
+from ledger import DEFAULT_USER
+
+# Вопросы длиннее этого почти всегда требуют рассуждений - отдаем их модели
+FASTPATH_MAX_LENGTH = 120
+LAST_N_DEFAULT = 5
+LAST_N_MAX = 20
+
+# Вопрос приводится к нижнему регистру до сопоставления - IGNORECASE только замедлил бы регулярки
+_FLAGS = re.UNICODE
+
+BALANCE = re.compile(
+    r"\bbalance\b|how much (?:money )?(?:do i have|is on my (?:card|account))"
+    r"|баланс|остат(?:ок|ке) на (?:карте|счете|счёте)|сколько (?:у меня )?денег"
+    r"|\bsaldo\b|stan konta|ile (?:mam )?(?:pieniędzy|kasy)", _FLAGS)
+
+INCOME = re.compile(
+    r"\bincome\b|\bearn(?:ed|ings)?\b|\breceived\b"
+    r"|доход|заработ|получил"
+    r"|doch[óo]d|przych[óo]d|zarobi", _FLAGS)
+
+SPEND = re.compile(
+    r"\bspen[dt]\b|\bspending\b|\bexpenses?\b"
+    r"|потрат|трат(?:ы|ил|ах)|расход"
+    r"|wyda(?:ł|l|tki|tk[óo]w|n)", _FLAGS)
+
+LARGEST = re.compile(
+    r"\b(?:biggest|largest|highest|most expensive)\s+(?:expense|purchase|spending|transaction)"
+    r"|сам(?:ая|ый|ую|ой) (?:больш|крупн|дорог)\w* (?:трат|расход|покупк|операци)\w*"
+    r"|крупнейш\w* (?:трат|расход|покупк)\w*"
+    r"|najwięks\w* (?:wydat|zakup|transakcj)\w*|najdroższ\w* zakup\w*", _FLAGS)
+
+LAST_N = re.compile(
+    r"\b(?:last|recent|latest)\s+(\d+)?\s*(?:transactions?|operations?|payments?)\b"
+    r"|последн\w*\s+(\d+)?\s*(?:транзакц|операц|плат)\w*"
+    r"|ostatni\w*\s+(\d+)?\s*(?:transakcj|operacj|płatnoś)\w*", _FLAGS)
+
+# Признаки того, что нужен не факт, а рассуждение или навигация
+DECLINE = re.compile(
+    r"advi[cs]e|\bshould\b|recommend|\bwhy\b|\bplan\b|budget|compar|predict|\bsave\b|\bopen\b|\bgo to\b"
+    r"|совет|почему|стоит ли|план|бюджет|сравн|эконом|прогноз|открой|перейди"
+    r"|pora[dđ]|dlaczego|czy powinien|budżet|porówn|oszczędz|otwórz|przejdź", _FLAGS)
+
+# Период или дата: агрегаты журнала - за все время, такие вопросы отдаем модели (числа и даты
+# отсекает и проверка покрытия: цифры, кроме N в "последние N", не служебные слова)
+PERIOD_STEMS = (
+    "today", "yesterday", "tonight", "week", "month", "year", "quarter", "daily", "annual", "since", "until",
+    "january", "february", "march", "april", "june", "july", "august", "september", "october", "november",
+    "december",
+    "сегодня", "вчера", "недел", "месяц", "год", "квартал", "январ", "феврал", "март", "апрел", "июн", "июл",
+    "август", "сентябр", "октябр", "ноябр", "декабр",
+    "dziś", "dzisiaj", "wczoraj", "tydzie", "tygod", "miesi", "kwarta", "stycz", "luty", "lutego", "marz", "marc",
+    "kwietni", "czerw", "lipiec", "lipca", "sierp", "wrze", "październik", "pazdziernik", "listopad", "grud",
+)
+PERIOD_WORDS = frozenset("ago may лет назад май мая мае rok roku lat maj maja maju".split())
+
+# Слова, которые не меняют смысл вопроса о факте; все остальное (кроме слов интента и категорий) - повод отдать LLM
+COVERED_WORDS = frozenset("""
+what what's whats which is are was were my me i i've ive do did does have has had how much many money the a an
+on in for to from show tell list give please total overall all current currently account card can you see check
+category categories now
+какой какая какое какие каков какова сколько я у меня мой моя мои мое моё мне на в всего общий общая общие общую
+общее текущий текущая сейчас покажи скажи был была были это ли по карте карта счете счёте счету есть деньги
+категории категорию
+jaki jaka jakie jest są moje mój moja moich mam ile na w z pokaż podaj łączne łącznie suma aktualne obecne mi
+mnie konto koncie karcie co kategorii kategorię się
+""".split())
+WORD = re.compile(r"[\w']+", _FLAGS)
+INTENTS = (LARGEST, LAST_N, SPEND, INCOME, BALANCE)
+
+
+def is_period_word(word):
+    return word in PERIOD_WORDS or word.startswith(PERIOD_STEMS)
+
+
+def strip_intent_words(text, matches):
+    """Текст без найденных слов интентов; слово убирается целиком (регулярки находят основы: "wyda" в "wydałem")"""
+    spans = []
+    for match in matches:
+        start, end = match.span()
+        while start > 0 and (text[start - 1].isalnum() or text[start - 1] == "_"):
+            start -= 1
+        while end < len(text) and (text[end].isalnum() or text[end] == "_"):
+            end += 1
+        spans.append((start, end))
+    if not spans:
+        return text
+    parts, position = [], 0
+    for start, end in sorted(spans):
+        if start > position:
+            parts.append(text[position:start])
+        position = max(position, end)
+    parts.append(text[position:])
+    return " ".join(parts)
+
+
+CYRILLIC = re.compile(r"[а-яё]", _FLAGS)
+POLISH = re.compile(r"[ąćęłńśźż]|\b(?:ile|jakie|jaki|moje|mój|moja|saldo|ostatnie|wydałem|wydałam|na co)\b", _FLAGS)
+
+# Синонимы категорий на трех языках (ключ - категория в данных)
+CATEGORY_SYNONYMS = {
+    "food": ["food", "coffee", "restaurant", "еда", "еду", "еде", "кафе", "кофе", "jedzenie", "kawa", "restaurac"],
+    "groceries": ["groceries", "grocery", "продукт", "zakupy spożywcze", "spożywcz"],
+    "health": ["health", "pharmacy", "medicine", "здоровье", "аптек", "лекарств", "zdrowie", "aptek"],
+    "salary": ["salary", "зарплат", "wynagrodzen", "pensj"],
+    "gift": ["gift", "подар", "prezent"],
+}
+
+TEMPLATES = {
+    "balance": {
+        "en": "Your current balance is {balance} {currency}.",
+        "ru": "Ваш текущий баланс: {balance} {currency}.",
+        "pl": "Twoje aktualne saldo: {balance} {currency}.",
+    },
+    "total_income": {
+        "en": "Your total income is {total} {currency} (transactions: {count}).",
+        "ru": "Ваш общий доход: {total} {currency} (операций: {count}).",
+        "pl": "Twoje łączne przychody: {total} {currency} (transakcji: {count}).",
+    },
+    "total_expenses": {
+        "en": "Your total expenses are {total} {currency} (transactions: {count}).",
+        "ru": "Ваши общие расходы: {total} {currency} (операций: {count}).",
+        "pl": "Twoje łączne wydatki: {total} {currency} (transakcji: {count}).",
+    },
+    "category_expenses": {
+        "en": "You spent {total} {currency} on {category} (transactions: {count}).",
+        "ru": "На категорию «{category}» вы потратили {total} {currency} (операций: {count}).",
+        "pl": "Na kategorię „{category}” wydano {total} {currency} (transakcji: {count}).",
+    },
+    "category_income": {
+        "en": "Your income from {category} is {total} {currency} (transactions: {count}).",
+        "ru": "Доход по категории «{category}»: {total} {currency} (операций: {count}).",
+        "pl": "Przychody z kategorii „{category}”: {total} {currency} (transakcji: {count}).",
+    },
+    "largest_expense": {
+        "en": "Your largest expense is {name}: {amount} {currency} on {date} (category: {category}).",
+        "ru": "Ваша самая большая трата - {name}: {amount} {currency}, {date} (категория: {category}).",
+        "pl": "Twój największy wydatek to {name}: {amount} {currency}, {date} (kategoria: {category}).",
+    },
+    "no_expenses": {
+        "en": "You have no expenses yet.",
+        "ru": "У вас пока нет расходов.",
+        "pl": "Nie masz jeszcze żadnych wydatków.",
+    },
+    "last_transactions": {
+        "en": "Your last {count} transactions:",
+        "ru": "Ваши последние транзакции ({count}):",
+        "pl": "Twoje ostatnie transakcje ({count}):",
+    },
+}
+
+
+def detect_language(text):
+    """Грубое определение языка вопроса: ru / pl / en"""
+    if CYRILLIC.search(text):
+        return "ru"
+    if POLISH.search(text):
+        return "pl"
+    return "en"
+
+
+def format_amount(value):
+    """Сумма без лишних нулей: 200 -> 200, 1520.3 -> 1520.30"""
+    value = round(float(value), 2)
+    return str(int(value)) if value.is_integer() else f"{value:.2f}"
+
+
+class FastPathEngine:
+    """Распознает простые вопросы и считает ответ по данным пользователя"""
+
+    def __init__(self, category_synonyms=CATEGORY_SYNONYMS):
+        self.category_synonyms = category_synonyms
+        self._tables = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.intents = {}
+
+    def _category_table(self, categories):
+        """Названия и синонимы категорий журнала: (фразы из нескольких слов, одиночные, их кортеж для startswith)"""
+        key = tuple(sorted(categories))
+        table = self._tables.get(key)
+        if table is None:
+            names = [(category, name.lower()) for category in key
+                     for name in [category] + self.category_synonyms.get(category, [])]
+            single = [(category, name) for category, name in names if " " not in name]
+            table = ([(category, name) for category, name in names if " " in name], single,
+                     tuple(name for _, name in single))
+            if len(self._tables) >= 64:
+                self._tables.clear()  # Категории меняются редко - таблиц обычно одна-две
+            self._tables[key] = table
+        return table
+
+    def _classify(self, lower_text, categories):
+        """Возвращает (intent, параметры) или None"""
+        if len(lower_text) > FASTPATH_MAX_LENGTH or DECLINE.search(lower_text):
+            return None
+        words = WORD.findall(lower_text)
+        if any(is_period_word(word) for word in words):
+            return None
+
+        # Вопрос должен быть покрыт целиком: слова интента, категории журнала и служебные слова
+        found = {pattern: list(pattern.finditer(lower_text)) for pattern in INTENTS}
+        text = strip_intent_words(lower_text, [match for matches in found.values() for match in matches])
+        phrases, single, prefixes = self._category_table(categories)
+        for _, name in phrases:
+            text = text.replace(name, " ")
+        if any(word not in COVERED_WORDS and not word.startswith(prefixes) for word in WORD.findall(text)):
+            return None
+
+        if found[LARGEST]:
+            return "largest_expense", {}
+
+        if found[LAST_N]:
+            count = next((int(group) for group in found[LAST_N][0].groups() if group), LAST_N_DEFAULT)
+            return "last_transactions", {"count": max(1, min(count, LAST_N_MAX))}
+
+        spend = found[SPEND]
+        income = found[INCOME]
+        category = next((category for category, name in phrases if name in lower_text), None)
+        if category is None:
+            category = next((category for category, name in single if any(word.startswith(name) for word in words)),
+                            None)
+
+        if category and (spend or income):
+            return ("category_income" if income and not spend else "category_expenses"), {"category": category}
+        if spend and not income:
+            return "total_expenses", {}
+        if income and not spend:
+            return "total_income", {}
+        if found[BALANCE] and not (spend or income):
+            return "balance", {}
+        return None
+
+    def _render(self, intent, params, language, ledger, user_id):
+        summary = ledger.summary(user_id)
+        currency = summary["currency"]
+        templates = TEMPLATES
+
+        if intent == "balance":
+            return templates["balance"][language].format(balance=format_amount(summary["balance"]), currency=currency)
+
+        if intent in ("total_income", "total_expenses", "category_income", "category_expenses"):
+            want_income = intent.endswith("income")
+            totals = summary["categories"][params["category"]] if "category" in params else summary
+            total = totals["income"] if want_income else totals["expenses"]
+            count = totals["income_count"] if want_income else totals["expense_count"]
+            return templates[intent][language].format(
+                total=format_amount(total), currency=currency, count=count,
+                category=params.get("category"))
+
+        if intent == "largest_expense":
+            largest = ledger.largest_expense(user_id)
+            if largest is None:
+                return templates["no_expenses"][language]
+            return templates["largest_expense"][language].format(
+                name=largest["name"], amount=format_amount(abs(largest["amount"])), currency=currency,
+                date=largest["date"], category=largest["category"])
+
+        if intent == "last_transactions":
+            recent = ledger.recent(user_id, params["count"])
+            lines = [templates["last_transactions"][language].format(count=len(recent))]
+            for t in recent:
+                symbol = "+" if t["amount"] > 0 else "-"
+                lines.append(f"- [{t['date']}] {t['name']}: {symbol}{format_amount(abs(t['amount']))} {currency} ({t['category']})")
+            return "\n".join(lines)
+
+        return None
+
+    def answer(self, user_input, ledger, user_id=DEFAULT_USER):
+        """Ответ на вопрос по данным журнала или None, если вопрос нужно отдать LLM"""
+        lower_text = user_input.strip().lower()
+        classified = self._classify(lower_text, ledger.summary(user_id)["categories"])
+        if classified is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        intent, params = classified
+        language = detect_language(lower_text)
+        result = self._render(intent, params, language, ledger, user_id)
+        with self._lock:
+            self.hits += 1
+            self.intents[intent] = self.intents.get(intent, 0) + 1
+        return {"result": result, "intent": intent, "language": language}
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "offload_rate": round(self.hits / total, 3) if total else 0.0,
+                "intents": dict(self.intents),
+            }
@@ -0,0 +1,87 @@
+"""Условные ответы (ETag / Last-Modified -> 304) и сжатие больших ответов.
+
+ETag строится из версии данных пользователя, поэтому пока данные не
+менялись, клиент получает 304 без тела и без повторной сериализации.
+JSON-ответы больше COMPRESS_MIN_BYTES сжимаются brotli (если установлен)
+или gzip в зависимости от Accept-Encoding.
+"""
+import gzip
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "5"))  # gzip 1-9, brotli quality 0-11
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/html")
+
+
+def make_etag(*parts):
+    """Слабый ETag из частей версии (версия данных, время изменения, ...)"""
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def is_not_modified(etag, last_modified=None):
+    """Совпадает ли то, что уже есть у клиента, с текущей версией"""
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        # If-None-Match важнее If-Modified-Since (RFC 9110)
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags or etag[2:] in tags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since and last_modified:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(build_body, etag, last_modified=None, mimetype="application/json"):
+    """Ответ с ETag/Last-Modified; тело строится (build_body()) только если у клиента старая версия"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if is_not_modified(etag, last_modified):
+        return Response(status=304, headers=headers)
+    return Response(build_body(), mimetype=mimetype, headers=headers)
+
+
+def choose_encoding(accept_encoding):
+    accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")
+                if not part.strip().endswith(";q=0")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_response(response):
+    """after_request: сжимает большие JSON/текстовые ответы (кроме потоковых)"""
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+
+    if encoding == "br":
+        data = brotli.compress(data, quality=COMPRESS_LEVEL)
+    else:
+        data = gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
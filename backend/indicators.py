@@ -0,0 +1,331 @@
+"""Индикаторы по ценам акций для страницы Stocks.
+
+Ряды цен закрытия приходят через /api/stocks/series, вместе с запросом
+со страницы Stocks или из локального файла STOCKS_DATA_PATH. Индикаторы
+считаются пачкой сразу по многим тикерам: ряды выравниваются по концу в
+одну матрицу (тикеры x дни, в начале коротких рядов - NaN), и все операции
+идут по оси времени одновременно для всех строк:
+- доходность за 1д/1н/1м/3м/1г;
+- SMA 20/50/200 и EMA 12/26 (MACD);
+- годовая волатильность по 20 дням;
+- максимальная и текущая просадка;
+- доходность относительно среднего по выбранным тикерам.
+
+Результат по тикеру кешируется на версию ряда (хеш цен), поэтому при
+повторных запросах с теми же данными ничего не пересчитывается. В промпт
+уходит только короткая строка сигналов на тикер, а не сырые цены.
+
+Ряды из запроса страницы Stocks в общий движок не попадают: они считаются
+во временном движке этого запроса (IndicatorEngine.from_page), иначе один
+пользователь подменял бы данные в промпте другого.
+"""
+import csv
+import hashlib
+import json
+import os
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from logs import get_logger
+
+log = get_logger("indicators")
+if np is None:
+    log.warning("numpy не установлен. Индикаторы акций недоступны.")
+
+STOCKS_DATA_PATH = os.getenv("STOCKS_DATA_PATH", "")
+STOCKS_PROMPT_MAX_TICKERS = int(os.getenv("STOCKS_PROMPT_MAX_TICKERS", "12"))
+STOCKS_MAX_TICKERS = int(os.getenv("STOCKS_MAX_TICKERS", "5000"))
+STOCKS_MAX_POINTS = int(os.getenv("STOCKS_MAX_POINTS", "1260"))  # 5 лет торговых дней; старые цены отбрасываются
+STOCKS_PAGE_MAX_TICKERS = int(os.getenv("STOCKS_PAGE_MAX_TICKERS", "50"))
+
+TRADING_DAYS = 252
+RETURN_HORIZONS = {"1d": 1, "1w": 5, "1m": 21, "3m": 63, "1y": 252}
+SMA_WINDOWS = (20, 50, 200)
+EMA_SPANS = (12, 26)
+VOLATILITY_WINDOW = 20
+
+
+class IndicatorsUnavailable(RuntimeError):
+    """numpy не установлен"""
+
+
+def series_version(prices):
+    """Версия ряда - хеш цен"""
+    return hashlib.sha1(np.asarray(prices, dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+def to_prices(values):
+    """Цены из списка чисел или точек вида {"time": ..., "price": ...}"""
+    prices = []
+    for value in values:
+        if isinstance(value, dict):
+            value = value.get("price", value.get("close"))
+        prices.append(float(value))
+    return prices
+
+
+def pack(series_list):
+    """Ряды разной длины -> матрица (ряды x дни), выровненная по последнему дню, с NaN в начале"""
+    length = max(len(series) for series in series_list)
+    matrix = np.full((len(series_list), length), np.nan)
+    for row, series in enumerate(series_list):
+        if len(series):
+            matrix[row, length - len(series):] = series
+    return matrix
+
+
+def horizon_returns(prices, days):
+    """Доходность за последние days дней (NaN, если ряд короче)"""
+    if prices.shape[1] <= days:
+        return np.full(prices.shape[0], np.nan)
+    return prices[:, -1] / prices[:, -1 - days] - 1
+
+
+def last_sma(prices, window):
+    """Последнее значение SMA(window) для каждой строки (NaN, если данных меньше окна)"""
+    if prices.shape[1] < window:
+        return np.full(prices.shape[0], np.nan)
+    # NaN в окне делает среднее NaN - так и нужно: данных меньше окна
+    return prices[:, -window:].mean(axis=1)
+
+
+def ema(prices, span):
+    """EMA по всей матрице: цикл по дням, векторно по всем тикерам сразу"""
+    alpha = 2.0 / (span + 1)
+    result = np.empty_like(prices)
+    current = prices[:, 0].copy()
+    result[:, 0] = current
+    for day in range(1, prices.shape[1]):
+        column = prices[:, day]
+        # Пока ряд не начался (NaN), EMA стартует с первой цены
+        current = np.where(np.isnan(current), column, current + alpha * (column - current))
+        result[:, day] = current
+    return result
+
+
+def rolling_volatility(prices, window=VOLATILITY_WINDOW):
+    """Годовая волатильность дневных доходностей за последние window дней"""
+    if prices.shape[1] <= window:
+        return np.full(prices.shape[0], np.nan)
+    returns = prices[:, -window:] / prices[:, -window - 1:-1] - 1
+    return returns.std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS)
+
+
+def drawdowns(prices):
+    """(максимальная просадка, текущая просадка) от исторического максимума"""
+    running_max = np.fmax.accumulate(np.nan_to_num(prices, nan=-np.inf), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drawdown = prices / running_max - 1
+    return np.nanmin(drawdown, axis=1), drawdown[:, -1]
+
+
+def compute_signals(tickers, series_list):
+    """Сигналы по пачке тикеров: {тикер: {показатель: значение}}"""
+    prices = pack(series_list)
+    last = prices[:, -1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = {name: horizon_returns(prices, days) for name, days in RETURN_HORIZONS.items()}
+        smas = {window: last_sma(prices, window) for window in SMA_WINDOWS}
+        # EMA нужна только последняя - считаем по окну, достаточному для сходимости
+        tail = prices[:, -max(EMA_SPANS) * 8:]
+        emas = {span: ema(tail, span)[:, -1] for span in EMA_SPANS}
+        volatility = rolling_volatility(prices)
+        max_drawdown, current_drawdown = drawdowns(prices)
+
+    signals = {}
+    for row, ticker in enumerate(tickers):
+        def value(array, digits=4):
+            number = float(array[row])
+            return None if np.isnan(number) else round(number, digits)
+
+        sma = {f"sma{window}": value(smas[window], 2) for window in SMA_WINDOWS}
+        ema_fast, ema_slow = value(emas[EMA_SPANS[0]], 2), value(emas[EMA_SPANS[1]], 2)
+        price = value(last, 2)
+        trend = "flat"
+        if sma["sma50"] is not None and price is not None:
+            above_long = sma["sma200"] is None or sma["sma50"] > sma["sma200"]
+            if price > sma["sma50"] and above_long:
+                trend = "up"
+            elif price < sma["sma50"] and not above_long:
+                trend = "down"
+        elif ema_fast is not None and ema_slow is not None:
+            trend = "up" if ema_fast > ema_slow else "down" if ema_fast < ema_slow else "flat"
+
+        signals[ticker] = {
+            "price": price,
+            "days": int(np.count_nonzero(~np.isnan(prices[row]))),
+            "returns": {name: value(returns[name]) for name in RETURN_HORIZONS},
+            **sma,
+            f"ema{EMA_SPANS[0]}": ema_fast,
+            f"ema{EMA_SPANS[1]}": ema_slow,
+            "macd": round(ema_fast - ema_slow, 4) if ema_fast is not None and ema_slow is not None else None,
+            "volatility": value(volatility),
+            "max_drawdown": value(max_drawdown),
+            "drawdown": value(current_drawdown),
+            "trend": trend,
+        }
+    return signals
+
+
+def _percent(value):
+    return "n/a" if value is None else f"{value * 100:+.1f}%"
+
+
+def format_signal(ticker, signal):
+    """Одна компактная строка сигналов для промпта"""
+    returns = signal["returns"]
+    parts = [f"{ticker} {signal['price']}"]
+    available = [name for name in RETURN_HORIZONS if returns[name] is not None]
+    if available:
+        parts.append(" ".join(f"{name} {_percent(returns[name])}" for name in available))
+    smas = [f"SMA{window} {signal[f'sma{window}']}" for window in SMA_WINDOWS if signal[f"sma{window}"] is not None]
+    if smas:
+        parts.append(", ".join(smas))
+    if signal["macd"] is not None:
+        parts.append(f"MACD {signal['macd']:+.2f}")
+    if signal["volatility"] is not None:
+        parts.append(f"vol {signal['volatility'] * 100:.0f}%")
+    parts.append(f"maxDD {_percent(signal['max_drawdown'])} (now {_percent(signal['drawdown'])})")
+    if signal.get("relative") is not None:
+        parts.append(f"vs avg {signal['relative_horizon']} {_percent(signal['relative'])}")
+    parts.append(f"trend {signal['trend']}")
+    return "- " + " | ".join(parts)
+
+
+class IndicatorEngine:
+    """Ряды цен по тикерам и кеш сигналов по версии ряда"""
+
+    def __init__(self, max_tickers=STOCKS_MAX_TICKERS, max_points=STOCKS_MAX_POINTS):
+        self.max_tickers = max_tickers
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._series = {}  # тикер -> (версия, np.array цен)
+        self._signals = {}  # тикер -> (версия, сигналы)
+        self.computed = 0
+        self.cache_hits = 0
+
+    @property
+    def available(self):
+        return np is not None
+
+    def _require(self):
+        if np is None:
+            raise IndicatorsUnavailable("numpy не установлен")
+
+    def update(self, series):
+        """Загружает ряды {тикер: [цены]}; возвращает {тикер: версия}.
+
+        Сначала проверяются все ряды и лимит тикеров, и только потом что-то
+        меняется: при ошибке (ValueError) движок остается прежним. От ряда
+        длиннее max_points берутся последние max_points цен.
+        """
+        self._require()
+        parsed = {}
+        for ticker, values in series.items():
+            ticker = str(ticker).upper()
+            if not isinstance(values, list):
+                raise ValueError(f"Некорректный ряд цен для {ticker}")
+            prices = np.asarray(to_prices(values[-self.max_points:]), dtype=np.float64)
+            if not len(prices) or not np.all(np.isfinite(prices)) or np.any(prices <= 0):
+                raise ValueError(f"Некорректный ряд цен для {ticker}")
+            parsed[ticker] = prices
+        versions = {}
+        with self._lock:
+            added = sum(ticker not in self._series for ticker in parsed)
+            if len(self._series) + added > self.max_tickers:
+                raise ValueError(f"Слишком много тикеров (максимум {self.max_tickers})")
+            for ticker, prices in parsed.items():
+                version = series_version(prices)
+                if self._series.get(ticker, (None,))[0] != version:
+                    self._series[ticker] = (version, prices)
+                versions[ticker] = version
+        return versions
+
+    @classmethod
+    def from_page(cls, stocks, max_tickers=STOCKS_PAGE_MAX_TICKERS):
+        """Временный движок с рядами страницы Stocks: [{"symbol": ..., "data": [{"time", "price"}]}].
+
+        None - рядов в запросе нет (тогда используются загруженные данные).
+        """
+        series = {}
+        for stock in stocks if isinstance(stocks, list) else []:
+            if isinstance(stock, dict) and stock.get("symbol") and stock.get("data"):
+                series[stock["symbol"]] = stock["data"]
+        if not series:
+            return None
+        engine = cls(max_tickers=max_tickers)
+        engine.update(series)
+        return engine
+
+    def load_file(self, path):
+        """Загружает ряды из JSON ({тикер: [цены]}) или CSV (ticker,date,close)"""
+        if path.endswith(".csv"):
+            series = {}
+            with open(path, newline="") as f:
+                rows = sorted(csv.DictReader(f), key=lambda r: (r["ticker"], r["date"]))
+            for row in rows:
+                series.setdefault(row["ticker"], []).append(float(row["close"]))
+        else:
+            with open(path) as f:
+                series = json.load(f)
+        return self.update(series)
+
+    def tickers(self):
+        with self._lock:
+            return list(self._series)
+
+    def signals(self, tickers=None):
+        """Сигналы по тикерам (по умолчанию - по всем); пересчитываются только измененные ряды"""
+        self._require()
+        with self._lock:
+            tickers = [t.upper() for t in tickers] if tickers else list(self._series)
+            unknown = [t for t in tickers if t not in self._series]
+            if unknown:
+                raise KeyError(", ".join(unknown))
+            stale = [t for t in tickers if self._signals.get(t, (None,))[0] != self._series[t][0]]
+            self.cache_hits += len(tickers) - len(stale)
+            if stale:
+                computed = compute_signals(stale, [self._series[t][1] for t in stale])
+                for ticker, signal in computed.items():
+                    self._signals[ticker] = (self._series[ticker][0], signal)
+                self.computed += len(stale)
+            result = {t: dict(self._signals[t][1]) for t in tickers}
+
+            # Относительная доходность - против среднего по выбранным тикерам за самый
+            # длинный горизонт, доступный для всех (у коротких рядов со страницы - 1 неделя)
+            horizon = next((name for name in reversed(list(RETURN_HORIZONS))
+                            if all(s["returns"][name] is not None for s in result.values())), None)
+            values = [s["returns"][horizon] for s in result.values()] if horizon else []
+            average = sum(values) / len(values) if values else None
+            for signal in result.values():
+                signal["relative_horizon"] = horizon
+                signal["relative"] = round(signal["returns"][horizon] - average, 4) if average is not None else None
+            return result
+
+    def prompt_block(self, tickers=None, max_tickers=STOCKS_PROMPT_MAX_TICKERS):
+        """Блок промпта с вычисленными сигналами или "" если данных нет"""
+        if np is None or not self._series:
+            return ""
+        signals = self.signals(tickers)
+        ordered = list(signals.items())
+        if len(ordered) > max_tickers:
+            # Без явного выбора показываем лидеров и аутсайдеров по относительной доходности
+            ordered.sort(key=lambda item: -(item[1]["relative"] or 0))
+            half = max_tickers // 2
+            ordered = ordered[:max_tickers - half] + ordered[-half:]
+        lines = [f"=== COMPUTED MARKET SIGNALS ({len(ordered)} of {len(signals)} tickers) ==="]
+        lines += [format_signal(ticker, signal) for ticker, signal in ordered]
+        return "\n".join(lines) + "\n"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "available": np is not None,
+                "tickers": len(self._series),
+                "computed": self.computed,
+                "cache_hits": self.cache_hits,
+            }
@@ -0,0 +1,344 @@
+"""Фоновые задачи анализа документов с очередью в SQLite.
+
+Загрузка сразу возвращает id задачи, а разбор PDF и запросы к модели
+выполняет ограниченный пул потоков (JOB_WORKERS). Очередь хранится в
+локальном SQLite файле, а сам загруженный файл лежит на диске в
+DOCUMENT_SPOOL_DIR (uploads.py) - в параметрах задачи только путь к нему,
+поэтому задачи, не успевшие выполниться, переживают перезапуск. Глубина
+очереди ограничена (JOB_QUEUE_DEPTH): при переполнении submit бросает
+QueueFull (-> 429).
+
+Задачи забираются атомарно (UPDATE ... WHERE status = 'queued'), так что
+одну очередь могут разбирать несколько процессов. Процесс, который
+выполняет задачу, обновляет у нее heartbeat_at; задача без отметки дольше
+JOB_STALE_SECONDS (процесс упал посреди работы) возвращается в очередь, а
+после JOB_MAX_ATTEMPTS попыток - завершается ошибкой, чтобы задача,
+которая роняет процесс, не перезапускалась бесконечно. Для каждой задачи
+хранится время ожидания в очереди и время выполнения; наружу (get) из
+параметров отдаются только поля public_params.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from logs import get_logger
+
+JOBS_PATH = os.getenv("JOBS_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "32"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))
+JOB_POLL_INTERVAL = 1.0  # как часто проверять очередь без уведомления (задачи других процессов)
+
+FINISHED_STATUSES = ("done", "failed")
+
+log = get_logger("jobs")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    content BLOB,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs(status, created_at);
+"""
+
+
+class QueueFull(Exception):
+    """В очереди уже JOB_QUEUE_DEPTH задач"""
+
+    def __init__(self, depth, retry_after):
+        super().__init__(f"Очередь задач заполнена ({depth})")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+def _ms(start, end):
+    return round((end - start) * 1000, 1) if start and end else None
+
+
+class JobQueue:
+    """Персистентная очередь задач и пул потоков, который ее разбирает.
+
+    handler(params, content) -> dict результата; исключение или ключ "error"
+    в результате переводят задачу в failed. abandon(params) вызывается для
+    задачи, которую бросили после max_attempts попыток (например, удалить
+    ее файл). public_params - поля параметров, которые видны в get().
+    """
+
+    def __init__(self, handler, path=JOBS_PATH, workers=JOB_WORKERS, depth=JOB_QUEUE_DEPTH,
+                 stale_seconds=JOB_STALE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS, abandon=None, public_params=()):
+        self.handler = handler
+        self.path = path
+        self.workers = workers
+        self.depth = depth
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max_attempts
+        self.abandon = abandon
+        self.public_params = tuple(public_params)
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        self._threads = []
+        self._running = set()  # id задач, которые выполняет этот процесс (для heartbeat)
+        self._running_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._last_sweep = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "heartbeat_at" not in columns:
+                # Файл очереди из прежней версии без heartbeat
+                conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        self.requeue_stale()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Закрывает SQLite соединение текущего потока (мастер serve.py - перед fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def start(self):
+        """Запускает потоки-обработчики (один раз на процесс)"""
+        if self._threads or self.workers <= 0:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._notify()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def submit(self, kind, params, content=None):
+        """Ставит задачу в очередь и возвращает ее id; QueueFull, если очередь заполнена"""
+        conn = self._connect()
+        job_id = uuid.uuid4().hex
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.depth:
+                conn.execute("ROLLBACK")
+                self.rejected += 1
+                raise QueueFull(self.depth, self.retry_after(queued))
+            conn.execute("INSERT INTO jobs (id, kind, status, params, content, created_at) "
+                         "VALUES (?, ?, 'queued', ?, ?, ?)",
+                         (job_id, kind, json.dumps(params, ensure_ascii=False), content, time.time()))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify()
+        return job_id
+
+    def retry_after(self, queued=None):
+        """Через сколько секунд стоит повторить: очередь / воркеры * среднее время задачи"""
+        if queued is None:
+            queued = self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        average = self._connect().execute(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs "
+            "WHERE status = 'done' ORDER BY finished_at DESC LIMIT 50)").fetchone()[0] or 5.0
+        return max(1, int(queued / max(self.workers, 1) * average))
+
+    def _claim(self):
+        """Атомарно забирает самую старую задачу из очереди"""
+        conn = self._connect()
+        while True:
+            row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            claimed = conn.execute("UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, "
+                                   "attempts = attempts + 1 WHERE id = ? AND status = 'queued'",
+                                   (now, now, row["id"])).rowcount
+            if claimed:
+                with self._running_lock:
+                    self._running.add(row["id"])
+                self._notify()
+                return conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                log.warning("Очередь задач недоступна", error=e)
+                job = None
+            if job is None:
+                if time.monotonic() - self._last_sweep > min(self.stale_seconds, 60):
+                    self._last_sweep = time.monotonic()
+                    self.requeue_stale()
+                with self._changed:
+                    self._changed.wait(JOB_POLL_INTERVAL)
+                continue
+            self._run(job)
+
+    def _heartbeat(self):
+        """Отметка живости у задач этого процесса - их не заберет requeue_stale другого процесса"""
+        while not self._stopping.wait(max(self.stale_seconds / 3, 0.05)):
+            with self._running_lock:
+                running = list(self._running)
+            if not running:
+                continue
+            try:
+                self._connect().execute(
+                    f"UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND id IN "
+                    f"({', '.join('?' * len(running))})", (time.time(), *running))
+            except sqlite3.Error as e:
+                log.warning("Очередь задач недоступна", error=e)
+
+    def _run(self, job):
+        try:
+            result = self.handler(json.loads(job["params"]), job["content"])
+            error = result.get("error") if isinstance(result, dict) else None
+        except Exception as e:
+            log.error("Задача завершилась ошибкой", exc_info=True, job=job["id"])
+            result, error = None, f"Ошибка обработки: {e}"
+        finally:
+            with self._running_lock:
+                self._running.discard(job["id"])
+
+        status = "failed" if error else "done"
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, content = NULL, finished_at = ? WHERE id = ?",
+            (status, None if error else json.dumps(result, ensure_ascii=False), error, time.time(), job["id"]))
+        if error:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self._notify()
+        timing = self.get(job["id"])["timing"]
+        log.info("Задача завершена", job=job["id"], status=status, queued_ms=timing["queued_ms"],
+                 run_ms=timing["run_ms"])
+
+    def requeue_stale(self):
+        """Возвращает в очередь задачи, зависшие в running (процесс упал), и чистит старые.
+
+        Задача, у которой уже max_attempts попыток, в очередь не возвращается, а завершается ошибкой.
+        """
+        conn = self._connect()
+        now = time.time()
+        stale = now - self.stale_seconds
+        abandoned = conn.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, content = NULL, finished_at = ? "
+            "WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ? AND attempts >= ? "
+            "RETURNING id, params",
+            (f"Задача прервана {self.max_attempts} раз(а) - обработка остановлена", now, stale,
+             self.max_attempts)).fetchall()
+        requeued = conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL, heartbeat_at = NULL "
+                                "WHERE status = 'running' AND COALESCE(heartbeat_at, started_at) < ?",
+                                (stale,)).rowcount
+        conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                     (now - JOB_RETENTION,))
+        for row in abandoned:
+            self.failed += 1
+            log.warning("Задача брошена после повторов", job=row["id"], attempts=self.max_attempts)
+            if self.abandon is not None:
+                try:
+                    self.abandon(json.loads(row["params"]))
+                except Exception:
+                    log.error("Не удалось убрать брошенную задачу", exc_info=True, job=row["id"])
+        if requeued:
+            log.info("Незавершенные задачи возвращены в очередь", count=requeued)
+        if abandoned or requeued:
+            self._notify()
+        return requeued
+
+    def get(self, job_id):
+        """Статус, тайминги и результат задачи (dict) или None"""
+        conn = self._connect()
+        row = conn.execute("SELECT id, kind, status, params, result, error, attempts, created_at, started_at, "
+                           "finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        params = json.loads(row["params"])
+        job = {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "params": {key: params[key] for key in self.public_params if key in params},
+            "attempts": row["attempts"],
+            "timing": {
+                "queued_ms": _ms(row["created_at"], row["started_at"] or now),
+                "run_ms": _ms(row["started_at"], row["finished_at"] or (now if row["started_at"] else None)),
+                "total_ms": _ms(row["created_at"], row["finished_at"] or now),
+            },
+        }
+        if row["status"] == "queued":
+            job["position"] = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at <= ?",
+                                           (row["created_at"],)).fetchone()[0]
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def wait(self, job_id, status, timeout):
+        """Ждет смены статуса задачи (для SSE); возвращает актуальное состояние"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] != status or remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, JOB_POLL_INTERVAL))
+
+    def stats(self):
+        conn = self._connect()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        timing = conn.execute(
+            "SELECT AVG(started_at - created_at), AVG(finished_at - started_at), MAX(finished_at - started_at) "
+            "FROM jobs WHERE status IN ('done', 'failed')").fetchone()
+        return {
+            "workers": len(self._threads),
+            "depth": self.depth,
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "completed": self.completed,
+            "errors": self.failed,
+            "rejected": self.rejected,
+            "avg_queued_ms": round(timing[0] * 1000, 1) if timing[0] is not None else None,
+            "avg_run_ms": round(timing[1] * 1000, 1) if timing[1] is not None else None,
+            "max_run_ms": round(timing[2] * 1000, 1) if timing[2] is not None else None,
+            "path": self.path,
+        }
@@ -0,0 +1,508 @@
+"""Журнал транзакций пользователя в SQLite с инкрементальными агрегатами.
+
+Транзакции хранятся в таблице с индексами по дате, категории, типу и
+названию. Баланс, доход/расход и суммы по категориям и месяцам
+пересчитываются не сканированием, а при каждой вставке - в той же
+SQL-транзакции (таблицы accounts, category_totals, month_totals) и в
+зеркале в памяти процесса. Поэтому чтение агрегатов - O(1).
+
+У каждого счета есть версия, она растет при каждой вставке. По ней
+сбрасываются кеши ответов и проверяется, не поменял ли данные другой
+процесс (тогда зеркало перечитывается из таблиц агрегатов).
+"""
+import os
+import re
+import base64
+import json
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from functools import lru_cache
+
+LEDGER_PATH = os.getenv("LEDGER_PATH", "ledger.sqlite3")
+DEFAULT_USER = "default"
+
+DISPLAY_DATE_FORMAT = "%d %b %Y"  # "12 Nov 2025" - формат дат в API и промпте
+STORAGE_DATE_FORMAT = "%Y-%m-%d"  # ISO - сортируется как строка
+
+_NAME_WORDS = re.compile(r"\w+", re.UNICODE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    user_id TEXT PRIMARY KEY,
+    balance REAL NOT NULL,
+    currency TEXT NOT NULL,
+    card_number TEXT NOT NULL,
+    income REAL NOT NULL DEFAULT 0,
+    expenses REAL NOT NULL DEFAULT 0,
+    income_count INTEGER NOT NULL DEFAULT 0,
+    expense_count INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    amount REAL NOT NULL,
+    date TEXT NOT NULL,
+    category TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions(user_id, date, id);
+CREATE INDEX IF NOT EXISTS transactions_category ON transactions(user_id, category, date);
+CREATE INDEX IF NOT EXISTS transactions_type ON transactions(user_id, type, date);
+CREATE INDEX IF NOT EXISTS transactions_name ON transactions(user_id, name, date);
+CREATE INDEX IF NOT EXISTS transactions_amount ON transactions(user_id, type, amount);
+CREATE TABLE IF NOT EXISTS category_totals (
+    user_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    income REAL NOT NULL,
+    expenses REAL NOT NULL,
+    income_count INTEGER NOT NULL,
+    expense_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, category)
+);
+CREATE TABLE IF NOT EXISTS month_totals (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    income REAL NOT NULL,
+    expenses REAL NOT NULL,
+    income_count INTEGER NOT NULL,
+    expense_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, month)
+);
+"""
+
+_UPSERT_TOTALS = """INSERT INTO {table} VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, {key}) DO UPDATE SET
+        income = income + excluded.income,
+        expenses = expenses + excluded.expenses,
+        income_count = income_count + excluded.income_count,
+        expense_count = expense_count + excluded.expense_count"""
+
+TRANSACTION_COLUMNS = "id, type, name, amount, date, category"
+
+
+# Допустимые поля сортировки страницы транзакций
+SORT_COLUMNS = ("date", "amount")
+PAGE_LIMIT_MAX = 200
+
+
+class LedgerError(ValueError):
+    """Некорректная транзакция, фильтр или неизвестный счет"""
+
+
+def encode_cursor(sort, order, value, tx_id):
+    """Непрозрачный курсор страницы: позиция последней отданной транзакции"""
+    raw = json.dumps([sort, order, value, tx_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, tx_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise LedgerError("Некорректный курсор")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise LedgerError("Курсор получен для другой сортировки")
+    return value, tx_id
+
+
+@lru_cache(maxsize=4096)
+def to_storage_date(value):
+    """Дата транзакции в ISO (принимает "12 Nov 2025", ISO-строку или datetime)"""
+    if isinstance(value, datetime):
+        return value.strftime(STORAGE_DATE_FORMAT)
+    for fmt in (STORAGE_DATE_FORMAT, DISPLAY_DATE_FORMAT):
+        try:
+            return datetime.strptime(value, fmt).strftime(STORAGE_DATE_FORMAT)
+        except (TypeError, ValueError):
+            continue
+    raise LedgerError(f"Неизвестный формат даты: {value!r}")
+
+
+@lru_cache(maxsize=4096)
+def to_display_date(value):
+    return datetime.strptime(value, STORAGE_DATE_FORMAT).strftime(DISPLAY_DATE_FORMAT)
+
+
+def row_to_transaction(row):
+    """Строка таблицы -> транзакция в формате API"""
+    tx_id, tx_type, name, amount, date, category = row
+    return {"id": tx_id, "type": tx_type, "name": name, "amount": amount,
+            "date": to_display_date(date), "category": category}
+
+
+def _empty_totals():
+    return {"income": 0.0, "expenses": 0.0, "income_count": 0, "expense_count": 0}
+
+
+def _add_to_totals(totals, amount):
+    if amount > 0:
+        totals["income"] += amount
+        totals["income_count"] += 1
+    else:
+        totals["expenses"] += -amount
+        totals["expense_count"] += 1
+
+
+class NameIndex:
+    """Слово -> названия транзакций, где оно встречается, и те же слова по алфавиту.
+
+    Индекс не меняется после создания: новые названия дают новый индекс
+    (with_names), поэтому читатели перебирают его без блокировки.
+    """
+
+    def __init__(self, names=None, tokens=None):
+        self.names = names if names is not None else {}
+        # Отсортированный список слов - поиск по началу слова бинарным поиском, а не перебором
+        self.tokens = tokens if tokens is not None else sorted(self.names)
+
+    def with_names(self, names):
+        """Индекс с добавленными названиями; тот же индекс, если ничего нового"""
+        added = {}
+        for name in names:
+            for word in _NAME_WORDS.findall(name.lower()):
+                if name not in self.names.get(word, ()):
+                    added.setdefault(word, set()).add(name)
+        if not added:
+            return self
+        index = dict(self.names)
+        tokens = list(self.tokens)
+        for word, word_names in added.items():
+            if word not in index:
+                insort(tokens, word)
+            index[word] = frozenset(index.get(word, frozenset()) | word_names)
+        return NameIndex(index, tokens)
+
+    def with_prefix(self, prefix):
+        """Слова индекса, начинающиеся с prefix"""
+        tokens = self.tokens
+        i = bisect_left(tokens, prefix)
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            yield tokens[i]
+            i += 1
+
+
+class Ledger:
+    """Транзакции и агрегаты по счетам пользователей"""
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._summaries = {}  # user_id -> агрегаты в памяти
+        self._names = {}  # user_id -> NameIndex
+        with self._write_lock:
+            conn = self._connect()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(accounts)")}
+            if "updated_at" not in columns:
+                # Файл журнала из прежней версии без времени изменения
+                conn.execute("ALTER TABLE accounts ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- Счета ----------
+
+    def has_account(self, user_id=DEFAULT_USER):
+        row = self._connect().execute("SELECT 1 FROM accounts WHERE user_id = ?", (user_id,)).fetchone()
+        return row is not None
+
+    def create_account(self, user_id=DEFAULT_USER, balance=0.0, currency="zł", card_number="", transactions=()):
+        """Создает счет с начальным балансом и историей (баланс историей не меняется)"""
+        with self._write_lock:
+            conn = self._connect()
+            conn.execute("INSERT INTO accounts (user_id, balance, currency, card_number, updated_at)"
+                         " VALUES (?, ?, ?, ?, ?)", (user_id, balance, currency, card_number, time.time()))
+        if transactions:
+            self.append_many(transactions, user_id, adjust_balance=False)
+
+    def seed(self, data, user_id=DEFAULT_USER):
+        """Создает счет из словаря в формате USER_DATA, если его еще нет"""
+        if self.has_account(user_id):
+            return False
+        # USER_DATA хранит транзакции от новых к старым - вставляем в хронологическом порядке
+        self.create_account(user_id, data["balance"], data["currency"], data["card_number"],
+                            list(reversed(data["transactions"])))
+        return True
+
+    # ---------- Запись ----------
+
+    def _normalize(self, transaction):
+        try:
+            amount = float(transaction["amount"])
+            name = str(transaction["name"])
+            category = str(transaction.get("category") or "other")
+            date = to_storage_date(transaction.get("date") or datetime.now())
+        except (KeyError, TypeError, ValueError) as e:
+            raise LedgerError(f"Некорректная транзакция: {e}")
+        # Явный тип задает знак суммы ({"type": "expense", "amount": 50} - это -50),
+        # без типа знак берется как есть; тип хранится по знаку - так же считаются агрегаты
+        declared = transaction.get("type")
+        if declared == "income":
+            amount = abs(amount)
+        elif declared == "expense":
+            amount = -abs(amount)
+        elif declared is not None:
+            raise LedgerError(f"Некорректный тип транзакции: {declared} (income или expense)")
+        tx_type = "income" if amount > 0 else "expense"
+        return tx_type, name, amount, date, category
+
+    def append(self, transaction, user_id=DEFAULT_USER):
+        """Добавляет транзакцию и возвращает ее в формате API (с id)"""
+        return self.append_many([transaction], user_id)[0]
+
+    def append_many(self, transactions, user_id=DEFAULT_USER, adjust_balance=True):
+        """Добавляет транзакции одной SQL-транзакцией и инкрементально обновляет агрегаты"""
+        rows = [self._normalize(t) for t in transactions]
+        if not rows:
+            return []
+
+        income = expenses = 0.0
+        income_count = expense_count = 0
+        categories = {}
+        months = {}
+        for _, _, amount, date, category in rows:
+            if amount > 0:
+                income += amount
+                income_count += 1
+            else:
+                expenses += -amount
+                expense_count += 1
+            _add_to_totals(categories.setdefault(category, _empty_totals()), amount)
+            _add_to_totals(months.setdefault(date[:7], _empty_totals()), amount)
+        balance_delta = (income - expenses) if adjust_balance else 0.0
+        updated_at = time.time()
+
+        with self._write_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.execute(
+                    "UPDATE accounts SET balance = balance + ?, income = income + ?, expenses = expenses + ?,"
+                    " income_count = income_count + ?, expense_count = expense_count + ?, version = version + 1,"
+                    " updated_at = ? WHERE user_id = ?",
+                    (balance_delta, income, expenses, income_count, expense_count, updated_at, user_id))
+                if cursor.rowcount == 0:
+                    raise LedgerError(f"Неизвестный счет: {user_id}")
+                first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM transactions").fetchone()[0]
+                conn.executemany(
+                    "INSERT INTO transactions (user_id, type, name, amount, date, category) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(user_id, *row) for row in rows])
+                for table, key, totals in (("category_totals", "category", categories), ("month_totals", "month", months)):
+                    conn.executemany(_UPSERT_TOTALS.format(table=table, key=key), [
+                        (user_id, name, t["income"], t["expenses"], t["income_count"], t["expense_count"])
+                        for name, t in totals.items()])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+            summary = self._summaries.get(user_id)
+            if summary is not None and summary["version"] == self._stored_version(user_id) - 1:
+                # Зеркало в памяти было актуальным - обновляем его так же инкрементально, но копией:
+                # читатели без блокировки перебирают прежние словари, их менять нельзя
+                summary = dict(summary)
+                summary["balance"] += balance_delta
+                summary["income"] += income
+                summary["expenses"] += expenses
+                summary["income_count"] += income_count
+                summary["expense_count"] += expense_count
+                summary["count"] += len(rows)
+                summary["version"] += 1
+                summary["updated_at"] = updated_at
+                for table, totals in (("categories", categories), ("months", months)):
+                    summary[table] = dict(summary[table])
+                    for name, delta in totals.items():
+                        current = dict(summary[table].get(name) or _empty_totals())
+                        for field, value in delta.items():
+                            current[field] += value
+                        summary[table][name] = current
+                self._names[user_id] = self._names[user_id].with_names({name for _, name, _, _, _ in rows})
+                self._summaries[user_id] = summary
+            else:
+                self._summaries.pop(user_id, None)
+
+        return [row_to_transaction((first_id + i, *row)) for i, row in enumerate(rows)]
+
+    # ---------- Чтение агрегатов ----------
+
+    def _stored_version(self, user_id):
+        row = self._connect().execute("SELECT version FROM accounts WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            raise LedgerError(f"Неизвестный счет: {user_id}")
+        return row[0]
+
+    def _load_summary(self, user_id):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT balance, currency, card_number, income, expenses, income_count, expense_count, version, updated_at"
+            " FROM accounts WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            raise LedgerError(f"Неизвестный счет: {user_id}")
+        balance, currency, card_number, income, expenses, income_count, expense_count, version, updated_at = row
+        summary = {
+            "balance": balance, "currency": currency, "card_number": card_number,
+            "income": income, "expenses": expenses,
+            "income_count": income_count, "expense_count": expense_count,
+            "count": income_count + expense_count, "version": version, "updated_at": updated_at,
+        }
+        for table, key, field in (("category_totals", "category", "categories"), ("month_totals", "month", "months")):
+            summary[field] = {
+                name: {"income": t_income, "expenses": t_expenses, "income_count": t_ic, "expense_count": t_ec}
+                for name, t_income, t_expenses, t_ic, t_ec in conn.execute(
+                    f"SELECT {key}, income, expenses, income_count, expense_count FROM {table} WHERE user_id = ?",
+                    (user_id,))
+            }
+        names = {}
+        for (name,) in conn.execute("SELECT DISTINCT name FROM transactions WHERE user_id = ?", (user_id,)):
+            for word in _NAME_WORDS.findall(name.lower()):
+                names.setdefault(word, set()).add(name)
+        return summary, NameIndex({word: frozenset(word_names) for word, word_names in names.items()})
+
+    def summary(self, user_id=DEFAULT_USER):
+        """Баланс, итоги, суммы по категориям и месяцам (O(1)).
+
+        Возвращает снимок: вставки заменяют его новым словарем, а не меняют,
+        поэтому его можно перебирать без блокировки (но не менять самому).
+        """
+        version = self._stored_version(user_id)
+        summary = self._summaries.get(user_id)
+        if summary is None or summary["version"] != version:
+            # Первый запрос или данные изменил другой процесс - перечитываем агрегаты
+            with self._write_lock:
+                summary, names = self._load_summary(user_id)
+                self._summaries[user_id] = summary
+                self._names[user_id] = names
+        return summary
+
+    def version(self, user_id=DEFAULT_USER):
+        """Версия данных счета - растет при каждой вставке"""
+        return self._stored_version(user_id)
+
+    def name_index(self, user_id=DEFAULT_USER):
+        """Индекс слов названий транзакций (NameIndex)"""
+        self.summary(user_id)
+        return self._names[user_id]
+
+    # ---------- Чтение транзакций ----------
+
+    def recent(self, user_id=DEFAULT_USER, limit=5):
+        """Последние транзакции, от новых к старым"""
+        rows = self._connect().execute(
+            f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE user_id = ?"
+            " ORDER BY date DESC, id DESC LIMIT ?", (user_id, limit))
+        return [row_to_transaction(row) for row in rows]
+
+    def largest_expense(self, user_id=DEFAULT_USER):
+        row = self._connect().execute(
+            f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE user_id = ? AND type = 'expense'"
+            " ORDER BY amount LIMIT 1", (user_id,)).fetchone()
+        return row_to_transaction(row) if row else None
+
+    def find(self, user_id=DEFAULT_USER, categories=None, names=None, months=None, limit=100):
+        """Транзакции по категориям/названиям (ИЛИ) в заданных месяцах, от новых к старым"""
+        where = ["user_id = ?"]
+        params = [user_id]
+        match = []
+        if categories:
+            match.append(f"category IN ({','.join('?' * len(categories))})")
+            params += list(categories)
+        if names:
+            match.append(f"name IN ({','.join('?' * len(names))})")
+            params += list(names)
+        if match:
+            where.append("(" + " OR ".join(match) + ")")
+        if months:
+            where.append("(" + " OR ".join("date BETWEEN ? AND ?" for _ in months) + ")")
+            for month in months:
+                params += [f"{month}-01", f"{month}-31"]
+        rows = self._connect().execute(
+            f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE {' AND '.join(where)}"
+            " ORDER BY date DESC, id DESC LIMIT ?", (*params, limit))
+        return [row_to_transaction(row) for row in rows]
+
+    def page(self, user_id=DEFAULT_USER, tx_type=None, category=None, date_from=None, date_to=None,
+             sort="date", order="desc", limit=50, cursor=None):
+        """Страница транзакций с фильтрами и keyset-пагинацией.
+
+        Возвращает (транзакции, курсор следующей страницы или None). Курсор
+        хранит позицию последней транзакции, поэтому страницы не сдвигаются
+        при появлении новых записей и не требуют OFFSET.
+        """
+        if sort not in SORT_COLUMNS:
+            raise LedgerError(f"Сортировка возможна по полям: {', '.join(SORT_COLUMNS)}")
+        if order not in ("asc", "desc"):
+            raise LedgerError("Порядок сортировки: asc или desc")
+        limit = max(1, min(int(limit), PAGE_LIMIT_MAX))
+
+        where = ["user_id = ?"]
+        params = [user_id]
+        if tx_type:
+            if tx_type not in ("income", "expense"):
+                raise LedgerError("Тип транзакции: income или expense")
+            where.append("type = ?")
+            params.append(tx_type)
+        if category:
+            where.append("category = ?")
+            params.append(category)
+        if date_from:
+            where.append("date >= ?")
+            params.append(to_storage_date(date_from))
+        if date_to:
+            where.append("date <= ?")
+            params.append(to_storage_date(date_to))
+        if cursor:
+            value, tx_id = decode_cursor(cursor, sort, order)
+            where.append(f"({sort}, id) {'<' if order == 'desc' else '>'} (?, ?)")
+            params += [value, tx_id]
+
+        direction = order.upper()
+        rows = self._connect().execute(
+            f"SELECT {TRANSACTION_COLUMNS} FROM transactions WHERE {' AND '.join(where)}"
+            f" ORDER BY {sort} {direction}, id {direction} LIMIT ?", (*params, limit + 1)).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, order, last[4] if sort == "date" else last[3], last[0])
+        return [row_to_transaction(row) for row in rows], next_cursor
+
+    def rows_after(self, last_id, user_id=DEFAULT_USER):
+        """Сырые строки (id, amount, date, category, name) с id > last_id - для дозагрузки копий"""
+        return self._connect().execute(
+            "SELECT id, amount, date, category, name FROM transactions WHERE id > ? AND user_id = ? ORDER BY id",
+            (last_id, user_id)).fetchall()
+
+    def user_data(self, user_id=DEFAULT_USER, limit=None):
+        """Данные в прежнем формате USER_DATA (последние limit транзакций или все)"""
+        summary = self.summary(user_id)
+        return {
+            "balance": round(summary["balance"], 2),
+            "currency": summary["currency"],
+            "card_number": summary["card_number"],
+            "transactions": self.recent(user_id, -1 if limit is None else limit),
+        }
+
+    def close(self):
+        """Закрывает SQLite соединение текущего потока (мастер serve.py - перед fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def stats(self):
+        return {"path": self.path, "accounts": len(self._summaries)}
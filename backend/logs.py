@@ -0,0 +1,166 @@
+"""Структурированные логи с уровнями, без записи в stdout на пути запроса.
+
+Вызов log.info(...) в потоке запроса только кладет запись в очередь
+(logging.handlers.QueueHandler), а форматирует и пишет в stdout отдельный
+поток (QueueListener). Если писатель не успевает и очередь заполнена
+(LOG_QUEUE_SIZE), запись выбрасывается и считается в dropped - запрос не
+ждет stdout. Записи ниже LOG_LEVEL отбрасываются еще до очереди.
+
+Поля передаются отдельно от сообщения: log.info("Ответ модели", model=m,
+status=200). Формат LOG_FORMAT=text - строка "время уровень логгер:
+сообщение ключ=значение", json - один JSON объект на строку.
+
+Процесс можно форкать (serve.py): перед fork поток-писатель дописывает
+очередь и останавливается, после fork - запускается заново и в родителе,
+и в дочернем процессе (потоки при fork не копируются).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT_LOGGER = "finbot"
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который не блокируется и не форматирует запись в потоке запроса"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Форматирование (и traceback) - в потоке QueueListener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class Logger:
+    """Обертка над logging.Logger: поля записи - keyword аргументами.
+
+    Уровень проверяется до создания записи, поэтому выключенный debug на
+    горячем пути стоит одного сравнения.
+    """
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, exc_info=False, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info)
+
+
+_setup_lock = threading.Lock()
+_handler = None
+_listener = None
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Настраивает очередь и поток-писатель (один раз на процесс)"""
+    global _handler, _listener
+    with _setup_lock:
+        if _handler is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        _handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(level)
+        root.addHandler(_handler)
+        root.propagate = False
+        _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def _pause_listener():
+    # До fork: дописываем очередь и останавливаем поток, чтобы его блокировки не достались ребенку
+    _setup_lock.acquire()
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _resume_listener():
+    if _listener is not None and _listener._thread is None:
+        _listener.start()
+    _setup_lock.release()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_pause_listener, after_in_parent=_resume_listener, after_in_child=_resume_listener)
+
+
+def shutdown_logging():
+    """Дописывает очередь и останавливает поток-писатель"""
+    global _listener
+    with _setup_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def get_logger(name):
+    """Логгер модуля: get_logger("back") -> finbot.back"""
+    setup_logging()
+    return Logger(logging.getLogger(f"{ROOT_LOGGER}.{name}"))
+
+
+def stats():
+    """Размер очереди и число выброшенных записей"""
+    return {
+        "level": LOG_LEVEL,
+        "format": LOG_FORMAT,
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+    }
@@ -0,0 +1,262 @@
+"""Метрики задержек и счетчики в текстовом формате Prometheus (/api/metrics).
+
+Без внешних зависимостей: счетчики и гистограммы с метками живут в памяти
+процесса (при нескольких воркерах каждый отдает свои - Prometheus
+собирает их по отдельности). Запись - словарь и несколько сложений под
+коротким lock, поэтому замеры можно ставить прямо на горячем пути.
+Gauge считаются в момент отдачи /api/metrics функцией-источником.
+
+Все метрики процесса объявлены здесь, в конце модуля, чтобы их список
+и единицы были видны в одном месте.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Секунды: сопоставление навигации и сборка промпта - микросекунды, upstream и документы - секунды
+FAST_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+SLOW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Общее для метрик с метками: имя, описание, набор меток, lock"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name}: ожидаются метки {self.label_names}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = self.header()
+        lines += [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in values]
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=SLOW_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [счетчики по корзинам (последняя - +Inf), сумма, количество]
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер блока with в секундах"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            return series[2] if series else 0
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Gauge(Metric):
+    """Значение считается при отдаче метрик: source() -> число или {(метки...): число}"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, source, labels=()):
+        super().__init__(name, documentation, labels)
+        self.source = source
+
+    def render(self):
+        try:
+            value = self.source()
+        except Exception as e:  # Источник недоступен (например, SQLite занят) - метрика пропускается
+            return [f"# {self.name} недоступна: {_escape(e)}"]
+        values = value.items() if isinstance(value, dict) else [((), value)]
+        lines = self.header()
+        lines += [f"{self.name}{_labels(self.label_names, key)} {_number(v)}" for key, v in sorted(values)
+                  if v is not None]
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=SLOW_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, source, labels=()):
+        return self._register(Gauge(name, documentation, source, labels))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+def process_memory(pid="self"):
+    """Память процесса в байтах из /proc (Linux): rss и pss; None, если /proc нет.
+
+    pss делит общие страницы между процессами, которые их используют: у
+    воркеров serve.py код и данные, загруженные мастером до fork, общие.
+    """
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss"] = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        return None
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    memory["pss"] = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass  # smaps_rollup - Linux 4.14+
+    return memory
+
+
+def _reset_start_time():
+    global PROCESS_START_TIME
+    PROCESS_START_TIME = time.time()
+
+
+PROCESS_START_TIME = time.time()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_start_time)
+
+REGISTRY = Registry()
+
+NAVIGATION_SECONDS = REGISTRY.histogram(
+    "finbot_navigation_match_seconds", "Сопоставление команд навигации (command - вопрос, response - ответ модели)",
+    ("source",), FAST_BUCKETS)
+PROMPT_BUILD_SECONDS = REGISTRY.histogram(
+    "finbot_prompt_build_seconds", "Сборка системного промпта с финансовым контекстом", (), FAST_BUCKETS)
+UPSTREAM_TTFB_SECONDS = REGISTRY.histogram(
+    "finbot_upstream_ttfb_seconds", "Время до заголовков ответа upstream (одна попытка)", ("model", "stream"))
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "finbot_upstream_request_seconds", "Полное время запроса к upstream, включая тело (одна попытка)",
+    ("model", "stream"))
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    "finbot_upstream_responses_total", "Ответы upstream по моделям и кодам (error - сеть/таймаут)",
+    ("model", "status"))
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "finbot_upstream_retries_total", "Повторы запроса к upstream после 429/5xx", ("model", "status"))
+MODEL_FALLBACKS = REGISTRY.counter(
+    "finbot_model_fallbacks_total", "Переключения на следующую модель после ошибки", ("model", "status"))
+MODEL_HEDGES = REGISTRY.counter(
+    "finbot_model_hedges_total", "Хедж-запросы во вторую модель", ("model",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "finbot_cache_requests_total", "Обращения к кешам: hit / miss", ("cache", "result"))
+DOCUMENT_EXTRACTION_SECONDS = REGISTRY.histogram(
+    "finbot_document_extraction_seconds", "Извлечение текста документа (PDF постранично, текст с очисткой)",
+    ("type", "outcome"))
+DOCUMENT_ANALYSIS_SECONDS = REGISTRY.histogram(
+    "finbot_document_analysis_seconds", "Анализ документа целиком: извлечение и запросы к модели",
+    ("mode", "outcome"))
+ADMISSION_DECISIONS = REGISTRY.counter(
+    "finbot_admission_decisions_total", "Решения контроля допуска: admitted или причина отказа (429)",
+    ("priority", "outcome"))
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "finbot_admission_wait_seconds", "Ожидание допуска в очереди (допущенные запросы)", ("priority",))
+SESSION_COMPACTIONS = REGISTRY.counter(
+    "finbot_session_compactions_total", "Сворачивания истории сессий в сводку (fallback - локально после ошибки модели)",
+    ("mode", "outcome"))
+REGISTRY.gauge("finbot_process_memory_bytes", "Память процесса: rss - резидентная, pss - с долей общих страниц",
+               lambda: {(kind,): value for kind, value in (process_memory() or {}).items()}, ("kind",))
+REGISTRY.gauge("finbot_process_start_time_seconds", "Время старта процесса (воркера), unix",
+               lambda: PROCESS_START_TIME)
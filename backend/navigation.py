@@ -0,0 +1,206 @@
+"""Распознавание команд навигации в вопросе пользователя и в ответе модели.
+
+Таблицы ключевых слов компилируются один раз при импорте в одно регулярное
+выражение, свернутое по общим префиксам (trie). Выражение начинается с
+литерального пробела, поэтому шаблон пробуется только в началах слов.
+Переводы строк, табы и частая разметка (`*`, скобки, кавычки) перед поиском
+заменяются на пробелы.
+
+Смысл матчера - правила сопоставления ниже, а не скорость. По времени он
+сравним с прежними циклами `keyword in text` (bench/bench_navigation.py):
+быстрее на коротком тексте и на длинном без совпадения, но медленнее, если
+ключевое слово стоит в конце длинного текста - прежний код там успевал
+остановиться после нескольких проходов `in`, а regex проверяет каждое слово.
+
+Правила сопоставления:
+- ключевое слово должно начинаться с начала слова ("курс" не найдется в
+  "ракурс"), окончание может быть любым (для русских и польских форм);
+- в одной позиции побеждает самое длинное слово ("переводы" -> история,
+  а не "перевод" -> перевод денег);
+- если найдено несколько страниц, выбирается страница с наивысшим
+  приоритетом (порядок в таблице).
+"""
+import re
+from datetime import datetime
+
+from metrics import NAVIGATION_SECONDS
+
+# Словарь команд навигации (порядок = приоритет)
+NAVIGATION_MAP = {
+    # Dashboard / Home
+    'dashboard': ['dashboard', 'home', 'главная', 'главную', 'домой', 'дашборд'],
+
+    # Transactions
+    'transactions': ['transactions', 'transaction', 'история', 'транзакции', 'транзакцию', 'переводы'],
+
+    # Analytics
+    'analytics': ['analytics', 'статистика', 'аналитика', 'графики', 'charts'],
+
+    # Contacts
+    'contacts': ['contacts', 'contact', 'контакты', 'контакт'],
+
+    # Document Analysis
+    'document_analysis': ['documents', 'document', 'документы', 'документ', 'анализ документов', 'document analysis'],
+
+    # Currency
+    'currency': ['currency', 'exchange', 'валюта', 'обмен', 'курс'],
+
+    # Transfer
+    'transfer': ['transfer', 'перевод', 'отправить деньги', 'send money'],
+
+    # Settings
+    'settings': ['settings', 'настройки', 'настройка'],
+
+    # Support
+    'support': ['support', 'help', 'поддержка', 'помощь'],
+
+    # Blik
+    'blik': ['blik', 'блик']
+}
+
+# Ключевые фразы для навигации
+NAVIGATION_TRIGGERS = [
+    'open', 'открой', 'перейди', 'go to', 'navigate', 'show', 'покажи',
+    'переход', 'иди', 'открыть', 'перейти', 'покажи мне'
+]
+
+# Паттерны которые AI может использовать в ответе
+RESPONSE_PATTERNS = {
+    'contacts': ['go to contacts', 'open contacts', 'contacts page', 'navigate to contacts'],
+    'transactions': ['go to transactions', 'open transactions', 'transaction history'],
+    'analytics': ['go to analytics', 'open analytics', 'view analytics'],
+    'document_analysis': ['go to documents', 'open documents', 'document analysis'],
+    'dashboard': ['go to dashboard', 'go home', 'return to home']
+}
+
+PAGE_NAMES = {
+    'dashboard': 'Dashboard',
+    'transactions': 'Transactions',
+    'analytics': 'Analytics',
+    'contacts': 'Contacts',
+    'document_analysis': 'Document Analysis',
+    'currency': 'Currency Exchange',
+    'transfer': 'Transfer',
+    'settings': 'Settings',
+    'support': 'Support',
+    'blik': 'BLIK'
+}
+
+PAGE_ROUTES = {
+    'dashboard': '/',
+    'transactions': '/trans',
+    'analytics': '/analytics',
+    'contacts': '/contacts',
+    'document_analysis': '/anal',
+    'currency': '/currency',
+    'transfer': '/trans',
+    'settings': '/settings',
+    'support': '/support',
+    'blik': '/blik'
+}
+
+TRIGGER = "__trigger__"
+
+# Символы, после которых может начинаться слово (кроме пробела)
+WORD_START_CHARS = "\n\t\r*_\"'«„“([/"
+
+
+def normalize_text(text):
+    """Нижний регистр, пробел в начале и пробелы вместо переводов строк/разметки"""
+    text = " " + text.lower()
+    for char in WORD_START_CHARS:
+        if char in text:
+            text = text.replace(char, " ")
+    return text
+
+
+def _trie_pattern(words):
+    """Собирает регулярное выражение из слов, сворачивая общие префиксы"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node):
+        end = "" in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        # Длинные ветки раньше пустого окончания - в одной позиции побеждает самое длинное слово
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if end else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Многошаблонный поиск ключевых слов за один проход по тексту"""
+
+    def __init__(self, table):
+        # table: {значение: [ключевые слова]}; порядок значений задает приоритет
+        self.priority = {}
+        self.values = {}
+        for value, keywords in table.items():
+            self.priority.setdefault(value, len(self.priority))
+            for keyword in keywords:
+                keyword = keyword.lower()
+                # Одинаковое слово у двух значений - остается значение с большим приоритетом
+                self.values.setdefault(keyword, value)
+        self.pattern = re.compile(" (" + _trie_pattern(self.values) + ")")
+
+    def find_all(self, text):
+        """Все найденные (значение, ключевое слово, позиция) в порядке появления"""
+        return [(self.values[m.group(1)], m.group(1), m.start(1) - 1)
+                for m in self.pattern.finditer(normalize_text(text))]
+
+    def best(self, text):
+        """Значение с наивысшим приоритетом среди найденных, или None"""
+        best_value = None
+        for match in self.pattern.finditer(normalize_text(text)):
+            value = self.values[match.group(1)]
+            if value == TRIGGER:
+                continue
+            if best_value is None or self.priority[value] < self.priority[best_value]:
+                best_value = value
+                if self.priority[value] == 0:
+                    break
+        return best_value
+
+
+# Компилируем таблицы один раз при импорте
+COMMAND_MATCHER = KeywordMatcher({**NAVIGATION_MAP, TRIGGER: NAVIGATION_TRIGGERS})
+RESPONSE_MATCHER = KeywordMatcher(RESPONSE_PATTERNS)
+
+
+def navigation_action(page):
+    """Действие навигации для фронтенда"""
+    return {
+        "type": "navigate",
+        "page": page,
+        "route": PAGE_ROUTES.get(page, '/')
+    }
+
+
+def check_navigation_command(user_input):
+    """Проверяет, является ли команда запросом на навигацию"""
+    with NAVIGATION_SECONDS.time(source="command"):
+        page = COMMAND_MATCHER.best(user_input)
+    if page is None:
+        return None
+
+    return {
+        "result": f"✅ Opening {PAGE_NAMES.get(page, page)} page...",
+        "action": navigation_action(page),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def extract_navigation_from_response(ai_response):
+    """Извлекает команды навигации из ответа AI"""
+    with NAVIGATION_SECONDS.time(source="response"):
+        page = RESPONSE_MATCHER.best(ai_response)
+    if page is None:
+        return None
+    return navigation_action(page)
@@ -0,0 +1,337 @@
+"""Очистка текста документов перед отправкой в модель.
+
+Каждый тип документа проходит свой потоковый этап (feed(кусок) -> готовый
+текст, close() -> остаток), поэтому очистка идет вместе с чтением и
+останавливается вместе с ним, когда набран бюджет символов:
+- text/html: только видимый текст - без тегов, script/style/head и
+  комментариев; блочные теги дают переносы строк, таблицы - строки
+  "ячейка | ячейка", списки - "- пункт";
+- text/markdown: без разметки ссылок, картинок, выделения, заголовков и
+  HTML вставок; таблицы - те же строки "ячейка | ячейка";
+- PDF (по страницам): колонтитулы (первые/последние строки страницы, которые
+  стоят там же на большинстве прошлых страниц; номера страниц в коротких
+  строках не мешают) выбрасываются, переносы слов по дефису склеиваются;
+- для всех: пробелы схлопываются, колонки через 3+ пробела или табы
+  становятся "|", подряд идущие пустые строки - одной.
+
+Счетчики: символы и оценка токенов до и после очистки.
+"""
+import re
+from html.parser import HTMLParser
+
+from prompts import estimate_tokens
+
+_SPACES = re.compile("[ \t\u00a0\u200b]+")
+_COLUMNS = re.compile("(?:[ \u00a0]{3,}|\t+)")
+_WHITESPACE = re.compile(r"\s+")
+# Номер страницы: "Page 3 of 10", "Стр. 3", "3/10", "- 3 -"
+_PAGE_NUMBER = re.compile(r"(?:\b(?:page|p|стр|страница|с|strona|str|s)\.?\s*\d{1,4}"
+                          r"|\b\d{1,4}\s*(?:/|of|из|z)\s*\d{1,4}\b"
+                          r"|^[\W_]*\d{1,4}[\W_]*$)(?:\s*(?:/|of|из|z)\s*\d{1,4}\b)?")
+
+_MD_FENCE = re.compile(r"^\s*(```|~~~)")
+_MD_IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+_MD_LINK = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+_MD_REF_LINK = re.compile(r"\[([^\]]+)\]\[[^\]]*\]")
+_MD_REF_DEF = re.compile(r"^\s*\[[^\]]+\]:\s*\S+")
+_MD_HEADING = re.compile(r"^\s{0,3}#{1,6}\s+")
+_MD_QUOTE = re.compile(r"^\s*(>\s?)+")
+_MD_BULLET = re.compile(r"^\s*[*+-]\s+")
+_MD_EMPHASIS = re.compile(r"(\*\*|__|\*|_|~~)(?=\S)(.+?)(?<=\S)\1")
+_MD_CODE = re.compile(r"`([^`]*)`")
+_MD_RULE = re.compile(r"^\s*([-*_]\s*){3,}$")
+_MD_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)+\|?\s*$")
+_HTML_TAG = re.compile(r"<[^>]+>")
+_HTML_COMMENT = re.compile(r"<!--.*?-->", re.S)
+
+
+def collapse_line(line):
+    """Колонки (3+ пробела, табы) -> " | ", остальные пробелы - один"""
+    line = line.strip()
+    # Большинство строк уже чистые - регулярные выражения только там, где есть что схлопывать
+    if "  " in line or "\t" in line or "\u00a0" in line or "\u200b" in line:
+        line = _SPACES.sub(" ", _COLUMNS.sub(" | ", line))
+    return line
+
+
+class LineCleaner:
+    """Построчная очистка простого текста; потоковая: незаконченная строка ждет следующий кусок"""
+
+    kind = "text"
+
+    def __init__(self):
+        self._tail = ""
+        self._blank = True  # в начале документа пустые строки не нужны
+        self.chars_before = 0
+        self.chars_after = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def feed(self, chunk):
+        self._count_before(chunk)
+        lines = (self._tail + chunk).split("\n")
+        self._tail = lines.pop()
+        return self._emit(lines)
+
+    def close(self):
+        tail, self._tail = self._tail, ""
+        return self._emit([tail]) if tail else ""
+
+    def _count_before(self, chunk):
+        self.chars_before += len(chunk)
+        self.tokens_before += estimate_tokens(chunk)
+
+    def process_line(self, line):
+        """Очищенная строка; пустая строка - разрыв абзаца, None - выбросить"""
+        return collapse_line(line)
+
+    def _emit(self, lines):
+        out = []
+        for line in lines:
+            line = self.process_line(line)
+            if line is None:
+                continue
+            if not line:
+                if self._blank:
+                    continue
+                self._blank = True
+            else:
+                self._blank = False
+            out.append(line)
+        if not out:
+            return ""
+        text = "\n".join(out) + "\n"
+        self.chars_after += len(text)
+        self.tokens_after += estimate_tokens(text)
+        return text
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+        }
+
+
+class MarkdownCleaner(LineCleaner):
+    """Markdown -> простой текст: разметка убирается, содержимое остается"""
+
+    kind = "markdown"
+
+    def __init__(self):
+        super().__init__()
+        self._in_code = False
+        self._in_comment = False
+
+    def process_line(self, line):
+        if _MD_FENCE.match(line):
+            self._in_code = not self._in_code
+            return None
+        if self._in_code:
+            return collapse_line(line)
+        if self._in_comment:
+            if "-->" in line:
+                self._in_comment = False
+                line = line.split("-->", 1)[1]
+            else:
+                return None
+        line = _HTML_COMMENT.sub("", line)
+        if "<!--" in line:
+            self._in_comment = True
+            line = line.split("<!--", 1)[0]
+        if _MD_REF_DEF.match(line) or _MD_RULE.match(line) or _MD_TABLE_SEPARATOR.match(line):
+            return None
+        if line.lstrip().startswith("|"):
+            cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+            line = " | ".join(cell for cell in cells)
+        line = _MD_HEADING.sub("", line)
+        line = _MD_QUOTE.sub("", line)
+        line = _MD_BULLET.sub("- ", line)
+        line = _MD_IMAGE.sub(r"\1", line)
+        line = _MD_LINK.sub(r"\1", line)
+        line = _MD_REF_LINK.sub(r"\1", line)
+        line = _MD_CODE.sub(r"\1", line)
+        line = _MD_EMPHASIS.sub(r"\2", line)
+        line = _HTML_TAG.sub("", line)
+        return _SPACES.sub(" ", line.strip())
+
+
+class _HTMLText(HTMLParser):
+    """Видимый текст HTML: блоки -> строки, таблицы -> строки с "|", скрытое - мимо"""
+
+    SKIP = {"script", "style", "head", "noscript", "template", "svg", "iframe", "object"}
+    BLOCK = {"p", "div", "section", "article", "header", "footer", "main", "aside", "nav", "ul", "ol",
+             "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "form", "fieldset", "table", "dl",
+             "dt", "dd", "figure", "figcaption", "address", "hr", "title"}
+    VOID = {"br", "img", "hr", "meta", "link", "input", "area", "base", "col", "embed", "source", "track", "wbr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            if tag not in self.VOID:
+                self._skip += 1
+            return
+        if self._skip:
+            return
+        if tag == "tr":
+            self._row = []
+        elif tag in ("td", "th"):
+            self._cell = []
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag == "br":
+            self._text("\n")
+        elif tag in self.BLOCK:
+            self.parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br" and not self._skip:
+            self._text("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(0, self._skip - 1)
+            return
+        if self._skip:
+            return
+        if tag in ("td", "th") and self._cell is not None:
+            if self._row is not None:
+                self._row.append(_SPACES.sub(" ", "".join(self._cell)).strip())
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            cells = [cell for cell in self._row if cell]
+            if cells:
+                self.parts.append("\n" + " | ".join(cells) + "\n")
+            self._row = None
+        elif tag in self.BLOCK or tag == "li":
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        # Пробелы и переносы в разметке HTML ничего не значат
+        if not self._skip:
+            self._text(_WHITESPACE.sub(" ", data))
+
+    def _text(self, text):
+        if self._cell is not None:
+            self._cell.append(text.replace("\n", " "))
+        else:
+            self.parts.append(text)
+
+    def take(self):
+        text, self.parts = "".join(self.parts), []
+        return text
+
+
+class HTMLCleaner(LineCleaner):
+    """HTML -> простой текст: парсер HTML, затем та же построчная очистка.
+    Пустые строки выбрасываются: границы абзацев уже даны блочными тегами."""
+
+    kind = "html"
+
+    def __init__(self):
+        super().__init__()
+        self._parser = _HTMLText()
+
+    def feed(self, chunk):
+        self._count_before(chunk)
+        self._parser.feed(chunk)
+        lines = (self._tail + self._parser.take()).split("\n")
+        self._tail = lines.pop()
+        return self._emit(lines)
+
+    def process_line(self, line):
+        return collapse_line(line) or None
+
+    def close(self):
+        self._parser.close()
+        self._tail += self._parser.take()
+        return super().close()
+
+
+class PdfPageCleaner(LineCleaner):
+    """Страницы PDF: колонтитулы, повторяющиеся от страницы к странице, выбрасываются"""
+
+    kind = "pdf"
+    EDGE_LINES = 2  # сколько строк сверху и снизу страницы считать колонтитулом
+    EDGE_MIN_PAGES = 2  # колонтитул - строка, которая уже была хотя бы на стольких страницах...
+    EDGE_MIN_SHARE = 0.5  # ...и на большей части прочитанных страниц
+    EDGE_KEY_MAX_CHARS = 60  # номер страницы ищется только в строках не длиннее
+
+    def __init__(self):
+        super().__init__()
+        self._edges = {}  # (край, строка) -> на скольких страницах встретилась
+        self._pages = 0
+        self.duplicate_lines = 0
+
+    def feed_page(self, text):
+        """Очищенный текст одной страницы"""
+        self._count_before(text)
+        lines = [collapse_line(line) for line in text.split("\n")]
+        lines = self._drop_repeated_edges([line for line in lines if line])
+        return self._emit(self._join_hyphenated(lines))
+
+    @classmethod
+    def _edge_key(cls, line, side):
+        # Номер страницы ("Стр. 3 из 10") в короткой строке сравнивается без цифр; прочие цифры
+        # остаются: "Total due: 1500 PLN" и "Total due: 2300 PLN" - разные строки, а не колонтитул
+        line = line.lower()
+        if len(line) <= cls.EDGE_KEY_MAX_CHARS:
+            line = _PAGE_NUMBER.sub("#", line)
+        return side, line
+
+    def _drop_repeated_edges(self, lines):
+        edge = min(self.EDGE_LINES, len(lines) // 2)
+        positions = [(index, "top") for index in range(edge)]
+        positions += [(index, "bottom") for index in range(len(lines) - edge, len(lines))]
+        drop = set()
+        for key, index in {self._edge_key(lines[index], side): index for index, side in positions}.items():
+            seen = self._edges.get(key, 0)
+            if seen >= self.EDGE_MIN_PAGES and seen > self._pages * self.EDGE_MIN_SHARE:
+                drop.add(index)
+            self._edges[key] = seen + 1
+        self._pages += 1
+        self.duplicate_lines += len(drop)
+        return [line for index, line in enumerate(lines) if index not in drop]
+
+    @staticmethod
+    def _join_hyphenated(lines):
+        out = []
+        for line in lines:
+            if out and out[-1].endswith("-") and line[:1].islower() and out[-1][-2:-1].isalpha():
+                out[-1] = out[-1][:-1] + line
+            else:
+                out.append(line)
+        return out
+
+    def stats(self):
+        return dict(super().stats(), duplicate_lines=self.duplicate_lines)
+
+
+CLEANERS = {
+    "text/html": HTMLCleaner,
+    "text/markdown": MarkdownCleaner,
+    "application/pdf": PdfPageCleaner,
+}
+
+
+def create_cleaner(file_type):
+    """Потоковый очиститель для типа документа (по умолчанию - простой текст)"""
+    return CLEANERS.get(file_type, LineCleaner)()
+
+
+def clean_text(text, file_type):
+    """Очистка всего текста сразу; возвращает (текст, счетчики)"""
+    cleaner = create_cleaner(file_type)
+    if isinstance(cleaner, PdfPageCleaner):
+        out = cleaner.feed_page(text)
+    else:
+        out = cleaner.feed(text) + cleaner.close()
+    return out.strip(), cleaner.stats()
@@ -0,0 +1,92 @@
+"""Дедлайны запросов и политика повторов для вызовов upstream API.
+
+Каждый входящий запрос получает один сквозной Deadline, который передается
+во все повторы. Паузы между повторами делаются через asyncio.sleep в
+фоновом цикле upstream клиента, а не time.sleep в потоке воркера.
+"""
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+# Общий бюджет времени на один запрос пользователя (все попытки + паузы)
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "45"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+
+
+class DeadlineExceeded(Exception):
+    """Бюджет времени запроса исчерпан"""
+
+    def __init__(self, budget):
+        super().__init__(f"Превышен бюджет времени запроса ({budget:g} с)")
+        self.budget = budget
+
+
+class Deadline:
+    """Сквозной дедлайн запроса на монотонных часах"""
+
+    def __init__(self, budget=REQUEST_DEADLINE):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, default):
+        """Таймаут для очередной попытки: не больше default и не дольше дедлайна"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(self.budget)
+        return min(default, remaining)
+
+
+def parse_retry_after(value):
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата) в секунды"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Экспоненциальный backoff с full jitter и учетом Retry-After"""
+
+    RETRY_STATUSES = (429, 502, 503, 504)
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt, retry_after=None):
+        """Пауза перед попыткой attempt + 1 (attempt считается с 0)"""
+        if retry_after is not None:
+            # Сервер сам сказал, когда приходить - добавляем немного jitter, чтобы не прийти всей толпой
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def delay_for(self, attempt, status_code, headers, deadline):
+        """Сколько ждать перед повтором, или None если повторять не нужно/некогда"""
+        if status_code not in self.RETRY_STATUSES or attempt + 1 >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt, parse_retry_after(headers.get("Retry-After")))
+        # Если пауза не помещается в оставшийся бюджет - сразу отдаем последний ответ
+        if deadline is not None and delay >= deadline.remaining():
+            return None
+        return delay
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
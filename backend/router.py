@@ -0,0 +1,277 @@
+"""Маршрутизация запросов между моделями OpenRouter с учетом задержек и ошибок.
+
+Для каждой модели хранится скользящее окно задержек и исходов запросов
+(успех, ошибка, 429). Запрос уходит в лучшую здоровую модель: сначала
+модели без деградации в порядке приоритета, затем медленные/ошибающиеся.
+Модель, которая много ошибается подряд, выключается circuit breaker'ом на
+ROUTER_COOLDOWN секунд, после чего получает один пробный запрос.
+Опционально запрос хеджируется: если первая модель не ответила за
+ROUTER_HEDGE_DELAY секунд, параллельно отправляется запрос в следующую.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from logs import get_logger
+from metrics import MODEL_FALLBACKS, MODEL_HEDGES, UPSTREAM_RETRIES
+
+log = get_logger("router")
+
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "100"))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "10"))
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "5"))
+ROUTER_ERROR_RATE = float(os.getenv("ROUTER_ERROR_RATE", "0.5"))
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "30"))
+ROUTER_SLOW_P95 = float(os.getenv("ROUTER_SLOW_P95", "10"))
+ROUTER_HEDGE_DELAY = float(os.getenv("ROUTER_HEDGE_DELAY", "0"))  # 0 - хеджирование выключено
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def is_failure(status_code):
+    """Считается ли исход ошибкой модели (None - сетевая ошибка/таймаут)"""
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class ModelStats:
+    """Скользящая статистика и состояние circuit breaker одной модели"""
+
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # Коды ответов (None - исключение)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.requests = 0
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for status in self.outcomes if is_failure(status)) / len(self.outcomes)
+
+    def rate_limited_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for status in self.outcomes if status == 429) / len(self.outcomes)
+
+    def percentiles(self):
+        ordered = sorted(self.latencies)
+        return _percentile(ordered, 0.5), _percentile(ordered, 0.95)
+
+
+class ModelRouter:
+    """Выбирает модель для запроса и собирает статистику по ответам"""
+
+    def __init__(self, models, window=ROUTER_WINDOW, min_samples=ROUTER_MIN_SAMPLES,
+                 failure_threshold=ROUTER_FAILURE_THRESHOLD, error_rate=ROUTER_ERROR_RATE,
+                 cooldown=ROUTER_COOLDOWN, slow_p95=ROUTER_SLOW_P95, hedge_delay=ROUTER_HEDGE_DELAY):
+        self.models = list(models)
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate
+        self.cooldown = cooldown
+        self.slow_p95 = slow_p95
+        self.hedge_delay = hedge_delay
+
+        self._lock = threading.Lock()
+        self._stats = {model: ModelStats(window) for model in self.models}
+        self.last_model = None
+        self.hedged_requests = 0
+        self.fallbacks = 0
+
+    # ---------- Выбор модели ----------
+
+    def _available(self, stats, now):
+        if stats.state == CLOSED:
+            return True
+        if stats.state == OPEN and now - stats.opened_at >= self.cooldown:
+            stats.state = HALF_OPEN
+        return stats.state == HALF_OPEN and not stats.probe_in_flight
+
+    def _degraded(self, stats):
+        if len(stats.latencies) >= self.min_samples:
+            _, p95 = stats.percentiles()
+            if p95 > self.slow_p95:
+                return True
+        return len(stats.outcomes) >= self.min_samples and stats.error_rate() > self.error_rate_threshold / 2
+
+    def candidates(self):
+        """Модели в порядке предпочтения: здоровые без деградации, затем деградировавшие"""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [m for m in self.models if self._available(self._stats[m], now)]
+            if not healthy:
+                # Все выключены - лучше попробовать, чем сразу отказать
+                return list(self.models)
+            return sorted(healthy, key=lambda m: (self._degraded(self._stats[m]), self.models.index(m)))
+
+    def choose(self):
+        """Лучшая модель для следующего запроса"""
+        return self.candidates()[0]
+
+    # ---------- Учет результатов ----------
+
+    def begin(self, model):
+        """Отмечает начало запроса (в half-open пропускаем только одну пробу)"""
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is not None and stats.state == HALF_OPEN:
+                stats.probe_in_flight = True
+
+    def record(self, model, latency, status_code):
+        """Учитывает исход запроса и переключает circuit breaker"""
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is None:
+                return
+            stats.requests += 1
+            stats.outcomes.append(status_code)
+            stats.probe_in_flight = False
+
+            if is_failure(status_code):
+                stats.consecutive_failures += 1
+                too_many = stats.consecutive_failures >= self.failure_threshold
+                too_often = (len(stats.outcomes) >= self.min_samples
+                             and stats.error_rate() >= self.error_rate_threshold)
+                if stats.state == HALF_OPEN or too_many or too_often:
+                    if stats.state != OPEN:
+                        log.warning("Circuit breaker открыт", model=model)
+                    stats.state = OPEN
+                    stats.opened_at = time.monotonic()
+            else:
+                stats.latencies.append(latency)
+                stats.consecutive_failures = 0
+                if stats.state != CLOSED:
+                    log.info("Circuit breaker закрыт", model=model)
+                stats.state = CLOSED
+                self.last_model = model
+
+    def record_latency(self, model, latency):
+        """Учитывает только задержку (нижнюю оценку) для запроса, проигравшего хедж"""
+        with self._lock:
+            stats = self._stats.get(model)
+            if stats is not None:
+                stats.requests += 1
+                stats.latencies.append(latency)
+                stats.probe_in_flight = False
+
+    def state(self):
+        """Снимок состояния роутера для /api/health"""
+        with self._lock:
+            models = {}
+            for model in self.models:
+                stats = self._stats[model]
+                p50, p95 = stats.percentiles()
+                models[model] = {
+                    "state": stats.state,
+                    "requests": stats.requests,
+                    "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                    "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                    "error_rate": round(stats.error_rate(), 3),
+                    "rate_limited_rate": round(stats.rate_limited_rate(), 3),
+                }
+            return {
+                "last_model": self.last_model,
+                "hedge_delay": self.hedge_delay,
+                "hedged_requests": self.hedged_requests,
+                "fallbacks": self.fallbacks,
+                "models": models,
+            }
+
+    # ---------- Отправка запроса ----------
+
+    async def _timed_post(self, client, model, url, headers, payload, deadline):
+        self.begin(model)
+        start = time.monotonic()
+        try:
+            response = await client.post(url, headers, {**payload, "model": model}, deadline=deadline)
+        except asyncio.CancelledError:
+            # Проиграл хедж - модель как минимум настолько медленная
+            self.record_latency(model, time.monotonic() - start)
+            raise
+        except Exception:
+            self.record(model, time.monotonic() - start, None)
+            raise
+        self.record(model, time.monotonic() - start, response.status_code)
+        return model, response
+
+    async def _hedged_post(self, client, candidates, url, headers, payload, deadline):
+        """Запрос в первую модель; если она молчит дольше hedge_delay - параллельно во вторую"""
+        tasks = {asyncio.ensure_future(self._timed_post(client, candidates[0], url, headers, payload, deadline))}
+
+        if self.hedge_delay > 0 and len(candidates) > 1:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                with self._lock:
+                    self.hedged_requests += 1
+                MODEL_HEDGES.inc(model=candidates[1])
+                tasks.add(asyncio.ensure_future(
+                    self._timed_post(client, candidates[1], url, headers, payload, deadline)))
+
+        fallback_result = None
+        error = None
+        pending = tasks
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    model, response = task.result()
+                    if response.status_code == 200:
+                        return model, response
+                    fallback_result = fallback_result or (model, response)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if fallback_result is not None:
+            return fallback_result
+        raise error
+
+    async def post(self, client, url, headers, payload, deadline=None, policy=None):
+        """Отправляет запрос через лучшую модель с fallback на следующие и повторами по policy.
+
+        Возвращает (model, response) - модель, которая фактически ответила.
+        """
+        tried = []
+        attempt = 0
+        while True:
+            candidates = self.candidates()
+            fresh = [m for m in candidates if m not in tried]
+            model, response = await self._hedged_post(client, fresh or candidates, url, headers, payload, deadline)
+            tried.append(model)
+
+            if policy is None or response.status_code not in policy.RETRY_STATUSES:
+                return model, response
+            if attempt + 1 >= policy.max_attempts:
+                return model, response
+
+            # Есть еще не опрошенная здоровая модель - переключаемся сразу, без паузы
+            if any(m not in tried for m in self.candidates()) and (deadline is None or not deadline.expired()):
+                with self._lock:
+                    self.fallbacks += 1
+                MODEL_FALLBACKS.inc(model=model, status=response.status_code)
+                log.debug("Модель ответила ошибкой - пробуем следующую", model=model, status=response.status_code)
+                attempt += 1
+                continue
+
+            delay = policy.delay_for(attempt, response.status_code, response.headers, deadline)
+            if delay is None:
+                return model, response
+            UPSTREAM_RETRIES.inc(model=model, status=response.status_code)
+            log.debug("Повтор запроса к upstream", model=model, status=response.status_code, delay=round(delay, 2),
+                      attempt=attempt + 2)
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,314 @@
+"""Продакшн запуск: мастер предзагружает приложение и форкает воркеры.
+
+    python serve.py --workers 4 --threads 16     (после pip install - colabothon-backend)
+
+Мастер один раз импортирует back.py (Flask, NumPy, PyPDF2, шаблоны промптов,
+зеркало журнала) и только потом форкает SERVE_WORKERS воркеров: эти
+страницы памяти у воркеров общие (copy-on-write), и воркер готов сразу
+после fork, без своего импорта. Воркеры слушают один сокет, открытый
+мастером, и принимают соединение, только когда у них есть свободный поток
+(до SERVE_THREADS запросов одновременно: SSE стримы и ожидание модели
+держат поток, поэтому потоков больше, чем ядер). Остальные ждут в очереди
+ядра и достаются свободному воркеру.
+
+Потоки при fork не копируются, поэтому в мастере их нет: с SERVE_PRELOAD=1
+back.py не запускает обработчики задач, logs.py останавливает поток-писатель
+на время fork, SQLite соединения закрываются (back.before_fork). Каждый
+воркер после fork запускает свои.
+
+SIGTERM/SIGINT мастеру - плавная остановка: воркеры перестают принимать
+соединения, дорабатывают начатые запросы (keep-alive соединения
+закрываются после текущего ответа) и выходят; кто не успел за
+SERVE_GRACEFUL_TIMEOUT, получает SIGKILL. Упавший воркер мастер запускает
+заново. После старта мастер пишет в лог время до готовности всех воркеров
+и память каждого (rss и pss).
+"""
+import argparse
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+START = time.perf_counter()
+
+# Настройки сервера тоже можно задать в .env
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+if load_dotenv is not None:
+    load_dotenv()
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler  # noqa: E402
+
+from logs import get_logger, shutdown_logging  # noqa: E402
+from metrics import process_memory  # noqa: E402
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "5000"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0"))  # 0 - по числу ядер
+SERVE_THREADS = int(os.getenv("SERVE_THREADS", "16"))
+SERVE_GRACEFUL_TIMEOUT = float(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+SERVE_KEEPALIVE = float(os.getenv("SERVE_KEEPALIVE", "5"))  # сколько держать простаивающее keep-alive соединение
+SERVE_TIMEOUT = float(os.getenv("SERVE_TIMEOUT", "60"))  # таймаут чтения/записи сокета внутри запроса
+SERVE_BACKLOG = int(os.getenv("SERVE_BACKLOG", "1024"))
+STARTUP_TIMEOUT = 60.0
+
+log = get_logger("serve")
+
+
+def _mb(value):
+    return round(value / 1024 / 1024, 1) if value is not None else None
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Обработчик соединения: keep-alive с ограниченным простоем, access log - на уровне debug"""
+
+    protocol_version = "HTTP/1.1"  # keep-alive и chunked ответы (SSE)
+    timeout = SERVE_TIMEOUT
+    served = 0
+
+    def handle_one_request(self):
+        if self.served:
+            # Следующий запрос keep-alive соединения ждем не дольше SERVE_KEEPALIVE, а при остановке - не ждем
+            wait_until = time.monotonic() + SERVE_KEEPALIVE
+            while True:
+                remaining = wait_until - time.monotonic()
+                if self.server.draining or remaining <= 0:
+                    self.close_connection = True
+                    return
+                if select.select([self.connection], [], [], min(remaining, 0.5))[0]:
+                    break
+        self.served += 1
+        super().handle_one_request()
+
+    def log_request(self, code="-", size="-"):
+        log.debug("Запрос", method=self.command, path=self.path, status=getattr(code, "value", code))
+
+
+class WorkerServer(BaseWSGIServer):
+    """WSGI сервер воркера на слушающем сокете мастера с пулом из threads потоков"""
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, sock, app, threads):
+        self.draining = False
+        self._slots = threading.BoundedSemaphore(threads)
+        self._pool = ThreadPoolExecutor(threads, thread_name_prefix="http")
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, handler=RequestHandler, fd=sock.fileno())
+        # Соединение может забрать другой воркер - accept не должен блокироваться
+        self.socket.setblocking(False)
+
+    def get_request(self):
+        # Нет свободного потока - соединение остается в очереди ядра (его заберет свободный воркер)
+        if not self._slots.acquire(timeout=0.5):
+            raise BlockingIOError
+        try:
+            conn, address = self.socket.accept()
+        except OSError:
+            self._slots.release()
+            raise
+        conn.setblocking(True)
+        return conn, address
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def drain(self):
+        """Ждет запросы, принятые до остановки (после выхода из serve_forever)"""
+        self._pool.shutdown(wait=True)
+
+
+def run_worker(sock, app_module, threads, ready_fd):
+    """Тело воркера после fork; возвращает код выхода"""
+    app_module.start_background_work()
+    server = WorkerServer(sock, app_module.app, threads)
+    sock.close()  # у сервера своя копия дескриптора: порт освобождается, когда все воркеры закроют свои
+
+    def stop(signum, frame):
+        server.draining = True
+        # shutdown() ждет выхода из serve_forever - вызываем не из этого (главного) потока
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C получает и мастер - он и пришлет SIGTERM
+    os.write(ready_fd, f"{os.getpid()}\n".encode())
+    os.close(ready_fd)
+
+    server.serve_forever(poll_interval=0.5)
+    started = time.monotonic()
+    server.drain()
+    app_module.document_jobs.stop(timeout=max(0.0, SERVE_GRACEFUL_TIMEOUT - (time.monotonic() - started)))
+    log.info("Воркер остановлен", pid=os.getpid(), drain_ms=round((time.monotonic() - started) * 1000, 1))
+    return 0
+
+
+class Master:
+    """Запускает воркеры, следит за ними и останавливает их"""
+
+    def __init__(self, sock, app_module, workers, threads, graceful_timeout):
+        self.sock = sock
+        self.app_module = app_module
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.children = {}  # pid -> время fork
+        self.ready = set()
+        self.stopping = False
+        self.started = False
+        self._ready_r, self._ready_w = os.pipe()
+        self._buffer = b""
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(self._ready_r)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                code = run_worker(self.sock, self.app_module, self.threads, self._ready_w)
+            except BaseException:
+                log.error("Воркер упал", exc_info=True, pid=os.getpid())
+            finally:
+                shutdown_logging()
+                # Не возвращаемся в код мастера и не выполняем его atexit
+                os._exit(code)
+        self.children[pid] = time.perf_counter()
+        return pid
+
+    def _on_signal(self, signum, frame):
+        self.stopping = True
+
+    def _read_ready(self, timeout):
+        if not select.select([self._ready_r], [], [], timeout)[0]:
+            return
+        self._buffer += os.read(self._ready_r, 4096)
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            pid = int(line)
+            self.ready.add(pid)
+            if self.started:
+                memory = process_memory(pid) or {}
+                log.info("Воркер перезапущен", pid=pid, rss_mb=_mb(memory.get("rss")))
+
+    def _reap(self):
+        """Собирает завершившихся воркеров; False - воркер упал еще при старте"""
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return True
+            self.children.pop(pid, None)
+            was_ready = pid in self.ready
+            self.ready.discard(pid)
+            if self.stopping:
+                continue
+            code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            log.warning("Воркер завершился", pid=pid, code=code)
+            if not was_ready:
+                return False
+            self.spawn()
+        return True
+
+    def report(self, preload_ms):
+        startup_ms = round((time.perf_counter() - START) * 1000, 1)
+        host, port = self.sock.getsockname()[:2]
+        master = process_memory() or {}
+        log.info("Сервер запущен", url=f"http://{host}:{port}", workers=self.workers, threads=self.threads,
+                 preload_ms=preload_ms, startup_ms=startup_ms, master_rss_mb=_mb(master.get("rss")))
+        for pid in sorted(self.ready):
+            memory = process_memory(pid) or {}
+            log.info("Воркер готов", pid=pid, rss_mb=_mb(memory.get("rss")), pss_mb=_mb(memory.get("pss")))
+
+    def run(self, preload_ms):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        for _ in range(self.workers):
+            self.spawn()
+
+        startup_deadline = time.monotonic() + STARTUP_TIMEOUT
+        kill_at = None
+        code = 0
+        while self.children:
+            self._read_ready(0.5)
+            if not self._reap():
+                log.error("Воркер завершился при старте - останавливаем сервер")
+                self.stopping, code = True, 1
+            if not self.started and not self.stopping:
+                if len(self.ready) >= self.workers:
+                    self.started = True
+                    self.report(preload_ms)
+                elif time.monotonic() > startup_deadline:
+                    log.error("Воркеры не запустились вовремя", ready=len(self.ready), workers=self.workers)
+                    self.stopping, code = True, 1
+            if self.stopping and kill_at is None:
+                log.info("Плавная остановка", workers=len(self.children), timeout_s=self.graceful_timeout)
+                kill_at = time.monotonic() + self.graceful_timeout
+                self._signal_all(signal.SIGTERM)
+                # Копия сокета в мастере не должна держать порт: когда воркеры выйдут из accept,
+                # новые соединения сразу получат отказ (балансировщик уведет их на другой инстанс)
+                self.sock.close()
+            elif kill_at is not None and time.monotonic() > kill_at:
+                log.warning("Воркеры не остановились вовремя - SIGKILL", workers=len(self.children))
+                self._signal_all(signal.SIGKILL)
+                kill_at = float("inf")
+        log.info("Сервер остановлен")
+        return code
+
+    def _signal_all(self, signum):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+
+def bind_socket(host, port, backlog=SERVE_BACKLOG):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Financial AI Assistant Backend: мастер и воркеры")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="процессов (0 - по числу ядер)")
+    parser.add_argument("--threads", type=int, default=SERVE_THREADS, help="одновременных запросов в воркере")
+    parser.add_argument("--graceful-timeout", type=float, default=SERVE_GRACEFUL_TIMEOUT,
+                        help="сколько ждать начатые запросы при остановке, с")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    # Сокет до загрузки приложения: занятый порт - ошибка сразу, без долгого импорта
+    sock = bind_socket(args.host, args.port)
+
+    os.environ["SERVE_PRELOAD"] = "1"
+    preload_start = time.perf_counter()
+    import back
+    back.before_fork()
+    preload_ms = round((time.perf_counter() - preload_start) * 1000, 1)
+
+    master = Master(sock, back, workers, max(1, args.threads), args.graceful_timeout)
+    raise SystemExit(master.run(preload_ms))
+
+
+if __name__ == "__main__":
+    main()
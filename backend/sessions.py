@@ -0,0 +1,372 @@
+"""Серверные сессии диалога с ограниченной историей.
+
+Клиент присылает session_id (первый раз - null) и получает его в ответе;
+история живет на сервере, а не пересылается клиентом. В сессии хранятся
+последние ходы (вопрос + ответ, каждый обрезан до SESSION_TURN_CHARS) и
+сводка более ранней части разговора. Как только ходы набирают больше
+SESSION_HISTORY_TOKENS токенов (или SESSION_MAX_TURNS ходов), самые старые
+сворачиваются в сводку пачкой - до половины порога, так что между
+сворачиваниями начало списка сообщений не меняется (prefix-stable: кеш
+промпта у провайдера продолжает попадать). Сводка сама ограничена
+SESSION_SUMMARY_TOKENS: при переполнении выпадают самые старые строки.
+Поэтому память сессии и размер истории в промпте ограничены, сколько бы
+ни длился разговор.
+
+Сворачивание инкрементальное: обрабатываются только выпадающие ходы.
+SESSION_COMPACTION=local - строка на ход (вопрос и начало ответа), без
+запросов к модели; model - модель переписывает сводку с учетом новых
+ходов (при ошибке - local). Сворачивание вызывается после отправки ответа.
+
+Сессии хранятся в памяти процесса (LRU на SESSION_MAX_ACTIVE сессий, TTL
+SESSION_TTL). С SESSION_DB_PATH каждая запись дублируется в SQLite:
+вытесненная из памяти сессия поднимается оттуда, и воркеры serve.py видят
+сессии друг друга (по версии сессии проверяется, не изменил ли ее другой
+процесс).
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from logs import get_logger
+from metrics import SESSION_COMPACTIONS
+from prompts import estimate_tokens
+
+SESSION_MAX_ACTIVE = int(os.getenv("SESSION_MAX_ACTIVE", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "12"))
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "1500"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "400"))
+SESSION_TURN_CHARS = int(os.getenv("SESSION_TURN_CHARS", "2000"))
+SESSION_COMPACTION = os.getenv("SESSION_COMPACTION", "local")  # local | model
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")  # пусто - только память
+
+SWEEP_EVERY = 200  # новых сессий между чистками истекших
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s")
+_SPACES = re.compile(r"\s+")
+
+log = get_logger("sessions")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated_at);
+"""
+
+
+def _clip(text, limit):
+    text = text.strip()
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def summary_line(user, assistant, width=160):
+    """Одна строка сводки на ход: вопрос и первое предложение ответа"""
+    answer = _SENTENCE_END.split(_SPACES.sub(" ", assistant.strip()), 1)[0]
+    return f"- User: {_clip(_SPACES.sub(' ', user), width)} -> FinBot: {_clip(answer, width)}"
+
+
+def trim_summary(summary, max_tokens):
+    """Обрезает сводку до max_tokens, выбрасывая самые старые строки"""
+    lines = summary.splitlines()
+    while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    if not lines and summary:
+        return _clip(summary, max_tokens * 4)  # одна огромная строка
+    return "\n".join(lines)
+
+
+def local_compact(summary, turns):
+    """Сворачивание без модели: к сводке добавляется строка на каждый ход"""
+    lines = [summary] if summary else []
+    lines += [summary_line(turn["user"], turn["assistant"]) for turn in turns]
+    return "\n".join(lines)
+
+
+def compaction_prompt(summary, turns, max_tokens=SESSION_SUMMARY_TOKENS):
+    """Промпт для SESSION_COMPACTION=model: обновить сводку с учетом выпадающих ходов"""
+    rendered = "\n\n".join(f"User: {turn['user']}\nFinBot: {turn['assistant']}" for turn in turns)
+    return f"""Update the running summary of a conversation between a user and FinBot, a personal finance assistant.
+Keep the user's goals, decisions, amounts, dates and open questions; drop greetings and repetition.
+Write short bullet points in the user's language, at most {max_tokens * 3 // 4} words in total.
+Reply with the updated summary only.
+
+Current summary:
+{summary or "(empty)"}
+
+Turns to add:
+{rendered}"""
+
+
+class Session:
+    """Состояние одной сессии; менять - только под self.lock (через SessionStore)"""
+
+    def __init__(self, session_id, created_at=None):
+        self.id = session_id
+        self.created_at = created_at or time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+        self.summary = ""
+        self.turns = deque()  # {"seq", "user", "assistant", "tokens"}
+        self.turn_count = 0
+        self.compacted_turns = 0
+        self.compacting = False
+        self.lock = threading.Lock()
+
+    def history_tokens(self):
+        return sum(turn["tokens"] for turn in self.turns)
+
+    def to_json(self):
+        return json.dumps({
+            "created_at": self.created_at, "updated_at": self.updated_at, "summary": self.summary,
+            "turns": list(self.turns), "turn_count": self.turn_count, "compacted_turns": self.compacted_turns,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, session_id, version, data):
+        state = json.loads(data)
+        session = cls(session_id, state["created_at"])
+        session.updated_at = state["updated_at"]
+        session.version = version
+        session.summary = state["summary"]
+        session.turns = deque(state["turns"])
+        session.turn_count = state["turn_count"]
+        session.compacted_turns = state["compacted_turns"]
+        return session
+
+
+class SessionStore:
+    """LRU+TTL хранилище сессий в памяти с необязательной копией в SQLite.
+
+    compact(summary, turns) -> новая сводка; по умолчанию local_compact.
+    """
+
+    def __init__(self, max_active=SESSION_MAX_ACTIVE, ttl=SESSION_TTL, max_turns=SESSION_MAX_TURNS,
+                 history_tokens=SESSION_HISTORY_TOKENS, summary_tokens=SESSION_SUMMARY_TOKENS,
+                 turn_chars=SESSION_TURN_CHARS, path=SESSION_DB_PATH, compact=None, mode="local"):
+        self.max_active = max_active
+        self.ttl = ttl
+        self.max_turns = max(1, max_turns)
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.turn_chars = turn_chars
+        self.path = path or None
+        self.compact_fn = compact or local_compact
+        self.mode = mode if compact else "local"
+        self._sessions = OrderedDict()  # id -> Session, в порядке последнего обращения
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"created": 0, "expired": 0, "evicted": 0, "restored": 0, "compactions": 0,
+                       "compaction_errors": 0}
+        if self.path:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+
+    # ---------- SQLite ----------
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Закрывает SQLite соединение текущего потока (мастер serve.py - перед fork)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _save(self, session):
+        session.version += 1
+        if self.path:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO sessions (id, version, data, updated_at) VALUES (?, ?, ?, ?)",
+                (session.id, session.version, session.to_json(), session.updated_at))
+
+    def _load(self, session_id, known_version=None):
+        """Сессия из SQLite; None - нет или не новее known_version"""
+        if not self.path:
+            return None
+        conn = self._connect()
+        if known_version is not None:
+            row = conn.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None or row[0] == known_version:
+                return None
+        row = conn.execute("SELECT version, data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return Session.from_json(session_id, row[0], row[1]) if row else None
+
+    def _delete(self, session_id):
+        if self.path:
+            self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    # ---------- Сессии ----------
+
+    def _expired(self, session):
+        return time.time() - session.updated_at > self.ttl
+
+    def get_or_create(self, session_id=None):
+        """Сессия по id; новая, если id пустой, неизвестный или сессия истекла"""
+        if session_id:
+            session = self._get(str(session_id)[:64])
+            if session is not None:
+                return session
+        session = Session(uuid.uuid4().hex)
+        with self._lock:
+            self._stats["created"] += 1
+            sweep = self._stats["created"] % SWEEP_EVERY == 0
+        if sweep:
+            self.sweep()  # Истекшие сессии, которых больше никто не спросит
+        self._remember(session)
+        return session
+
+    def _get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+        # Сессию мог изменить другой воркер - берем более новую версию из SQLite
+        fresher = self._load(session_id, session.version if session is not None else None)
+        if fresher is not None:
+            session = fresher
+            with self._lock:
+                self._stats["restored"] += 1
+            self._remember(session)
+        if session is None:
+            return None
+        if self._expired(session):
+            with self._lock:
+                self._sessions.pop(session_id, None)
+                self._stats["expired"] += 1
+            self._delete(session_id)
+            return None
+        return session
+
+    def _remember(self, session):
+        with self._lock:
+            self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            while len(self._sessions) > self.max_active:
+                # В SQLite вытесненная сессия остается и поднимется при следующем обращении
+                self._sessions.popitem(last=False)
+                self._stats["evicted"] += 1
+
+    def messages(self, session):
+        """История для запроса к модели: сводка (system) и последние ходы (user/assistant)"""
+        with session.lock:
+            messages = [{"role": "system", "content": f"{SUMMARY_HEADER}\n{session.summary}"}] if session.summary else []
+            for turn in session.turns:
+                messages.append({"role": "user", "content": turn["user"]})
+                messages.append({"role": "assistant", "content": turn["assistant"]})
+            return messages
+
+    def history_key(self, session):
+        """Что из истории влияет на ответ модели: для ключа кеша ответов (None - истории нет)"""
+        with session.lock:
+            if not session.turns and not session.summary:
+                return None
+            return f"{session.id}:{session.version}"
+
+    def record(self, session, user, assistant):
+        """Добавляет ход; True - история переросла порог и ее пора свернуть (compact)"""
+        user, assistant = _clip(user, self.turn_chars), _clip(assistant, self.turn_chars)
+        with session.lock:
+            session.turn_count += 1
+            session.turns.append({"seq": session.turn_count, "user": user, "assistant": assistant,
+                                  "tokens": estimate_tokens(user) + estimate_tokens(assistant) + 8})
+            session.updated_at = time.time()
+            # Жесткий предел на случай, если сворачивание не успевает или не запускалось
+            while len(session.turns) > 1 and (len(session.turns) > self.max_turns * 2
+                                              or session.history_tokens() > self.history_tokens * 2):
+                session.summary = trim_summary(local_compact(session.summary, [session.turns.popleft()]),
+                                               self.summary_tokens)
+                session.compacted_turns += 1
+            self._save(session)
+            return self._needs_compaction(session)
+
+    def _needs_compaction(self, session):
+        return len(session.turns) > self.max_turns or session.history_tokens() > self.history_tokens
+
+    def compact(self, session):
+        """Сворачивает старые ходы в сводку (вне потока ответа: может ждать модель)"""
+        with session.lock:
+            if session.compacting or not self._needs_compaction(session):
+                return False
+            # Сворачиваем до половины порога: следующее сворачивание - через несколько ходов
+            folded, tokens = [], session.history_tokens()
+            for turn in session.turns:
+                if len(session.turns) - len(folded) <= self.max_turns // 2 and tokens <= self.history_tokens // 2:
+                    break
+                if len(folded) == len(session.turns) - 1:
+                    break  # последний ход остается как есть
+                folded.append(turn)
+                tokens -= turn["tokens"]
+            if not folded:
+                return False
+            session.compacting = True
+            summary = session.summary
+
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            new_summary = self.compact_fn(summary, folded)
+        except Exception as e:
+            log.warning("Сводка сессии не обновлена моделью - сворачиваем локально", session=session.id, error=e)
+            new_summary, outcome = local_compact(summary, folded), "fallback"
+        new_summary = trim_summary(new_summary.strip(), self.summary_tokens)
+
+        with session.lock:
+            session.compacting = False
+            # Пока шло сворачивание, записи могли уйти (жесткий предел) - снимаем только то, что еще на месте
+            last_seq = folded[-1]["seq"]
+            removed = 0
+            while session.turns and session.turns[0]["seq"] <= last_seq:
+                session.turns.popleft()
+                removed += 1
+            if removed:
+                session.summary = new_summary
+                session.compacted_turns += removed
+                self._save(session)
+        SESSION_COMPACTIONS.inc(mode=self.mode, outcome=outcome)
+        with self._lock:
+            self._stats["compactions"] += 1
+            self._stats["compaction_errors"] += int(outcome != "ok")
+        log.debug("Сессия свернута", session=session.id, turns=removed, summary_tokens=estimate_tokens(new_summary),
+                  ms=round((time.perf_counter() - start) * 1000, 1))
+        return True
+
+    def describe(self, session):
+        """Состояние сессии для ответа API"""
+        with session.lock:
+            return {"id": session.id, "turns": session.turn_count, "history_turns": len(session.turns),
+                    "compacted_turns": session.compacted_turns, "history_tokens": session.history_tokens(),
+                    "summary_tokens": estimate_tokens(session.summary) if session.summary else 0}
+
+    def sweep(self):
+        """Удаляет истекшие сессии из памяти и SQLite"""
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, session in self._sessions.items() if now - session.updated_at > self.ttl]
+            for sid in expired:
+                del self._sessions[sid]
+            self._stats["expired"] += len(expired)
+        if self.path:
+            self._connect().execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, active=len(self._sessions), max_active=self.max_active, ttl=self.ttl,
+                        max_turns=self.max_turns, history_tokens=self.history_tokens,
+                        summary_tokens=self.summary_tokens, compaction=self.mode, path=self.path)
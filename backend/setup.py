@@ -1,19 +1,26 @@
-from setuptools import setup, find_packages
+import os
 
-with open("requirements.txt") as f:
+from setuptools import setup
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+with open(os.path.join(HERE, "requirements.txt")) as f:
     requirements = [line.strip() for line in f if line.strip() and not line.startswith("#")]
 
+# Бэкенд - плоские модули (serve.py, back.py, ...), а не пакет: find_packages() их не находит
+modules = sorted(name[:-3] for name in os.listdir(HERE) if name.endswith(".py") and name != "setup.py")
+
 setup(
     name="colabothon-backend",
     version="1.0.0",
     description="Financial AI Assistant Backend",
     author="Your Team",
-    packages=find_packages(),
+    py_modules=modules,
     install_requires=requirements,
     python_requires=">=3.8",
     entry_points={
         "console_scripts": [
-            "colabothon-backend=back:app.run",
+            "colabothon-backend=serve:main",
         ],
     },
     classifiers=[
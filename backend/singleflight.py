@@ -0,0 +1,84 @@
+"""Single-flight: одинаковые одновременные запросы делят один вызов upstream.
+
+Первый запрос с данным ключом (лидер) выполняет работу, остальные ждут его
+результат (или исключение). Число ожидающих на ключ ограничено, каждый
+ожидающий ждет не дольше своего таймаута.
+"""
+import os
+import threading
+
+SINGLEFLIGHT_MAX_WAITERS = int(os.getenv("SINGLEFLIGHT_MAX_WAITERS", "64"))
+
+
+class TooManyWaiters(Exception):
+    """Слишком много запросов ждут один и тот же результат"""
+
+
+class WaiterTimeout(Exception):
+    """Ожидающий не дождался результата лидера"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Группа вызовов, объединяемых по ключу"""
+
+    def __init__(self, max_waiters=SINGLEFLIGHT_MAX_WAITERS):
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+        self.rejected = 0
+
+    def do(self, key, fn, timeout=None):
+        """Выполняет fn() один раз на ключ; возвращает (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                if call.waiters >= self.max_waiters:
+                    self.rejected += 1
+                    raise TooManyWaiters(f"Слишком много одинаковых запросов в очереди ({call.waiters})")
+                call.waiters += 1
+                self.shared += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result, False
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                call.waiters -= 1
+            raise WaiterTimeout(f"Не дождались общего результата за {timeout:g} с")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "leaders": self.leaders,
+                "shared": self.shared,
+                "rejected": self.rejected,
+                "max_waiters": self.max_waiters,
+            }
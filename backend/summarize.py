@@ -0,0 +1,240 @@
+"""Анализ длинных документов по схеме map-reduce.
+
+Вместо первых 8000 символов в модель уходит весь текст: он режется на
+куски до DOCUMENT_CHUNK_TOKENS токенов, куски разбираются параллельно
+(не больше DOCUMENT_MAP_CONCURRENCY запросов к модели одновременно), а
+заметки по кускам сводятся одним запросом в ту же сводку из 7 разделов.
+Время ответа растет с числом кусков / лимитом параллельности, а не с
+числом страниц.
+
+Дедлайн документа общий: на свод оставляется DOCUMENT_REDUCE_SECONDS,
+куски, которые не успели, отменяются, и возвращается частичная сводка
+по готовым кускам (с пометкой, какая часть документа покрыта). Куски
+отправляются попеременно с начала и с конца документа: при нехватке
+времени теряется середина, а не комиссии и условия расторжения в конце.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from cache import make_cache_key
+from logs import get_logger
+from prompts import estimate_tokens
+from retry import Deadline
+
+DOCUMENT_ANALYSIS_MODE = os.getenv("DOCUMENT_ANALYSIS_MODE", "mapreduce")  # mapreduce | truncate
+DOCUMENT_CHUNK_TOKENS = int(os.getenv("DOCUMENT_CHUNK_TOKENS", "3000"))
+DOCUMENT_MAP_CONCURRENCY = int(os.getenv("DOCUMENT_MAP_CONCURRENCY", "4"))
+DOCUMENT_DEADLINE = float(os.getenv("DOCUMENT_DEADLINE", "90"))
+DOCUMENT_REDUCE_SECONDS = float(os.getenv("DOCUMENT_REDUCE_SECONDS", "20"))
+
+ANALYSIS_MODES = ("mapreduce", "truncate")
+
+log = get_logger("summarize")
+
+SUMMARY_SECTIONS = """1. **Document Type**: What kind of document is this? (contract, agreement, terms of service, etc.)
+2. **Main Purpose**: What is the main purpose of this document?
+3. **Key Points**: List 3-5 most important points or conditions
+4. **Important Dates**: Any important dates or deadlines mentioned
+5. **Financial Terms**: Any amounts, fees, interest rates, or financial obligations
+6. **Risks/Warnings**: Any important warnings or risks the user should be aware of
+7. **Action Required**: Does the user need to do anything?"""
+
+SUMMARY_FORMAT = ("Format the response clearly and concisely. If the document is a banking contract, "
+                  "focus on financial terms, obligations, and user rights.")
+
+
+class ChunkFailed(RuntimeError):
+    """Модель не вернула заметки по куску (ошибка API, лимит, таймаут)"""
+
+
+def analysis_prompt(filename, text):
+    """Промпт анализа документа целиком (документ помещается в один кусок)"""
+    return f"""Analyze this document and provide a brief summary in the user's language.
+
+Document: {filename}
+
+Content:
+{text}
+
+Please provide:
+{SUMMARY_SECTIONS}
+
+{SUMMARY_FORMAT}"""
+
+
+def map_prompt(filename, text, number, total):
+    """Промпт для одного куска: заметки по тем же 7 разделам, только факты из куска"""
+    return f"""This is part {number} of {total} of the document "{filename}".
+Extract notes from this part only, under the headings below. Quote exact amounts, fees,
+interest rates, dates and deadlines. Write "none" under a heading if this part has nothing for it.
+
+Part {number} of {total}:
+{text}
+
+Headings:
+{SUMMARY_SECTIONS}"""
+
+
+def reduce_prompt(filename, notes, total):
+    """Промпт свода: заметки по кускам -> одна сводка из 7 разделов"""
+    parts = "\n\n".join(f"--- Part {number} of {total} ---\n{note}" for number, note in notes)
+    missing = total - len(notes)
+    coverage = (f"\nNotes for {missing} of {total} parts are missing (not analyzed in time); "
+                f"mention that the summary may be incomplete.\n" if missing else "")
+    return f"""Below are notes extracted from consecutive parts of the document "{filename}".
+Merge them into one brief summary of the whole document in the user's language.
+Keep every amount, fee, rate, date and termination condition from the notes; drop duplicates and "none".
+{coverage}
+{parts}
+
+Please provide:
+{SUMMARY_SECTIONS}
+
+{SUMMARY_FORMAT}"""
+
+
+# Версия промптов анализа для ключа кеша сводок: меняется при любой правке шаблонов выше
+DOCUMENT_PROMPT_VERSION = make_cache_key(analysis_prompt("", ""), map_prompt("", "", 0, 0),
+                                         reduce_prompt("", [(0, "")], 1), DOCUMENT_CHUNK_TOKENS)[:16]
+
+
+def interleaved_order(count):
+    """Порядок кусков: 1, n, 2, n-1, ... (начало и конец документа - первыми)"""
+    order = []
+    left, right = 0, count - 1
+    while left <= right:
+        order.append(left)
+        if left != right:
+            order.append(right)
+        left, right = left + 1, right - 1
+    return order
+
+
+def split_chunks(text, max_tokens=DOCUMENT_CHUNK_TOKENS):
+    """Режет текст по строкам на куски не больше max_tokens (длинные строки - по символам)"""
+    max_chars = max_tokens * 4
+    chunks, current, current_tokens = [], [], 0
+    for line in text.splitlines():
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or [""]
+        for piece in pieces:
+            tokens = estimate_tokens(piece) + 1
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class DocumentSummarizer:
+    """Map-reduce сводка документа через переданную функцию вызова модели.
+
+    complete(prompt, deadline, page) -> текст ответа; при неудаче бросает ChunkFailed.
+    """
+
+    def __init__(self, complete, concurrency=DOCUMENT_MAP_CONCURRENCY, chunk_tokens=DOCUMENT_CHUNK_TOKENS,
+                 reduce_seconds=DOCUMENT_REDUCE_SECONDS):
+        self.complete = complete
+        self.concurrency = max(1, concurrency)
+        self.chunk_tokens = chunk_tokens
+        self.reduce_seconds = reduce_seconds
+        # Общий пул: лимит параллельных запросов к модели на все документы сразу
+        self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="doc-map")
+        self._lock = threading.Lock()
+        self._stats = {"documents": 0, "chunks": 0, "chunks_done": 0, "chunks_failed": 0,
+                       "chunks_skipped": 0, "partial": 0}
+
+    def summarize(self, filename, text, deadline=None, page=None):
+        """Сводка документа; возвращает словарь с summary и счетчиками кусков.
+
+        Бросает ChunkFailed, только если не удалось разобрать ни одного куска.
+        """
+        deadline = deadline or Deadline(DOCUMENT_DEADLINE)
+        chunks = split_chunks(text, self.chunk_tokens)
+        total = len(chunks)
+        info = {"mode": "mapreduce", "chunks": total, "chunks_done": 0, "partial": False}
+
+        if total <= 1:
+            summary = self.complete(analysis_prompt(filename, text), deadline, page)
+            info["chunks_done"] = total
+            self._count(info, 0, 0)
+            return dict(info, summary=summary, map_ms=0.0, reduce_ms=0.0)
+
+        start = time.perf_counter()
+        notes, failed, skipped = self._map(filename, chunks, deadline, page)
+        map_ms = (time.perf_counter() - start) * 1000
+        info["chunks_done"] = len(notes)
+        info["partial"] = len(notes) < total
+        self._count(info, failed, skipped)
+        if not notes:
+            raise ChunkFailed(f"Не удалось разобрать ни одного из {total} фрагментов документа")
+
+        start = time.perf_counter()
+        summary = self._reduce(filename, notes, total, deadline, page)
+        reduce_ms = (time.perf_counter() - start) * 1000
+        return dict(info, summary=summary, map_ms=round(map_ms, 1), reduce_ms=round(reduce_ms, 1))
+
+    def _map(self, filename, chunks, deadline, page):
+        # На свод оставляем reduce_seconds (но не больше половины оставшегося времени)
+        map_budget = deadline.remaining() - min(self.reduce_seconds, deadline.remaining() / 2)
+        map_deadline = Deadline(max(0.0, map_budget))
+        total = len(chunks)
+        futures = {}
+        for index in interleaved_order(total):
+            prompt = map_prompt(filename, chunks[index], index + 1, total)
+            futures[self._pool.submit(self._map_chunk, prompt, map_deadline, page)] = index + 1
+
+        notes, failed, skipped, pending = [], 0, 0, set(futures)
+        while pending and not map_deadline.expired():
+            done, pending = wait(pending, timeout=map_deadline.remaining(), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    note = future.result()
+                except ChunkFailed as e:
+                    failed += 1
+                    log.warning("Фрагмент документа не обработан", filename=filename, chunk=futures[future],
+                                total=total, error=e)
+                    continue
+                if note is None:
+                    skipped += 1
+                else:
+                    notes.append((futures[future], note))
+        for future in pending:
+            future.cancel()
+        skipped += len(pending)
+        if skipped:
+            log.warning("Дедлайн документа: сводка частичная", filename=filename, done=len(notes), total=total)
+        notes.sort()
+        return notes, failed, skipped
+
+    def _map_chunk(self, prompt, map_deadline, page):
+        # Кусок дождался очереди уже после дедлайна - не тратим на него запрос
+        if map_deadline.expired():
+            return None
+        return self.complete(prompt, map_deadline, page)
+
+    def _reduce(self, filename, notes, total, deadline, page):
+        try:
+            return self.complete(reduce_prompt(filename, notes, total), deadline, page)
+        except ChunkFailed as e:
+            # Свод не удался - отдаем заметки по частям как есть, это лучше, чем ничего
+            log.warning("Свод документа не удался", filename=filename, error=e)
+            parts = "\n\n".join(f"**Part {number}/{total}**\n{note}" for number, note in notes)
+            return f"⚠️ Сводка собрана по частям без объединения ({len(notes)} из {total}).\n\n{parts}"
+
+    def _count(self, info, failed, skipped):
+        with self._lock:
+            self._stats["documents"] += 1
+            self._stats["chunks"] += info["chunks"]
+            self._stats["chunks_done"] += info["chunks_done"]
+            self._stats["chunks_failed"] += failed
+            self._stats["chunks_skipped"] += skipped
+            self._stats["partial"] += int(info["partial"])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, concurrency=self.concurrency, chunk_tokens=self.chunk_tokens)
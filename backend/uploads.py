@@ -0,0 +1,79 @@
+"""Загрузка документов без буферизации целиком в памяти.
+
+Лимит размера проверяется по ходу чтения тела запроса (request.max_content_length):
+как только прочитано больше MAX_DOCUMENT_BYTES, Werkzeug прерывает разбор
+с 413, не дочитывая остальное. Файловая часть multipart пишется сразу во
+временный файл, если тело больше UPLOAD_SPOOL_BYTES (или длина неизвестна),
+иначе в BytesIO. Дальше тот же файловый объект идет в PDF парсер - без
+file.read() и копии в BytesIO. SpooledTemporaryFile не используется: его
+read/seek через Python-обертку почти вдвое замедляют разбор PDF.
+
+Для фоновых задач файл копируется на диск в DOCUMENT_SPOOL_DIR, чтобы
+дожить до обработчика (и до перезапуска).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from flask import Request
+
+MAX_DOCUMENT_BYTES = int(os.getenv("MAX_DOCUMENT_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(512 * 1024)))
+DOCUMENT_SPOOL_DIR = os.getenv("DOCUMENT_SPOOL_DIR", "document_spool")
+
+# Запас на границы multipart и текстовые поля формы сверх размера файла
+MULTIPART_OVERHEAD = 64 * 1024
+READ_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """Файл больше MAX_DOCUMENT_BYTES"""
+
+
+class SpoolingRequest(Request):
+    """Request, который складывает загружаемые файлы больше UPLOAD_SPOOL_BYTES во временный файл"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is None or total_content_length > UPLOAD_SPOOL_BYTES:
+            return tempfile.TemporaryFile("w+b")
+        return BytesIO()
+
+
+def limit_document_upload(request, max_bytes=MAX_DOCUMENT_BYTES):
+    """Ограничивает тело текущего запроса; вызывать до обращения к request.files"""
+    request.max_content_length = max_bytes + MULTIPART_OVERHEAD
+
+
+def hash_upload(stream, max_bytes=MAX_DOCUMENT_BYTES):
+    """SHA-256 и размер загруженного файла чтением по кускам; поток возвращается в начало"""
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(f"Файл больше {max_bytes} байт")
+        digest.update(chunk)
+    stream.seek(0)
+    return size, digest.hexdigest()
+
+
+def persist_upload(stream, directory=DOCUMENT_SPOOL_DIR):
+    """Копирует загруженный файл в directory (по кускам) и возвращает путь"""
+    os.makedirs(directory, exist_ok=True)
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile("wb", dir=directory, prefix="upload-", delete=False) as target:
+        shutil.copyfileobj(stream, target, READ_CHUNK)
+    return target.name
+
+
+def discard_upload(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
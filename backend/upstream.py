@@ -0,0 +1,260 @@
+"""Общий клиент к upstream LLM API (OpenRouter) с пулом соединений.
+
+Все обращения к модели (чат, стриминг, анализ документов) идут через один
+httpx.AsyncClient, который живет в фоновом event loop. Соединения
+переиспользуются (keep-alive, опционально HTTP/2), поэтому TLS handshake
+делается один раз, а не на каждый запрос. Синхронный код Flask отправляет
+корутины в этот цикл и ждет результат, так что много запросов к модели
+могут быть в полете одновременно при небольшом числе воркеров.
+
+Каждая попытка замеряется (metrics.py): время до заголовков ответа,
+полное время и код ответа по модели из тела запроса.
+"""
+import asyncio
+import atexit
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from logs import get_logger
+from metrics import UPSTREAM_RESPONSES, UPSTREAM_RETRIES, UPSTREAM_SECONDS, UPSTREAM_TTFB_SECONDS
+from retry import DeadlineExceeded
+
+log = get_logger("upstream")
+
+# Настройки пула (можно переопределить через .env)
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "16"))
+UPSTREAM_MAX_PER_HOST = int(os.getenv("UPSTREAM_MAX_PER_HOST", "16"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "0").lower() in ("1", "true", "yes")
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "30"))
+
+# Маркер конца потока в очереди между event loop и синхронным генератором
+_END = object()
+
+
+def _model_of(payload):
+    return (payload or {}).get("model") or "unknown"
+
+
+def _record_attempt(model, stream, start, status):
+    """Полное время и код ответа одной попытки (status None - сеть/таймаут)"""
+    UPSTREAM_SECONDS.observe(time.perf_counter() - start, model=model, stream=stream)
+    UPSTREAM_RESPONSES.inc(model=model, status=status if status is not None else "error")
+
+
+def _http2_available():
+    """Проверяет, установлен ли пакет h2 (нужен httpx для HTTP/2)"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class UpstreamClient:
+    """Пул соединений к upstream API с асинхронным API и синхронными обертками"""
+
+    def __init__(self, pool_size=UPSTREAM_POOL_SIZE, max_keepalive=UPSTREAM_MAX_KEEPALIVE,
+                 max_per_host=UPSTREAM_MAX_PER_HOST, http2=UPSTREAM_HTTP2, timeout=UPSTREAM_TIMEOUT):
+        if http2 and not _http2_available():
+            log.warning("UPSTREAM_HTTP2 включен, но пакет h2 не установлен - используем HTTP/1.1")
+            http2 = False
+
+        self.pool_size = pool_size
+        self.max_keepalive = max_keepalive
+        self.max_per_host = max_per_host
+        self.http2 = http2
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._host_slots = {}  # host -> asyncio.Semaphore (используется только внутри loop)
+
+    # ---------- Жизненный цикл ----------
+
+    def _get_loop(self):
+        """Лениво запускает фоновый event loop и AsyncClient (после fork каждый воркер получает свой)"""
+        with self._lock:
+            if self._loop is None or self._thread is None or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="upstream-loop", daemon=True)
+                thread.start()
+                self._loop = loop
+                self._thread = thread
+                self._host_slots = {}
+                self._client = asyncio.run_coroutine_threadsafe(self._create_client(), loop).result()
+            return self._loop
+
+    async def _create_client(self):
+        return httpx.AsyncClient(
+            http2=self.http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=30,
+            ),
+        )
+
+    def close(self):
+        """Закрывает соединения и останавливает фоновый цикл"""
+        with self._lock:
+            loop, client = self._loop, self._client
+            self._loop = self._thread = self._client = None
+        if loop is None:
+            return
+        if client is not None:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _host_slot(self, url):
+        """Семафор, ограничивающий число одновременных запросов к одному хосту"""
+        host = urlsplit(url).netloc
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.max_per_host)
+        return slot
+
+    # ---------- Асинхронный API ----------
+
+    def _attempt_timeout(self, timeout, deadline):
+        timeout = timeout or self.timeout
+        return deadline.timeout(timeout) if deadline is not None else timeout
+
+    async def post(self, url, headers=None, json=None, timeout=None, deadline=None, policy=None):
+        """POST запрос через общий пул с повторами по policy в пределах deadline"""
+        attempt = 0
+        model = _model_of(json)
+        while True:
+            start = time.perf_counter()
+            try:
+                async with self._host_slot(url):
+                    # send(stream=True) + aread: время до заголовков отдельно от чтения тела
+                    request = self._client.build_request("POST", url, headers=headers, json=json,
+                                                         timeout=self._attempt_timeout(timeout, deadline))
+                    response = await self._client.send(request, stream=True)
+                    UPSTREAM_TTFB_SECONDS.observe(time.perf_counter() - start, model=model, stream="0")
+                    try:
+                        await response.aread()
+                    finally:
+                        await response.aclose()
+            except httpx.TimeoutException:
+                _record_attempt(model, "0", start, None)
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceeded(deadline.budget)
+                raise
+            except httpx.TransportError:
+                _record_attempt(model, "0", start, None)
+                raise
+            _record_attempt(model, "0", start, response.status_code)
+
+            delay = policy.delay_for(attempt, response.status_code, response.headers, deadline) if policy else None
+            if delay is None:
+                return response
+            UPSTREAM_RETRIES.inc(model=model, status=response.status_code)
+            log.debug("Повтор запроса к upstream", status=response.status_code, delay=round(delay, 2),
+                      attempt=attempt + 2)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def stream_post(self, url, headers=None, json=None, timeout=None, sink=None,
+                          deadline=None, policy=None):
+        """Стриминговый POST: кладет в sink сначала ответ (статус, заголовки), затем строки тела.
+
+        Повторы возможны только до первого байта тела, пока клиенту еще ничего не отдано.
+        """
+        attempt = 0
+        model = _model_of(json)
+        while True:
+            start = time.perf_counter()
+            status = None
+            try:
+                async with self._host_slot(url):
+                    async with self._client.stream("POST", url, headers=headers, json=json,
+                                                   timeout=self._attempt_timeout(timeout, deadline)) as response:
+                        UPSTREAM_TTFB_SECONDS.observe(time.perf_counter() - start, model=model, stream="1")
+                        status = response.status_code
+                        if response.status_code != 200:
+                            # Тело ошибки небольшое - читаем целиком, чтобы .json()/.text работали
+                            await response.aread()
+                            delay = policy.delay_for(attempt, response.status_code, response.headers, deadline) if policy else None
+                            if delay is None:
+                                sink(response)
+                                return
+                        else:
+                            sink(response)
+                            async for line in response.aiter_lines():
+                                sink(line)
+                            return
+            except httpx.TimeoutException:
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceeded(deadline.budget)
+                raise
+            finally:
+                # Полное время - до конца тела или до отмены (клиент ушел, получив [DONE])
+                _record_attempt(model, "1", start, status)
+
+            UPSTREAM_RETRIES.inc(model=model, status=response.status_code)
+            log.debug("Повтор стримингового запроса к upstream", status=response.status_code,
+                      delay=round(delay, 2), attempt=attempt + 2)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # ---------- Синхронные обертки для Flask ----------
+
+    def run(self, coro):
+        """Выполняет корутину в фоновом цикле и ждет результат из синхронного кода"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    def post_sync(self, url, headers=None, json=None, timeout=None, deadline=None, policy=None):
+        """Синхронный POST через общий пул (паузы между повторами - в фоновом цикле)"""
+        return self.run(self.post(url, headers, json, timeout, deadline, policy))
+
+    def stream_sync(self, url, headers=None, json=None, timeout=None, deadline=None, policy=None):
+        """Синхронный генератор: первым отдает httpx.Response, затем строки тела ответа"""
+        loop = self._get_loop()
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                await self.stream_post(url, headers, json, timeout, sink=items.put,
+                                       deadline=deadline, policy=policy)
+            except BaseException as e:  # Включая CancelledError - поток должен завершиться
+                items.put(e)
+            finally:
+                items.put(_END)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), loop)
+        try:
+            while True:
+                item = items.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Клиент отключился или генератор закрыт раньше - прерываем upstream запрос
+            future.cancel()
+
+    def stats(self):
+        """Текущие настройки пула для /api/health"""
+        return {
+            "pool_size": self.pool_size,
+            "max_keepalive": self.max_keepalive,
+            "max_per_host": self.max_per_host,
+            "http2": self.http2,
+            "timeout": self.timeout,
+        }
+
+
+# Общий клиент для всех вызовов модели в процессе
+upstream_client = UpstreamClient()
+atexit.register(upstream_client.close)
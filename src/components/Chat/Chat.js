@@ -12,6 +12,8 @@ const Chat = forwardRef(({ onBobbyDetected, pendingMessage, shouldOpenChat, isOp
   const { speak } = useSpeech();
   const wsRef = useRef(null);
   const recognizerRef = useRef(null);
+  // Server-side conversation session: history lives on the backend
+  const sessionIdRef = useRef(null);
 
   // Use external isOpen if provided, otherwise use internal state
   const actualIsOpen = externalIsOpen !== undefined ? externalIsOpen : isOpen;
@@ -39,13 +41,16 @@ const Chat = forwardRef(({ onBobbyDetected, pendingMessage, shouldOpenChat, isOp
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ input: messageText })
+        body: JSON.stringify({ input: messageText, session_id: sessionIdRef.current })
       });
 
       const data = await response.json();
+      if (data.session_id) {
+        sessionIdRef.current = data.session_id;
+      }
       const aiMessage = {
         id: Date.now() + 1,
-        text: data.result || 'No response received from AI',
+        text: data.result || data.error || 'No response received from AI',
         sender: 'ai'
       };
 